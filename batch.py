@@ -0,0 +1,441 @@
+"""
+Batch Executor
+Runs one ladder program across many simulated machine instances at once.
+
+Every tag becomes a NumPy column with one element per instance, and each
+instruction is translated into a vectorized operation over those columns.
+One scan of the generated function advances all instances together, so
+the Python overhead is paid once per instruction instead of once per
+instruction per instance (Monte Carlo and what-if runs of identical cells).
+"""
+
+import ast
+import logging
+from functools import reduce
+from typing import Any, Callable, Dict, List
+
+from .tags import AREAS, BOOL, DINT, REAL
+from .compiler import AREA_NAMES, CodeGenerator, timer_runs
+from .instructions import (XIC, XIO, AFI, Branch, OTE, OTL, OTU, OSR, TON, TOF, Counter,
+                           Compare, LIM, MOV, Math, DIV, CPT, COP, FLL, MATH_ERRORS,
+                           timers)
+
+logger = logging.getLogger(__name__)
+
+# NumPy is only needed for batch simulation
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+
+class VectorCodeGenerator(CodeGenerator):
+    """
+    Code generator for the batch executor.
+    Tag references index a row of a 2-D (tags x instances) array, so
+    every expression evaluates to a column across all instances.
+    """
+
+    def test(self, tag_name: str) -> str:
+        ref = self.ref(tag_name)
+        if ref.startswith(AREA_NAMES[BOOL]):
+            return ref
+        return f"({ref} != 0)"
+
+    def emit_evaluate(self, instruction) -> None:
+        raise TypeError(f"{type(instruction).__name__} is not supported by the batch executor")
+
+
+# ---------------------------------------------------------------------------
+# Vectorized instruction translations
+# The rung state `s` is a boolean column; it starts as the shared
+# read-only ONES column and every operation below produces a new array,
+# so no rung state ever aliases a tag row.
+# ---------------------------------------------------------------------------
+
+def _emit_xic(inst, gen):
+    gen.line(f"s = s & {gen.test(inst.tag)}")
+
+
+def _emit_xio(inst, gen):
+    gen.line(f"s = s & ~{gen.test(inst.tag)}")
+
+
+def _emit_afi(inst, gen):
+    gen.line("s = s & False")
+
+
+def _emit_branch(inst, gen):
+    incoming, result = gen.temp('b'), gen.temp('t')
+    gen.line(f"{incoming} = s")
+    for k, leg in enumerate(inst.legs):
+        if k:
+            gen.line(f"s = {incoming}")
+        for instruction in leg:
+            _emitter_for(instruction)(instruction, gen)
+        gen.line(f"{result} = s" if k == 0 else f"{result} = {result} | s")
+    gen.line(f"s = {result}" if inst.legs else "s = s & False")
+
+
+def _emit_ote(inst, gen):
+    gen.line(gen.assign(inst.tag, 's'))
+
+
+def _emit_otl(inst, gen):
+    gen.line(f"{gen.ref(inst.tag)} |= s")
+
+
+def _emit_otu(inst, gen):
+    gen.line(f"{gen.ref(inst.tag)} &= ~s")
+
+
+def _emit_osr(inst, gen):
+    gen.lines([
+        f"p = s & ~{gen.test(inst.sb_tag)}",
+        gen.assign(inst.sb_tag, 's'),
+        gen.assign(inst.tag, 'p'),
+        "s = p",
+    ])
+
+
+def _emit_ton(inst, gen):
+    gen.lines([
+        f"n = {gen.get(inst.pre_tag, inst.preset)}",
+        f"a = where(s, {gen.get(inst.acc_tag, 0)}, 0)",
+        "d = s & (a >= n)",
+        gen.assign(inst.acc_tag, 'a'),
+        gen.assign(inst.en_tag, 's'),
+        gen.assign(inst.tt_tag, 's & ~d'),
+        gen.assign(inst.dn_tag, 'd'),
+    ])
+
+
+def _emit_tof(inst, gen):
+    gen.lines([
+        f"n = {gen.get(inst.pre_tag, inst.preset)}",
+        f"a = {gen.get(inst.acc_tag, 0)}",
+        f"t = {gen.test(inst.tt_tag)}",
+        f"u = ~s & {gen.test(inst.dn_tag)}",
+        "d = a < n",
+        gen.assign(inst.acc_tag, "where(s, 0, a)"),
+        gen.assign(inst.tt_tag, "where(s, False, where(u, d, t))"),
+        gen.assign(inst.dn_tag, "s | (u & d)"),
+        gen.assign(inst.en_tag, 's'),
+    ])
+
+
+def _advance_ton(rows, B):
+    return f"{B}[{rows['TT']}] & (a < n)"
+
+
+def _advance_tof(rows, B):
+    return f"{B}[{rows['TT']}] & {B}[{rows['DN']}] & (a < n)"
+
+
+def _emit_counter(inst, gen):
+    code = [
+        f"a = {gen.get(inst.acc_tag, 0)} + (s & ~{gen.test(inst.edge_tag)}) * {inst.step}",
+    ]
+    if inst.reset_tag:
+        code.append(f"a = where({gen.test(inst.reset_tag)}, 0, a)")
+    code += [
+        gen.assign(inst.edge_tag, 's'),
+        gen.assign(inst.acc_tag, 'a'),
+        gen.assign(inst.dn_tag, f"a >= {gen.get(inst.pre_tag, inst.preset)}"),
+    ]
+    gen.lines(code)
+
+
+# Word instructions: a value is stored only where the rung is TRUE and
+# the scalar instruction would not have failed (see MATH_ERRORS): no
+# zero divisor, and for a DINT, a finite value in range. Integer results
+# wrap around on int64 overflow instead.
+
+_DINT_RANGE = "(abs({}) < 2.0 ** 63)"
+
+
+def _emit_store(gen, tag_name: str, value: str, integral: bool, guards: List[str] = ()) -> None:
+    data_type = gen.tags.slot(tag_name)[0]
+    conditions = ['s', *guards]
+    code = []
+    if data_type == BOOL:
+        value = f"({value}) != 0"
+    elif data_type == DINT and not integral:
+        code.append(f"v = {value}")
+        value = 'v'
+        conditions.append(_DINT_RANGE.format('v'))
+    code.append(f"put({gen.ref(tag_name)}, {value}, where={' & '.join(conditions)}, "
+                f"casting='unsafe')")
+    _emit_ignoring_errors(gen, code)
+
+
+def _emit_ignoring_errors(gen, code: List[str]) -> None:
+    gen.line("with errstate(all='ignore'):")
+    gen.lines([f"    {line}" for line in code])
+
+
+def _emit_compare(inst, gen):
+    gen.line(f"s = s & ({gen.operand(inst.source_a)} {inst.symbol} {gen.operand(inst.source_b)})")
+
+
+def _emit_lim(inst, gen):
+    low, test, high = (gen.operand(operand) for operand in (inst.low, inst.test, inst.high))
+    gen.line(f"s = s & ((({low} <= {high}) & ({low} <= {test}) & ({test} <= {high})) | "
+             f"(({low} > {high}) & (({test} >= {low}) | ({test} <= {high}))))")
+
+
+def _emit_folded(gen, tag_name: str, compute: Callable[[], Any]) -> None:
+    """
+    Store the result of a word operation on constants only. Python, not
+    NumPy, would evaluate it in the scan (raising on 1 / 0, or on ints
+    beyond int64), so it is evaluated here as the scalar instruction
+    does: no store if that fails.
+    """
+    try:
+        value = compute()
+        if isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63:
+            if gen.tags.slot(tag_name)[0] == DINT:
+                return
+            value = float(value)
+    except MATH_ERRORS:
+        return
+    literal = repr(value) if isinstance(value, int) else f"f64({repr(value)!r})"
+    _emit_store(gen, tag_name, literal, isinstance(value, int))
+
+
+def _emit_mov(inst, gen):
+    if not isinstance(inst.source, str):
+        _emit_folded(gen, inst.tag, lambda: inst.source)
+        return
+    _emit_store(gen, inst.tag, gen.operand(inst.source), gen.integral(inst.source))
+
+
+def _emit_math(inst, gen):
+    if not isinstance(inst.source_a, str) and not isinstance(inst.source_b, str):
+        _emit_folded(gen, inst.tag, lambda: inst.function(inst.source_a, inst.source_b))
+        return
+    value = f"{gen.operand(inst.source_a)} {inst.symbol} {gen.operand(inst.source_b)}"
+    _emit_store(gen, inst.tag, value, inst.integral(gen))
+
+
+def _emit_div(inst, gen):
+    if not isinstance(inst.source_a, str) and not isinstance(inst.source_b, str):
+        _emit_math(inst, gen)
+        return
+    divisor = gen.operand(inst.source_b)
+    _emit_store(gen, inst.tag, f"{gen.operand(inst.source_a)} / {divisor}", False,
+                [f"({divisor} != 0)"])
+
+
+def _zero_constant(inst, node) -> bool:
+    """True if a CPT subexpression uses no tags and evaluates to 0 (or fails to evaluate)"""
+    if any(isinstance(child, (ast.Name, ast.Attribute, ast.Subscript)) for child in ast.walk(node)):
+        return False
+    try:
+        return eval(inst.render(str, None, node), {'__builtins__': {}, 'abs': abs,
+                                                   'min': min, 'max': max}) == 0
+    except MATH_ERRORS:
+        return True
+
+
+def _emit_cpt(inst, gen):
+    if not inst.sources:
+        _emit_folded(gen, inst.tag, lambda: inst.function([]))
+        return
+    functions = {'min': 'vmin', 'max': 'vmax'}
+    ref = lambda tag_name: gen.get(tag_name, 0)
+    divisions = [node for node in ast.walk(inst.tree)
+                 if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Div)]
+    if any(_zero_constant(inst, node.right) for node in divisions):
+        # The scalar instruction always fails on a constant zero divisor
+        return
+    divisors = [inst.render(ref, functions, node.right) for node in divisions]
+    integral = not inst.divides and gen.integral(*inst.sources, *inst.constants)
+    _emit_store(gen, inst.tag, inst.render(ref, functions), integral,
+                [f"({divisor} != 0)" for divisor in divisors])
+
+
+def _emit_cop(inst, gen):
+    source_type, source = gen.block(inst.source, inst.length)
+    data_type, target = gen.block(inst.tag, inst.length)
+    condition = 's'
+    if data_type == BOOL and source_type != BOOL:
+        source = f"{source} != 0"
+    elif data_type == DINT and source_type == REAL:
+        condition = f"s & {_DINT_RANGE.format(source)}.all(axis=0)"
+    _emit_ignoring_errors(gen, [f"put({target}, {source}, where={condition}, casting='unsafe')"])
+
+
+def _emit_fll(inst, gen):
+    data_type, target = gen.block(inst.tag, inst.length)
+    value, condition = gen.operand(inst.source), 's'
+    if isinstance(inst.source, int) and not -2 ** 63 <= inst.source < 2 ** 63:
+        # Beyond int64 (see _emit_folded)
+        if data_type == DINT:
+            return
+        value = repr(float(inst.source))
+    if data_type == BOOL:
+        value = f"({value}) != 0"
+    elif data_type == DINT and not gen.integral(inst.source):
+        condition = f"s & {_DINT_RANGE.format(value)}"
+    _emit_ignoring_errors(gen, [f"put({target}, {value}, where={condition}, casting='unsafe')"])
+
+
+def _minimum(*values):
+    return reduce(np.minimum, values)
+
+
+def _maximum(*values):
+    return reduce(np.maximum, values)
+
+
+VECTOR_EMITTERS: Dict[type, Callable] = {
+    XIC: _emit_xic,
+    XIO: _emit_xio,
+    AFI: _emit_afi,
+    Branch: _emit_branch,
+    OTE: _emit_ote,
+    OTL: _emit_otl,
+    OTU: _emit_otu,
+    OSR: _emit_osr,
+    TON: _emit_ton,
+    TOF: _emit_tof,
+    Counter: _emit_counter,
+    Compare: _emit_compare,
+    LIM: _emit_lim,
+    MOV: _emit_mov,
+    Math: _emit_math,
+    DIV: _emit_div,
+    CPT: _emit_cpt,
+    COP: _emit_cop,
+    FLL: _emit_fll,
+}
+
+
+# Timer advance pass: rows of a run of timers that are timing
+ADVANCE_SELECTORS: Dict[type, Callable] = {
+    TON: _advance_ton,
+    TOF: _advance_tof,
+}
+
+
+def _emit_advance(gen, rungs) -> None:
+    """
+    Timer advance pass (see Timer): one vectorized update per run of
+    consecutive timer structures, covering all its timers and instances
+    """
+    runs = timer_runs(timers(rungs), gen.tags)
+    if not runs:
+        return
+    B, I = AREA_NAMES[BOOL], AREA_NAMES[DINT]
+    gen.line("if dt:")
+    for cls, first, count in runs:
+        rows = {member: f"{index}:{index + count}" for member, index in first.items()}
+        gen.lines([
+            f"    a = {I}[{rows['ACC']}]; n = {I}[{rows['PRE']}]",
+            f"    {I}[{rows['ACC']}] = where({ADVANCE_SELECTORS[cls](rows, B)}, "
+            f"minimum(a + dt, n), a)",
+        ])
+
+
+def _emitter_for(instruction) -> Callable:
+    for cls in type(instruction).__mro__:
+        if cls in VECTOR_EMITTERS:
+            return VECTOR_EMITTERS[cls]
+    raise TypeError(f"{type(instruction).__name__} is not supported by the batch executor")
+
+
+class BatchExecutor:
+    """
+    Evaluates N instances of a LadderProgram in lock-step.
+
+    Tag storage mirrors the program's slot layout with one column per
+    instance: B is (bool tags x N), I is (DINT tags x N) and R is
+    (REAL tags x N). All instances start from the program's current
+    tag values.
+
+    Usage:
+        batch = BatchExecutor(program, instances=10000)
+        batch.set('START_BTN', np.random.rand(10000) < 0.5)
+        batch.run(scans=200, dt_ms=50)
+        running = batch.get('MOTOR_RUN')
+    """
+
+    DTYPES = {BOOL: 'bool', DINT: 'int64', REAL: 'float64'}
+
+    def __init__(self, program, instances: int):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("NumPy is required for the batch executor")
+
+        self.program = program
+        self.instances = instances
+        self.tags = program.tags
+        self.scan_count = 0
+
+        program.declare_tags()
+        self.scan_function = self._compile()
+
+        # One row per tag slot, one column per instance
+        self.areas: Dict[str, Any] = {}
+        for area in AREAS:
+            values = np.array(self.tags.areas[area], dtype=self.DTYPES[area])
+            self.areas[area] = np.repeat(values[:, None], instances, axis=1)
+
+        logger.info(f"Batch executor ready: {len(program.rungs)} rungs x {instances} instances")
+
+    def _compile(self) -> Callable:
+        gen = VectorCodeGenerator(self.tags)
+        areas = ', '.join(AREA_NAMES[area] for area in AREAS)
+        gen.source.append(f"def batch_scan(dt, {areas}):")
+        _emit_advance(gen, self.program.rungs)
+
+        for rung in self.program.rungs:
+            gen.line(f"# rung {rung.rung_id}")
+            gen.line("s = ONES")
+            for instruction in rung.instructions:
+                _emitter_for(instruction)(instruction, gen)
+
+        gen.line("return None")
+
+        ones = np.ones(self.instances, dtype=bool)
+        ones.flags.writeable = False
+        namespace = dict(gen.namespace, ONES=ones, where=np.where, minimum=np.minimum,
+                         put=np.copyto, errstate=np.errstate, vmin=_minimum, vmax=_maximum,
+                         f64=np.float64)
+        source = '\n'.join(gen.source) + '\n'
+        exec(compile(source, '<ladder:batch_scan>', 'exec'), namespace)
+        function = namespace['batch_scan']
+        function.source = source
+        return function
+
+    def _row(self, tag_name: str):
+        slot = self.tags.slot(tag_name)
+        if slot is None:
+            raise KeyError(f"Unknown tag: {tag_name}")
+        data_type, index = slot
+        return self.areas[data_type][index]
+
+    def get(self, tag_name: str):
+        """Column of a tag's value across all instances (a live view)"""
+        return self._row(tag_name)
+
+    def set(self, tag_name: str, values) -> None:
+        """Set a tag for all instances (scalar or one value per instance)"""
+        self._row(tag_name)[:] = values
+
+    def scan(self, dt_ms: int = 0) -> None:
+        """Run one scan of every instance; timers advance by dt_ms"""
+        areas = self.areas
+        self.scan_function(dt_ms, *[areas[area] for area in AREAS])
+        self.scan_count += 1
+
+    def run(self, scans: int, dt_ms: int = 0, on_scan: Callable = None) -> None:
+        """
+        Run a number of scans. on_scan(executor, scan_number) is called
+        before each scan so scripts can drive inputs.
+        """
+        for scan_number in range(scans):
+            if on_scan:
+                on_scan(self, scan_number)
+            self.scan(dt_ms)
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Pi Ladder Logic - Benchmark Suite
+
+Generates synthetic ladder programs (load_from_json format) and measures,
+per execution mode:
+    - program load time (from JSON and from the program cache)
+    - scans/sec and scan latency distribution
+    - tag operations per scan (instruction tag reads + writes)
+    - memory (allocation peak while loading, tag storage size)
+and the GPIOManager input/output cycle on the simulated backend.
+
+Results are written as JSON. Scan metrics are the median of --repeat
+runs. With --baseline, results are compared with a previous result file
+run with the same parameters (exit status 2 otherwise): the exit status
+is 1 if scan throughput or median latency regressed by more than
+--threshold percent. Other metrics (mean and tail latency, load times,
+memory, GPIO) are noisier and only reported.
+
+    python3 benchmark.py --rungs 1000 --scans 2000 --output bench.json
+    python3 benchmark.py --baseline bench.json --threshold 10
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import statistics
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List
+
+# Add core modules to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from core.runtime import LadderProgram
+from core.stats import LatencyHistogram
+from io.gpio_backends import SimulatedBackend
+from io.gpio_manager import GPIOManager
+
+CONTACTS = ('XIC', 'XIO')
+COILS = ('OTE', 'OTL', 'OTU', 'OSR')
+
+# Metrics compared with a baseline: name -> True if larger is better.
+# Only GATED metrics fail the run; INFORMATIONAL ones (a single slow scan
+# or load moves them) are reported. min/max latency are not compared.
+GATED = {'scans_per_sec': True, 'tag_ops_per_sec': True, 'p50_ms': False}
+INFORMATIONAL = {
+    'mean_ms': False, 'p95_ms': False, 'p99_ms': False,
+    'load_json_ms': False, 'load_cache_ms': False, 'load_peak_kb': False,
+    'read_inputs_mean_us': False, 'write_outputs_mean_us': False,
+}
+
+
+def generate_program(rungs: int = 1000, contacts: int = 3, timer_density: float = 0.1,
+                     counter_density: float = 0.05, fan_out: float = 3.0,
+                     coil_mix: Dict[str, float] = None, seed: int = 0) -> Dict:
+    """
+    Synthetic program in load_from_json format.
+
+    rungs            number of rungs
+    contacts         maximum contacts per rung (1..contacts, uniform)
+    timer_density    fraction of rungs ending in a TON/TOF
+    counter_density  fraction of rungs ending in a CTU/CTD
+    fan_out          average number of rungs reading each tag (the
+                     contact tag pool is sized accordingly)
+    coil_mix         relative weights of the other rung outputs
+    """
+    rng = random.Random(seed)
+    coil_mix = coil_mix or {'OTE': 6, 'OTL': 1, 'OTU': 1, 'OSR': 1}
+    coil_types = list(coil_mix)
+    coil_weights = [coil_mix[coil] for coil in coil_types]
+
+    pool = max(1, int(rungs * (1 + contacts) / 2 / fan_out))
+    tag = lambda: f"B{rng.randrange(pool)}"
+
+    program_rungs = []
+    for rung_id in range(rungs):
+        instructions = [{'type': rng.choice(CONTACTS), 'tag': tag()}
+                        for _ in range(rng.randint(1, contacts))]
+        kind = rng.random()
+        if kind < timer_density:
+            instructions.append({'type': rng.choice(('TON', 'TOF')), 'tag': f"TMR{rung_id}",
+                                 'preset': rng.randint(10, 5000)})
+        elif kind < timer_density + counter_density:
+            counter = {'type': rng.choice(('CTU', 'CTD')), 'tag': f"CNT{rung_id}",
+                       'preset': rng.randint(1, 100)}
+            if counter['type'] == 'CTU':
+                counter['reset_tag'] = tag()
+            instructions.append(counter)
+        else:
+            # Outputs feed back into the contact pool
+            coil = rng.choices(coil_types, coil_weights)[0]
+            target = f"OS{rung_id}" if coil == 'OSR' else f"B{rung_id % pool}"
+            instructions.append({'type': coil, 'tag': target})
+        program_rungs.append({'rung_id': rung_id, 'instructions': instructions})
+
+    return {'program_name': f"synthetic_{rungs}", 'scan_time_ms': 10, 'rungs': program_rungs}
+
+
+def tag_operations(program: LadderProgram) -> int:
+    """Tag reads + writes made by one full scan of the program"""
+    return sum(len(instruction.reads()) + len(instruction.writes())
+               for rung in program.rungs for instruction in rung.instructions)
+
+
+def bench_load(program_file: str, mode: str) -> Dict[str, float]:
+    """Load times (ms) from JSON and from the program cache, and load memory"""
+    start = time.perf_counter_ns()
+    program = LadderProgram(mode)
+    program.load_from_json(program_file, use_cache=False)
+    json_ns = time.perf_counter_ns() - start
+    program.close()
+
+    # Separate pass: tracemalloc slows allocation down several times
+    tracemalloc.start()
+    program = LadderProgram(mode)
+    program.load_from_json(program_file, use_cache=False)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    program.close()
+
+    program = LadderProgram(mode)
+    program.load_from_json(program_file)                # writes the cache
+    program.close()
+    start = time.perf_counter_ns()
+    cached = LadderProgram(mode)
+    cached.load_from_json(program_file)
+    cache_ns = time.perf_counter_ns() - start
+    cached.close()
+
+    return {'load_json_ms': json_ns / 1e6, 'load_cache_ms': cache_ns / 1e6,
+            'load_peak_kb': peak / 1024}
+
+
+def bench_scan(program_file: str, mode: str, scans: int, toggle: int, seed: int,
+               workers: int = None) -> Dict[str, float]:
+    """Scan throughput and latency with `toggle` random input changes per scan"""
+    program = LadderProgram(mode, workers)
+    program.load_from_json(program_file, use_cache=False)
+    tags = program.tags
+    inputs = sorted(name for name in tags.slots if name.startswith('B'))
+    rng = random.Random(seed)
+    changes = [[(rng.choice(inputs), rng.random() < 0.5) for _ in range(toggle)]
+               for _ in range(min(scans, 1000))]
+
+    for _ in range(min(100, scans)):           # warm up
+        program.execute_scan()
+
+    histogram = LatencyHistogram()
+    clock = time.perf_counter_ns
+    begin = clock()
+    for scan in range(scans):
+        for tag_name, value in changes[scan % len(changes)]:
+            tags.set(tag_name, value)
+        start = clock()
+        program.execute_scan()
+        histogram.record(clock() - start)
+    elapsed_ns = clock() - begin
+    program.close()
+
+    operations = tag_operations(program)
+    summary = histogram.summary()
+    result = {key: summary[key] for key in summary if key != 'count'}
+    result.update({
+        'scans_per_sec': scans / (elapsed_ns / 1e9),
+        'tag_ops_per_scan': operations,
+        'tag_ops_per_sec': operations * scans / (elapsed_ns / 1e9),
+        'tag_storage_kb': sum(len(area) * getattr(area, 'itemsize', 1)
+                              for area in tags.areas.values()) / 1024,
+    })
+    return result
+
+
+def bench_gpio(points: int, cycles: int) -> Dict[str, float]:
+    """GPIOManager read_inputs + write_outputs on the simulated backend"""
+    config = {
+        'inputs': [{'tag': f"IN{k}", 'pin': k} for k in range(points)],
+        'outputs': [{'tag': f"OUT{k}", 'pin': 1000 + k} for k in range(points)],
+    }
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        json.dump(config, f)
+    try:
+        backend = SimulatedBackend()
+        manager = GPIOManager(f.name, backend=backend)
+    finally:
+        os.unlink(f.name)
+
+    tags = LadderProgram().tags
+    rng = random.Random(0)
+    read, write = LatencyHistogram(), LatencyHistogram()
+    clock = time.perf_counter_ns
+    for cycle in range(cycles):
+        backend.set_level(rng.randrange(points), rng.random() < 0.5)
+        start = clock()
+        manager.read_inputs(tags)
+        middle = clock()
+        tags.set(f"OUT{rng.randrange(points)}", rng.random() < 0.5)
+        manager.write_outputs(tags)
+        read.record(middle - start)
+        write.record(clock() - middle)
+
+    return {'points': points,
+            'read_inputs_mean_us': read.mean_ns / 1e3,
+            'read_inputs_p99_us': read.percentile(99.0) / 1e3,
+            'write_outputs_mean_us': write.mean_ns / 1e3,
+            'write_outputs_p99_us': write.percentile(99.0) / 1e3}
+
+
+def compare(results: Dict, baseline: Dict, threshold: float,
+            metrics: Dict[str, bool] = GATED) -> List[str]:
+    """Of `metrics`, those that are more than threshold % worse than the baseline"""
+    regressions = []
+
+    def walk(current, previous, path):
+        for key, value in current.items():
+            if key not in previous:
+                continue
+            if isinstance(value, dict):
+                walk(value, previous[key], path + [key])
+            elif key in metrics and previous[key]:
+                change = (value - previous[key]) / abs(previous[key]) * 100
+                worse = -change if metrics[key] else change
+                if worse > threshold:
+                    regressions.append(f"{'.'.join(path + [key])}: {previous[key]:.4g} -> "
+                                       f"{value:.4g} ({worse:+.1f}% worse)")
+
+    walk(results['results'], baseline.get('results', {}), [])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pi Ladder Logic benchmark suite')
+    parser.add_argument('--rungs', type=int, default=1000, help='Rungs in the synthetic program')
+    parser.add_argument('--contacts', type=int, default=3, help='Maximum contacts per rung')
+    parser.add_argument('--timers', type=float, default=0.1, help='Fraction of rungs with a timer')
+    parser.add_argument('--counters', type=float, default=0.05,
+                        help='Fraction of rungs with a counter')
+    parser.add_argument('--fan-out', type=float, default=3.0,
+                        help='Average number of rungs reading each tag')
+    parser.add_argument('--scans', type=int, default=2000, help='Scans measured per mode')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per mode: the median scan metrics and best load times '
+                             'are reported (default: 3)')
+    parser.add_argument('--toggle', type=int, default=5, help='Input changes per scan')
+    parser.add_argument('--modes', default='compiled,interpreted,incremental',
+                        help='Comma-separated execution modes (also: parallel)')
+    parser.add_argument('--workers', type=int, help='Workers for the parallel mode')
+    parser.add_argument('--gpio-points', type=int, default=32,
+                        help='Inputs and outputs for the GPIO benchmark (0 to skip)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--baseline', help='Compare with a previous results file')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='Regression threshold in percent (default: 10)')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    parameters = {key: getattr(args, key) for key in
+                  ('rungs', 'contacts', 'timers', 'counters', 'fan_out', 'scans', 'toggle',
+                   'seed', 'repeat', 'workers', 'gpio_points')}
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        baseline_parameters = baseline.get('meta', {}).get('parameters', {})
+        if baseline_parameters != parameters:
+            differences = ', '.join(
+                f"{key} {baseline_parameters.get(key)!r} -> {parameters.get(key)!r}"
+                for key in sorted(baseline_parameters.keys() | parameters.keys())
+                if baseline_parameters.get(key) != parameters.get(key))
+            print(f"Error: {args.baseline} was run with different parameters ({differences}); "
+                  f"results are not comparable", file=sys.stderr)
+            return 2
+    program = generate_program(args.rungs, args.contacts, args.timers, args.counters,
+                               args.fan_out, seed=args.seed)
+
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'parameters': parameters,
+        },
+        'results': {},
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        program_file = os.path.join(directory, 'synthetic.json')
+        with open(program_file, 'w') as f:
+            json.dump(program, f)
+
+        for mode in args.modes.split(','):
+            print(f"Benchmarking {mode} mode ({args.rungs} rungs, {args.scans} scans)...")
+            loads = [bench_load(program_file, mode) for _ in range(args.repeat)]
+            result = {key: min(load[key] for load in loads) for key in loads[0]}
+            scans = [bench_scan(program_file, mode, args.scans, args.toggle, args.seed, args.workers)
+                     for _ in range(args.repeat)]
+            result.update({key: statistics.median(run[key] for run in scans) for key in scans[0]})
+            results['results'][mode] = result
+            print(f"  {result['scans_per_sec']:.0f} scans/s, "
+                  f"p50 {result['p50_ms']:.3f} ms, p99 {result['p99_ms']:.3f} ms, "
+                  f"load {result['load_json_ms']:.1f} ms (cached {result['load_cache_ms']:.1f} ms)")
+
+    if args.gpio_points:
+        print(f"Benchmarking GPIO ({args.gpio_points} inputs/outputs)...")
+        results['results']['gpio'] = bench_gpio(args.gpio_points, max(args.scans, 1000))
+        gpio = results['results']['gpio']
+        print(f"  read {gpio['read_inputs_mean_us']:.1f} us, "
+              f"write {gpio['write_outputs_mean_us']:.1f} us")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if baseline is not None:
+        changes = compare(results, baseline, args.threshold, INFORMATIONAL)
+        if changes:
+            print(f"\nWorse by > {args.threshold:g}% (informational, not gated):")
+            for change in changes:
+                print(f"  {change}")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressions (> {args.threshold:g}%):")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regressions against {args.baseline}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,349 @@
+"""
+Ladder Program Compiler
+Translates loaded rungs into straight-line Python functions so the
+scan does not pay per-instruction dispatch and tag lookup overhead.
+Contacts and branches are compiled into optimized boolean expressions
+(see logic.py).
+"""
+
+import marshal
+import logging
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Tuple
+
+from .tags import TagDatabase, AREAS, BOOL, DINT, REAL, infer_type
+from .instructions import timers
+from . import logic
+
+logger = logging.getLogger(__name__)
+
+
+# Local names the storage areas are bound to inside generated code
+AREA_NAMES = {area: name for area, name in zip(AREAS, ('B', 'I', 'R'))}
+
+# Threads currently inside background_compile()
+_background = threading.local()
+
+
+@contextmanager
+def background_compile():
+    """
+    Compile scan functions in a forked child process within this block
+    (on the calling thread). compile() holds the GIL for the whole call,
+    about 0.1s per 1000 rungs, which would stall a running scan thread.
+    """
+    _background.active = True
+    try:
+        yield
+    finally:
+        _background.active = False
+
+
+def _compile_child(source: str, filename: str, connection) -> None:
+    try:
+        data = marshal.dumps(compile(source, filename, 'exec'))
+    except Exception:
+        data = b''
+    connection.send_bytes(data)
+
+
+def compile_source(source: str, name: str):
+    """Bytecode for generated source (in a child process inside background_compile())"""
+    filename = f"<ladder:{name}>"
+    if not getattr(_background, 'active', False):
+        return compile(source, filename, 'exec')
+
+    context = multiprocessing.get_context('fork')
+    parent, child = context.Pipe(duplex=False)
+    process = context.Process(target=_compile_child, args=(source, filename, child), daemon=True)
+    process.start()
+    child.close()
+    try:
+        data = parent.recv_bytes()
+    except EOFError:
+        data = b''
+    finally:
+        parent.close()
+        process.join()
+    if not data:
+        # Report the error from compiling here
+        return compile(source, filename, 'exec')
+    return marshal.loads(data)
+
+
+class CodeGenerator:
+    """
+    Collects generated source for one scan function.
+    Instructions call back into this object from their emit() method
+    to read/write tags and append lines; the local `s` holds the rung
+    state and `dt` the timer time base for the current scan.
+
+    Tag references are resolved to storage slots at generation time,
+    so the generated code only indexes the typed storage areas.
+
+    With `optimize`, instruction sequences are emitted through rung
+    plans (logic.py); otherwise every instruction emits its own code
+    (needed when instrumenting each instruction).
+    """
+
+    def __init__(self, tags: TagDatabase, optimize: bool = True):
+        self.tags = tags
+        self.optimize = optimize
+        self.source: List[str] = []
+        self.namespace: Dict[str, Any] = {}
+        self.indent = '    '
+        self.fallbacks = 0
+        self.temps = 0
+
+    # -- tag access -------------------------------------------------------
+
+    def ref(self, tag_name: str, default: Any = False) -> str:
+        """Storage reference (e.g. B[12]) for a tag, allocating it if needed"""
+        slot = self.tags.slot(tag_name)
+        if slot is None:
+            slot = self.tags.allocate(tag_name, infer_type(default), default)
+        data_type, index = slot
+        return f"{AREA_NAMES[data_type]}[{index}]"
+
+    def get(self, tag_name: str, default: Any = False) -> str:
+        """Expression reading a tag value"""
+        return self.ref(tag_name, default)
+
+    def test(self, tag_name: str) -> str:
+        """Expression reading a tag as a boolean"""
+        return f"{self.ref(tag_name)} != 0"
+
+    def truth(self, tag_name: str, negated: bool = False) -> str:
+        """
+        Expression testing a tag inside a boolean expression; BOOL
+        storage holds 0/1, so it is used directly
+        """
+        ref = self.ref(tag_name)
+        if ref.startswith(AREA_NAMES[BOOL] + '['):
+            return f"not {ref}" if negated else ref
+        return f"{ref} == 0" if negated else f"{ref} != 0"
+
+    def assign(self, tag_name: str, expr: str) -> str:
+        """Statement writing an expression to a tag"""
+        return f"{self.ref(tag_name)} = {expr}"
+
+    def operand(self, value: Any) -> str:
+        """Expression for a word instruction operand: a tag (DINT if new) or a number"""
+        if isinstance(value, str):
+            return self.get(value, 0)
+        return repr(value)
+
+    def integral(self, *operands: Any) -> bool:
+        """True if every operand is an integer constant or a BOOL/DINT tag"""
+        return all(self.tags.slot(value)[0] != REAL if isinstance(value, str)
+                   else isinstance(value, int) for value in operands)
+
+    def store(self, tag_name: str, expr: str, integral: bool = False) -> str:
+        """
+        Statement writing a number to a tag, converted like
+        TagDatabase.set: truncated for DINT (unless the expression is
+        `integral`), != 0 for BOOL
+        """
+        data_type = self.tags.slot(tag_name)[0]
+        if data_type == BOOL:
+            expr = f"({expr}) != 0"
+        elif data_type == DINT and not integral:
+            expr = f"int({expr})"
+        return self.assign(tag_name, expr)
+
+    def block(self, tag_name: str, length: int) -> Tuple[str, str]:
+        """
+        (data type, slice, e.g. I[40:50]) of `length` consecutive array
+        elements from `tag_name` (see TagDatabase.block)
+        """
+        data_type, index = self.tags.block(tag_name, length)
+        return data_type, f"{AREA_NAMES[data_type]}[{index}:{index + length}]"
+
+    @staticmethod
+    def block_value(data_type: str, expr: str, source_type: str) -> str:
+        """Expression converting a block of `source_type` values for a `data_type` block"""
+        if source_type == data_type:
+            return expr
+        if data_type == BOOL:
+            return f"bytes(map(bool, {expr}))"
+        if data_type == DINT:
+            return f"array('q', map(int, {expr}))"
+        return f"array('d', map(float, {expr}))"
+
+    @staticmethod
+    def fill_value(data_type: str, expr: str, length: int, integral: bool = False) -> str:
+        """Expression for a `data_type` block of `length` copies of a number"""
+        if data_type == BOOL:
+            return f"bytes((({expr}) != 0,)) * {length}"
+        if data_type == DINT:
+            return f"array('q', ({expr if integral else f'int({expr})'},)) * {length}"
+        return f"array('d', ({expr},)) * {length}"
+
+    @staticmethod
+    def write_block(target: str, expr: str) -> List[str]:
+        """Statements assigning a block expression to a block slice"""
+        code = ["from array import array"] if "array(" in expr else []
+        return code + [f"{target} = {expr}"]
+
+    # -- source building --------------------------------------------------
+
+    def line(self, code: str) -> None:
+        self.source.append(self.indent + code)
+
+    def lines(self, code: List[str]) -> None:
+        for line in code:
+            self.line(line)
+
+    def temp(self, prefix: str) -> str:
+        """A new local variable name"""
+        self.temps += 1
+        return f"{prefix}{self.temps}"
+
+    def emit_instructions(self, instructions: List) -> None:
+        """Emit a sequence of instructions continuing from the current rung state"""
+        if self.optimize:
+            logic.emit_steps(self, logic.plan(instructions))
+        else:
+            for instruction in instructions:
+                instruction.emit(self)
+
+    def emit_timers(self, rungs: List) -> None:
+        """
+        Timer advance pass, in front of the first rung: add dt to the
+        accumulator of each of the rungs' timers that is timing (see
+        Timer). Timers whose members occupy consecutive slots (a block,
+        see TagDatabase.allocate_block) are handled together: while few
+        of them are selected, a loop skips to those with bytes.find, so
+        idle timers cost nothing; when many are, the block's ACC slice
+        is rewritten by one comprehension.
+        """
+        runs = timer_runs(timers(rungs), self.tags)
+        if not runs:
+            return
+        B, I = AREA_NAMES[BOOL], AREA_NAMES[DINT]
+        self.line("if dt:")
+        for cls, first, count in runs:
+            select, acc, pre, dn = (first[member] for member in
+                                    (cls.advance_member, 'ACC', 'PRE', 'DN'))
+            if count == 1:
+                self.line(f"    if {B}[{select}]:")
+                self.line(f"        x = {I}[{acc}]; p = {I}[{pre}]")
+                self.line(f"        {I}[{acc}] = {cls.advance_value('x', 'p', f'{B}[{dn}]')}")
+                continue
+            dense = cls.advance_value('x', 'p', 'd', 'dt * e')
+            sparse = cls.advance_value('x', 'p', f'{B}[{dn} + k]')
+            self.lines([
+                f"    t = bytes({B}[{select}:{select + count}])",
+                f"    if t.count(1) * 4 > {count}:",
+                "        from array import array",
+                f"        {I}[{acc}:{acc + count}] = array('q', [{dense} for e, x, p, d in "
+                f"zip(t, {I}[{acc}:{acc + count}], {I}[{pre}:{pre + count}], {B}[{dn}:{dn + count}])])",
+                "    else:",
+                "        k = t.find(1)",
+                "        while k >= 0:",
+                f"            x = {I}[{acc} + k]; p = {I}[{pre} + k]",
+                f"            {I}[{acc} + k] = {sparse}",
+                "            k = t.find(1, k + 1)",
+            ])
+
+    def constant(self, value: Any) -> str:
+        """Bind a Python object into the generated function's globals"""
+        name = f"_K{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def emit_evaluate(self, instruction) -> None:
+        """Fallback: call the instruction's interpreter implementation"""
+        self.fallbacks += 1
+        self.line("tags.delta_ms = dt")
+        self.line(f"s = {self.constant(instruction)}.evaluate(tags, s)")
+
+
+def timer_runs(timer_list: List, tags: TagDatabase) -> List:
+    """
+    Group timers into runs of one class whose structures are
+    consecutive in every member: (class, first slot index per member,
+    count). Timers are allocated (if needed) first.
+    """
+    slots = []
+    for timer in timer_list:
+        timer.declare(tags)
+        slots.append((type(timer).__name__, tags.slot(timer.en_tag)[1], type(timer),
+                      {member: tags.slot(f"{timer.tag}.{member}")[1]
+                       for member, _ in timer.members}))
+
+    runs = []
+    for _, _, cls, first in sorted(slots, key=lambda slot: slot[:2]):
+        if runs:
+            run_cls, run_first, count = runs[-1]
+            if run_cls is cls and all(first[member] == run_first[member] + count
+                                      for member in first):
+                runs[-1] = (run_cls, run_first, count + 1)
+                continue
+        runs.append((cls, first, 1))
+    return runs
+
+
+class ProgramCompiler:
+    """
+    Compiles a list of rungs into a single scan function:
+
+        scan(tags, dt, B, I, R)
+
+    where B/I/R are the BOOL/DINT/REAL storage areas of `tags` and dt is
+    the timer time base (ms). Rung execution order and semantics are
+    identical to LadderProgram.execute_rungs (timer advance pass, then
+    Rung.execute for each rung).
+    """
+
+    def __init__(self, generator_class=CodeGenerator):
+        self.generator_class = generator_class
+
+    @staticmethod
+    def signature(name: str) -> str:
+        areas = ', '.join(AREA_NAMES[area] for area in AREAS)
+        return f"def {name}(tags, dt, {areas}):"
+
+    def generate(self, rungs: List, tags: TagDatabase, name: str = 'scan',
+                 instrument=None) -> CodeGenerator:
+        """
+        Generate source for the given rungs (for inspection or compile).
+        `instrument` (e.g. a ScanProfiler) may emit extra code around
+        each rung and instruction.
+        """
+        gen = self.generator_class(tags, optimize=instrument is None)
+        gen.source.append(self.signature(name))
+        gen.emit_timers(rungs)
+
+        if instrument is None:
+            for rung, steps in zip(rungs, logic.plan_rungs(rungs)):
+                gen.line(f"# rung {rung.rung_id}")
+                logic.emit_rung(gen, steps)
+
+        else:
+            # Instruction by instruction, so each can be timed
+            for r, rung in enumerate(rungs):
+                gen.line(f"# rung {rung.rung_id}")
+                instrument.emit_rung_start(gen, r)
+                gen.line("s = True")
+                for instruction in rung.instructions:
+                    instruction.emit(gen)
+                    instrument.emit_instruction_end(gen, instruction)
+                instrument.emit_rung_end(gen, r)
+
+        gen.line("return None")
+        return gen
+
+    def compile(self, rungs: List, tags: TagDatabase, name: str = 'scan',
+                instrument=None) -> Callable:
+        """Compile rungs into a callable scan function"""
+        gen = self.generate(rungs, tags, name, instrument)
+        source = '\n'.join(gen.source) + '\n'
+        namespace = dict(gen.namespace)
+        exec(compile_source(source, name), namespace)
+        function = namespace[name]
+        function.source = source
+        logger.debug(f"Compiled {len(rungs)} rungs into {len(gen.source)} lines")
+        return function
@@ -0,0 +1,175 @@
+"""
+Shared test helpers: generated ladder programs, and running one program
+in several execution modes in lock-step on a virtual clock.
+"""
+
+import json
+import math
+import random
+from typing import Dict, List
+
+import pytest
+
+from .runtime import LadderProgram
+from .scheduler import Timebase, VirtualClock
+
+SCAN_MS = 10
+EXAMPLES = ('blink.json', 'traffic_light.json', 'start_stop_motor.json')
+
+INPUT_BITS = [f"X{k}" for k in range(6)]
+BITS = [f"B{k}" for k in range(5)]
+DINTS = [f"D{k}" for k in range(5)]
+REALS = [f"R{k}" for k in range(3)]
+TIMERS = {'T0': ('TON', 30), 'T1': ('TON', 120), 'T2': ('TOF', 50)}
+COUNTERS = {'C0': 3, 'C1': 5}
+ARRAY_SIZE = 8
+EXPRESSIONS = ("({p}D0 - {p}D1) * 2 / {p}R0", "ABS({p}R1) + MIN({p}D2, {p}D3, {p}R2)",
+               "MAX({p}D4, 3) * {p}T0.ACC - 7", "{p}A[3] + {p}F[2] / 4", "-{p}R0 * ({p}D1 + 1)")
+
+
+def _operand(rnd: random.Random, p: str):
+    k = rnd.random()
+    if k < 0.6:
+        return p + rnd.choice(DINTS + REALS + ['T0.ACC', 'C0.ACC', 'A[3]', 'F[2]'])
+    if k < 0.85:
+        return rnd.randint(-5, 5)
+    return rnd.choice([0.5, -2.5, 0, 3.0])
+
+
+def _contact(rnd: random.Random, p: str, one_shots: List[int]) -> Dict:
+    k = rnd.random()
+    if k < 0.5:
+        tag = rnd.choice(INPUT_BITS + [p + name for name in
+                                       BITS + ['T0.DN', 'T1.TT', 'T2.DN', 'C0.DN', 'C1.DN', 'G[1]']])
+        return {"type": rnd.choice(["XIC", "XIO"]), "tag": tag}
+    if k < 0.75:
+        return {"type": rnd.choice(["EQU", "NEQ", "GRT", "GEQ", "LES", "LEQ"]),
+                "source_a": _operand(rnd, p), "source_b": _operand(rnd, p)}
+    if k < 0.85:
+        return {"type": "LIM", "low": _operand(rnd, p), "test": _operand(rnd, p),
+                "high": _operand(rnd, p)}
+    if k < 0.92:
+        one_shots.append(len(one_shots))
+        return {"type": "OSR", "tag": f"{p}OS{one_shots[-1]}"}
+    legs = [[_contact(rnd, p, one_shots) for _ in range(rnd.randint(1, 2))]
+            for _ in range(rnd.randint(2, 3))]
+    return {"type": "BRANCH", "legs": legs}
+
+
+def _output(rnd: random.Random, p: str) -> Dict:
+    k = rnd.random()
+    dest = p + rnd.choice(DINTS + REALS + ['A[5]', 'F[1]'])
+    if k < 0.15:
+        return {"type": rnd.choice(["OTE", "OTE", "OTL", "OTU"]), "tag": p + rnd.choice(BITS + ['G[2]'])}
+    if k < 0.3:
+        timer = rnd.choice(sorted(TIMERS))
+        timer_type, preset = TIMERS[timer]
+        return {"type": timer_type, "tag": p + timer, "preset": preset}
+    if k < 0.4:
+        counter = rnd.choice(sorted(COUNTERS))
+        instruction = {"type": rnd.choice(["CTU", "CTU", "CTD"]), "tag": p + counter,
+                       "preset": COUNTERS[counter]}
+        if instruction["type"] == "CTU" and rnd.random() < 0.5:
+            instruction["reset_tag"] = rnd.choice(INPUT_BITS)
+        return instruction
+    if k < 0.5:
+        return {"type": "MOV", "source": _operand(rnd, p), "dest": dest}
+    if k < 0.7:
+        return {"type": rnd.choice(["ADD", "SUB", "MUL", "DIV"]), "source_a": _operand(rnd, p),
+                "source_b": _operand(rnd, p), "dest": dest}
+    if k < 0.8:
+        return {"type": "CPT", "dest": dest, "expression": rnd.choice(EXPRESSIONS).format(p=p)}
+    if k < 0.9:
+        source, target = rnd.choice([("A", "A[2]"), ("A[1]", "F"), ("F", "A"), ("A", "G"), ("F[4]", "F")])
+        return {"type": "COP", "source": p + source, "dest": p + target, "length": rnd.randint(1, 4)}
+    return {"type": "FLL", "source": _operand(rnd, p), "dest": p + rnd.choice(["A[4]", "F", "G"]),
+            "length": rnd.randint(1, 4)}
+
+
+def generate_program(seed: int, rungs: int = 40, sections: int = 1) -> Dict:
+    """
+    Random program over a fixed tag set: contacts, compares, one-shots
+    and branches feeding coils, timers, counters, word and file
+    instructions. Rungs read tags written by earlier (and later) rungs.
+
+    With several sections, each has its own tags (prefixed S0_, S1_, ...)
+    and they share only the X inputs, so they can be scanned in parallel.
+    """
+    rnd = random.Random(seed)
+    program_rungs = []
+    tags = {}
+    for section in range(sections):
+        p = f"S{section}_" if sections > 1 else ""
+        one_shots: List[int] = []
+        for _ in range(rungs):
+            instructions = [_contact(rnd, p, one_shots) for _ in range(rnd.randint(0, 3))]
+            instructions.append(_output(rnd, p))
+            if rnd.random() < 0.15:
+                # Output before a contact: the rest of the rung sees its state
+                instructions.append(_contact(rnd, p, one_shots))
+                instructions.append(_output(rnd, p))
+            program_rungs.append({"rung_id": len(program_rungs), "instructions": instructions})
+        tags.update({p + name: "DINT" for name in DINTS})
+        tags.update({p + name: "REAL" for name in REALS})
+        tags[p + "A"] = {"type": "DINT", "length": ARRAY_SIZE, "value": list(range(ARRAY_SIZE))}
+        tags[p + "F"] = {"type": "REAL", "length": ARRAY_SIZE}
+        tags[p + "G"] = {"type": "BOOL", "length": ARRAY_SIZE}
+    return {"scan_time_ms": SCAN_MS, "tags": tags, "rungs": program_rungs}
+
+
+def input_values(seed: int, scans: int, sections: int = 1) -> List[List[tuple]]:
+    """Per scan, a few input tag writes (bits every scan, numbers now and then)"""
+    rnd = random.Random(seed)
+    steps = []
+    for _ in range(scans):
+        writes = [(name, rnd.random() < 0.4) for name in rnd.sample(INPUT_BITS, 2)]
+        p = f"S{rnd.randrange(sections)}_" if sections > 1 else ""
+        if rnd.random() < 0.3:
+            writes.append((p + rnd.choice(DINTS), rnd.choice([0, 1, -3, 250, 2 ** 40])))
+        if rnd.random() < 0.2:
+            writes.append((p + rnd.choice(REALS), rnd.choice([0.0, 1.5, -7.25, float('nan'), 1e300])))
+        steps.append(writes)
+    return steps
+
+
+def tag_image(program: LadderProgram) -> Dict:
+    """Every tag's value, comparable across modes (NaN == NaN, -0.0 == 0.0)"""
+    areas = program.tags.areas
+    image = {}
+    for tag_name, (data_type, index) in program.tags.slots.items():
+        value = areas[data_type][index]
+        if isinstance(value, float):
+            value = 'nan' if math.isnan(value) else value + 0.0
+        image[tag_name] = value
+    return image
+
+
+def run_modes(json_file: str, modes, steps: List[List[tuple]], workers: int = 2) -> Dict[str, List[Dict]]:
+    """Tag images after every scan of `json_file` in each mode, fed the same inputs"""
+    images = {}
+    for mode in modes:
+        program = LadderProgram(mode, workers)
+        program.load_from_json(json_file, use_cache=False)
+        clock = VirtualClock()
+        program.timebase = Timebase(clock)
+        images[mode] = []
+        try:
+            for writes in steps:
+                for tag_name, value in writes:
+                    program.tags.set(tag_name, value)
+                program.execute_scan()
+                images[mode].append(tag_image(program))
+                clock.advance(SCAN_MS * 1_000_000)
+        finally:
+            program.close()
+    return images
+
+
+@pytest.fixture
+def program_file(tmp_path):
+    """Write a program dict to a JSON file; returns its path"""
+    def write(program: Dict, name: str = 'program.json') -> str:
+        path = tmp_path / name
+        path.write_text(json.dumps(program))
+        return str(path)
+    return write
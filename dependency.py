@@ -0,0 +1,83 @@
+"""
+Rung Dependency Graph
+Read/write tag sets for each rung of a program and the reverse index
+from tags to the rungs that depend on them.
+"""
+
+from collections import defaultdict
+from typing import Dict, List, Set
+
+from .instructions import Timer, walk
+
+
+class DependencyGraph:
+    """
+    Tag dependencies of a list of rungs.
+
+    A rung depends on every tag it reads and every tag it writes: if
+    another rung (or the I/O) changes a tag this rung writes, running
+    this rung again could overwrite it, so it must be re-evaluated too.
+    """
+
+    def __init__(self, rungs: List):
+        self.rungs = rungs
+        self.reads: List[Set[str]] = []
+        self.writes: List[Set[str]] = []
+        self.timing_tags: List[List[str]] = []
+
+        self.readers: Dict[str, List[int]] = defaultdict(list)
+        self.writers: Dict[str, List[int]] = defaultdict(list)
+
+        for r, rung in enumerate(rungs):
+            reads, writes = set(), set()
+            for instruction in rung.instructions:
+                reads.update(instruction.reads())
+                writes.update(instruction.writes())
+            timing = [instruction.tt_tag for instruction in walk(rung.instructions)
+                      if isinstance(instruction, Timer)]
+
+            self.reads.append(reads)
+            self.writes.append(writes)
+            self.timing_tags.append(timing)
+
+            for tag_name in reads:
+                self.readers[tag_name].append(r)
+            for tag_name in writes:
+                self.writers[tag_name].append(r)
+
+    def tags(self) -> Set[str]:
+        """All tags referenced by the program"""
+        return set(self.readers) | set(self.writers)
+
+    def dependents(self, tag_name: str) -> List[int]:
+        """Indices of rungs that read or write a tag, in scan order"""
+        return sorted(set(self.readers.get(tag_name, ())) | set(self.writers.get(tag_name, ())))
+
+    def partition(self) -> List[List[int]]:
+        """
+        Split the rungs into independent groups: two rungs are in the same
+        group if one writes a tag the other reads or writes. Rungs in
+        different groups can run in any order (or concurrently) with the
+        same result as the sequential scan. Each group lists rung indices
+        in scan order; groups are ordered by their first rung.
+        """
+        parent = list(range(len(self.rungs)))
+
+        def find(r: int) -> int:
+            while parent[r] != r:
+                parent[r] = parent[parent[r]]
+                r = parent[r]
+            return r
+
+        for tag_name in self.writers:
+            members = self.dependents(tag_name)
+            root = find(members[0])
+            for r in members[1:]:
+                other = find(r)
+                if other != root:
+                    parent[other] = root
+
+        groups = defaultdict(list)
+        for r in range(len(self.rungs)):
+            groups[find(r)].append(r)
+        return sorted(groups.values(), key=lambda group: group[0])
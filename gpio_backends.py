@@ -0,0 +1,348 @@
+"""
+GPIO Backends
+Pin access layer under GPIOManager.
+
+Backends work on physical pin levels (inversion is handled by the
+manager) and take outputs in bulk: write() receives only the pins whose
+level changed and applies them with as few calls as the driver allows.
+
+    RPiGPIOBackend    - RPi.GPIO (one multi-channel GPIO.output call)
+    GpiodBackend      - Linux GPIO character device via libgpiod v2
+                        (/dev/gpiochipN, one line request for all pins)
+    SimulatedBackend  - in-memory pins for running without hardware
+    FakeChipBackend   - simulated pins stored in a file, one byte per
+                        line, so tests and other processes can drive
+                        inputs and inspect outputs on any Linux box
+"""
+
+import os
+import mmap
+import time
+import logging
+import threading
+from datetime import timedelta
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Optional pin drivers
+try:
+    import RPi.GPIO as GPIO
+    GPIO_AVAILABLE = True
+except (ImportError, RuntimeError):
+    GPIO_AVAILABLE = False
+
+try:
+    import gpiod
+    from gpiod.line import Bias, Direction, Edge, Value
+    GPIOD_AVAILABLE = True
+except ImportError:
+    GPIOD_AVAILABLE = False
+
+
+EdgeCallback = Callable[[int], None]   # called with the edge timestamp (monotonic ns)
+
+
+class GPIOBackend:
+    """Interface implemented by all pin backends"""
+
+    name = 'base'
+
+    def setup_input(self, pin: int) -> None:
+        raise NotImplementedError
+
+    def setup_output(self, pin: int) -> None:
+        raise NotImplementedError
+
+    def add_edge_detect(self, pin: int, edge: str, callback: EdgeCallback,
+                        bounce_ms: int = None) -> None:
+        """Call callback(timestamp_ns) on 'rising', 'falling' or 'both' edges of an input"""
+        raise NotImplementedError
+
+    def read(self, pins: List[int]) -> List[bool]:
+        """Read the levels of several input pins"""
+        raise NotImplementedError
+
+    def write(self, levels: Dict[int, bool]) -> None:
+        """Set several output pins in one batch"""
+        raise NotImplementedError
+
+    def cleanup(self) -> None:
+        pass
+
+
+class RPiGPIOBackend(GPIOBackend):
+    """RPi.GPIO with BCM pin numbering"""
+
+    name = 'rpi'
+
+    def __init__(self):
+        if not GPIO_AVAILABLE:
+            raise RuntimeError("RPi.GPIO is not available")
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+
+    def setup_input(self, pin: int) -> None:
+        GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+
+    def setup_output(self, pin: int) -> None:
+        GPIO.setup(pin, GPIO.OUT)
+        GPIO.output(pin, GPIO.LOW)
+
+    def add_edge_detect(self, pin: int, edge: str, callback: EdgeCallback,
+                        bounce_ms: int = None) -> None:
+        mode = {'rising': GPIO.RISING, 'falling': GPIO.FALLING, 'both': GPIO.BOTH}[edge]
+        options = {'bouncetime': bounce_ms} if bounce_ms else {}
+        GPIO.add_event_detect(pin, mode, callback=lambda channel: callback(time.monotonic_ns()),
+                              **options)
+
+    def read(self, pins: List[int]) -> List[bool]:
+        return [bool(GPIO.input(pin)) for pin in pins]
+
+    def write(self, levels: Dict[int, bool]) -> None:
+        # RPi.GPIO accepts parallel lists of channels and values
+        GPIO.output(list(levels), [GPIO.HIGH if level else GPIO.LOW for level in levels.values()])
+
+    def cleanup(self) -> None:
+        GPIO.cleanup()
+
+
+class GpiodBackend(GPIOBackend):
+    """
+    GPIO character device (libgpiod v2 Python bindings).
+    All configured lines are requested together on first use, so reads
+    and writes are single get_values/set_values calls. Edge events carry
+    kernel timestamps and are delivered from a reader thread.
+    """
+
+    name = 'gpiod'
+
+    def __init__(self, chip: str = '/dev/gpiochip0', consumer: str = 'pi-ladder'):
+        if not GPIOD_AVAILABLE:
+            raise RuntimeError("gpiod (libgpiod v2 bindings) is not available")
+        self.chip = chip
+        self.consumer = consumer
+        self.inputs: List[int] = []
+        self.outputs: List[int] = []
+        self.edges: Dict[int, tuple] = {}
+        self.request = None
+        self.running = False
+        self.thread = None
+
+    def setup_input(self, pin: int) -> None:
+        self.inputs.append(pin)
+
+    def setup_output(self, pin: int) -> None:
+        self.outputs.append(pin)
+
+    def add_edge_detect(self, pin: int, edge: str, callback: EdgeCallback,
+                        bounce_ms: int = None) -> None:
+        self.edges[pin] = (edge, callback, bounce_ms)
+
+    def _request_lines(self):
+        edge_modes = {'rising': Edge.RISING, 'falling': Edge.FALLING, 'both': Edge.BOTH}
+        config = {}
+        polled = [pin for pin in self.inputs if pin not in self.edges]
+        if polled:
+            config[tuple(polled)] = gpiod.LineSettings(direction=Direction.INPUT,
+                                                       bias=Bias.PULL_DOWN)
+        for pin, (edge, _, bounce_ms) in self.edges.items():
+            config[pin] = gpiod.LineSettings(
+                direction=Direction.INPUT, bias=Bias.PULL_DOWN,
+                edge_detection=edge_modes[edge],
+                debounce_period=timedelta(milliseconds=bounce_ms or 0))
+        if self.outputs:
+            config[tuple(self.outputs)] = gpiod.LineSettings(direction=Direction.OUTPUT,
+                                                             output_value=Value.INACTIVE)
+
+        self.request = gpiod.request_lines(self.chip, consumer=self.consumer, config=config)
+        if self.edges:
+            self.running = True
+            self.thread = threading.Thread(target=self._read_events, name='gpiod-edges',
+                                           daemon=True)
+            self.thread.start()
+        return self.request
+
+    def _read_events(self) -> None:
+        while self.running:
+            if self.request.wait_edge_events(timedelta(milliseconds=100)):
+                for event in self.request.read_edge_events():
+                    _, callback, _ = self.edges[event.line_offset]
+                    callback(event.timestamp_ns)
+
+    def read(self, pins: List[int]) -> List[bool]:
+        request = self.request or self._request_lines()
+        return [value == Value.ACTIVE for value in request.get_values(pins)]
+
+    def write(self, levels: Dict[int, bool]) -> None:
+        request = self.request or self._request_lines()
+        request.set_values({pin: Value.ACTIVE if level else Value.INACTIVE
+                            for pin, level in levels.items()})
+
+    def cleanup(self) -> None:
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+        if self.request:
+            self.request.release()
+            self.request = None
+
+
+class SimulatedBackend(GPIOBackend):
+    """
+    In-memory pins. set_level() drives an input like a real signal,
+    including edge callbacks (timestamped with `clock`); write_calls
+    counts output batches.
+    """
+
+    name = 'simulation'
+
+    def __init__(self, clock=time.monotonic_ns):
+        self.clock = clock
+        self.levels: Dict[int, bool] = {}
+        self.edge_callbacks: Dict[int, tuple] = {}
+        self.write_calls = 0
+
+    def setup_input(self, pin: int) -> None:
+        self.levels.setdefault(pin, False)
+
+    def setup_output(self, pin: int) -> None:
+        self._store(pin, False)
+
+    def add_edge_detect(self, pin: int, edge: str, callback: EdgeCallback,
+                        bounce_ms: int = None) -> None:
+        self.edge_callbacks[pin] = (edge, callback)
+
+    def set_level(self, pin: int, level: bool) -> None:
+        """Drive a pin, firing its edge callback on a matching edge"""
+        previous = self.get_level(pin)
+        level = bool(level)
+        self._store(pin, level)
+        detect = self.edge_callbacks.get(pin)
+        if detect and level != previous:
+            edge, callback = detect
+            if edge == 'both' or (edge == 'rising') == level:
+                callback(self.clock())
+
+    def get_level(self, pin: int) -> bool:
+        return self.levels.get(pin, False)
+
+    def _store(self, pin: int, level: bool) -> None:
+        self.levels[pin] = level
+
+    def read(self, pins: List[int]) -> List[bool]:
+        return [self.get_level(pin) for pin in pins]
+
+    def write(self, levels: Dict[int, bool]) -> None:
+        self.write_calls += 1
+        for pin, level in levels.items():
+            self._store(pin, level)
+
+
+class FakeChipBackend(SimulatedBackend):
+    """
+    Simulated chip backed by a file of one ASCII '0'/'1' byte per line
+    (offset = pin number). Outputs are written with one memory-mapped
+    update per batch; inputs can be changed by any process writing the
+    file, and such changes are turned into edge events by a poller.
+    """
+
+    name = 'fake'
+
+    def __init__(self, path: str, lines: int = 64, poll_ms: float = 1.0,
+                 clock=time.monotonic_ns):
+        super().__init__(clock)
+        self.path = path
+        self.poll_s = poll_ms / 1000.0
+
+        with open(path, 'a+b') as f:
+            if os.fstat(f.fileno()).st_size < lines:
+                f.truncate(lines)
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        for pin in range(len(self.map)):
+            if self.map[pin] not in b'01':
+                self.map[pin] = ord('0')
+
+        self.seen: Dict[int, bool] = {}
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def get_level(self, pin: int) -> bool:
+        return self.map[pin] == ord('1')
+
+    def _store(self, pin: int, level: bool) -> None:
+        self.map[pin] = ord('1') if level else ord('0')
+
+    def write(self, levels: Dict[int, bool]) -> None:
+        super().write(levels)
+        self.map.flush()
+
+    def add_edge_detect(self, pin: int, edge: str, callback: EdgeCallback,
+                        bounce_ms: int = None) -> None:
+        super().add_edge_detect(pin, edge, callback, bounce_ms)
+        self.seen[pin] = self.get_level(pin)
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self._poll, name='fake-chip-edges', daemon=True)
+            self.thread.start()
+
+    def _edge(self, pin: int, level: bool) -> None:
+        """Fire the callback if level is a detected edge from the last seen level"""
+        with self.lock:
+            previous = self.seen.get(pin, level)
+            self.seen[pin] = level
+        edge, callback = self.edge_callbacks[pin]
+        if level != previous and (edge == 'both' or (edge == 'rising') == level):
+            callback(self.clock())
+
+    def _poll(self) -> None:
+        """Detect edges made by other writers of the file"""
+        while self.running:
+            time.sleep(self.poll_s)
+            for pin in list(self.edge_callbacks):
+                self._edge(pin, self.get_level(pin))
+
+    def set_level(self, pin: int, level: bool) -> None:
+        self._store(pin, bool(level))
+        if pin in self.edge_callbacks:
+            self._edge(pin, bool(level))
+
+    def cleanup(self) -> None:
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+        self.map.close()
+        self.file.close()
+
+
+BACKENDS = {
+    'rpi': RPiGPIOBackend,
+    'gpiod': GpiodBackend,
+    'simulation': SimulatedBackend,
+    'fake': FakeChipBackend,
+}
+
+
+def create_backend(name: str = 'auto', **options) -> GPIOBackend:
+    """
+    Create a backend by name. 'auto' picks RPi.GPIO, then the gpiod
+    character device, and falls back to simulation.
+    """
+    if name == 'auto':
+        if GPIO_AVAILABLE:
+            return RPiGPIOBackend()
+        chip = options.get('chip', '/dev/gpiochip0')
+        if GPIOD_AVAILABLE and os.path.exists(chip):
+            return GpiodBackend(chip)
+        logger.warning("No GPIO driver available - running in simulation mode")
+        return SimulatedBackend()
+
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown GPIO backend: {name}")
+    if name == 'gpiod':
+        return GpiodBackend(options.get('chip', '/dev/gpiochip0'))
+    if name == 'fake':
+        return FakeChipBackend(options.get('chip', 'fake_gpiochip'), options.get('lines', 64))
+    return BACKENDS[name]()
@@ -3,29 +3,38 @@ GPIO Manager for Raspberry Pi
 Handles physical I/O similar to PLC I/O modules
 """
 
+import time
+import heapq
 import logging
 import json
-from typing import Dict, List
+from collections import deque
+from typing import Callable, Dict, List
+
+from .gpio_backends import GPIOBackend, SimulatedBackend, create_backend, GPIO_AVAILABLE
+from .input_filters import InputFilterBank
 
 logger = logging.getLogger(__name__)
 
-# Try to import RPi.GPIO, fall back to simulation mode if not available
-try:
-    import RPi.GPIO as GPIO
-    GPIO_AVAILABLE = True
-except (ImportError, RuntimeError):
-    GPIO_AVAILABLE = False
-    logger.warning("RPi.GPIO not available - running in simulation mode")
+
+EDGES = ('rising', 'falling', 'both')
 
 
 class IOPoint:
     """Represents a single I/O point (input or output)"""
     
-    def __init__(self, tag_name: str, pin: int, io_type: str, invert: bool = False):
+    def __init__(self, tag_name: str, pin: int, io_type: str, invert: bool = False,
+                 edge: str = None, priority: bool = False, count_tag: str = None):
         self.tag_name = tag_name
         self.pin = pin
         self.io_type = io_type.upper()  # 'INPUT' or 'OUTPUT'
         self.invert = invert
+        
+        # Edge capture (inputs only): None = polled once per scan
+        if edge is not None and edge not in EDGES:
+            raise ValueError(f"{tag_name}: edge must be one of {EDGES}")
+        self.edge = edge
+        self.priority = priority      # Edge triggers an immediate scan
+        self.count_tag = count_tag    # DINT tag counting captured edges
     
     def __repr__(self):
         return f"IOPoint({self.tag_name}, Pin {self.pin}, {self.io_type})"
@@ -35,20 +44,70 @@ class GPIOManager:
     """
     Manages GPIO for ladder logic I/O
     Maps physical GPIO pins to ladder logic tags
+    
+    Inputs configured with an "edge" are captured by edge callbacks
+    instead of relying only on the once-per-scan poll: each edge is
+    queued with a monotonic timestamp, and a pulse that started and
+    ended between two scans is latched into the input image for one
+    scan. Edges on "priority" inputs call on_priority_edge (set by the
+    runtime to request an immediate out-of-cycle scan).
+    
+    Inputs with a "filter" are debounced/majority-voted by an
+    InputFilterBank (see input_filters.py) before entering the image.
+    
+    Pins are accessed through a GPIOBackend (see gpio_backends.py),
+    chosen by the "backend" config key or passed in. Outputs are only
+    written when they change, in one batch per scan.
+    
+    Filters and captured edges are timed with `clock` (monotonic ns);
+    pass the runtime's VirtualClock to simulate in virtual time.
     """
     
-    def __init__(self, config_file: str = None):
+    def __init__(self, config_file: str = None, backend: GPIOBackend = None,
+                 clock=time.monotonic_ns):
+        self.clock = clock
         self.inputs: List[IOPoint] = []
         self.outputs: List[IOPoint] = []
-        self.simulation_mode = not GPIO_AVAILABLE
+        self.backend = backend
         self.simulation_inputs: Dict[str, bool] = {}
         
+        # Input/output image tables (one entry per configured point)
+        self.input_image: List[bool] = []
+        self.output_image: List[bool] = []
+        # Input levels as polled (and filtered), without latched pulses
+        self._input_levels: List[bool] = []
+        self._input_slots = None
+        self._output_slots = None
+        self._counted: List[int] = []
+        self._count_slots = None
+        self._slot_owner = None
+        
+        # Physical pin numbers and the last levels written to them
+        self._input_pins: List[int] = []
+        self._output_pins: List[int] = []
+        self._written: List[bool] = []
+        self._last_output_image: List[bool] = None
+        
+        self.filters = InputFilterBank()
+        
+        # Captured edges: (input index, timestamp ns), appended from callbacks
+        self.edges = deque()
+        self.edge_counts: List[int] = []
+        self.last_edge_ns: List[int] = []
+        self.on_priority_edge: Callable[[], None] = None
+        
         if config_file:
             self.load_config(config_file)
         
-        if not self.simulation_mode:
-            GPIO.setmode(GPIO.BCM)  # Use BCM pin numbering
-            GPIO.setwarnings(False)
+        if self.backend is None:
+            self.backend = create_backend('auto')
+        if self.simulation_mode:
+            # Simulated edges are timestamped on the filters' clock
+            self.backend.clock = clock
+    
+    @property
+    def simulation_mode(self) -> bool:
+        return isinstance(self.backend, SimulatedBackend)
     
     def load_config(self, config_file: str):
         """
@@ -56,9 +115,14 @@ class GPIOManager:
         
         Format:
         {
+            "backend": "auto",  (rpi, gpiod, simulation or fake; optional)
+            "chip": "/dev/gpiochip0",  (gpiod device or fake chip file)
             "inputs": [
                 {"tag": "START_BTN", "pin": 17, "invert": false},
-                {"tag": "STOP_BTN", "pin": 27, "invert": false}
+                {"tag": "STOP_BTN", "pin": 27, "invert": false,
+                 "filter": {"type": "debounce", "on_ms": 20, "off_ms": 20}},
+                {"tag": "ESTOP", "pin": 22, "edge": "both", "priority": true},
+                {"tag": "ENCODER", "pin": 5, "edge": "rising", "count_tag": "ENCODER_COUNT"}
             ],
             "outputs": [
                 {"tag": "MOTOR_RUN", "pin": 22, "invert": false},
@@ -69,19 +133,30 @@ class GPIOManager:
         with open(config_file, 'r') as f:
             config = json.load(f)
         
+        if self.backend is None:
+            options = {'chip': config['chip']} if 'chip' in config else {}
+            self.backend = create_backend(config.get('backend', 'auto'), **options)
+        
         # Configure inputs
         for inp in config.get('inputs', []):
             io_point = IOPoint(
                 tag_name=inp['tag'],
                 pin=inp['pin'],
                 io_type='INPUT',
-                invert=inp.get('invert', False)
+                invert=inp.get('invert', False),
+                edge=inp.get('edge'),
+                priority=inp.get('priority', False),
+                count_tag=inp.get('count_tag')
             )
+            index = len(self.inputs)
             self.inputs.append(io_point)
+            if 'filter' in inp:
+                self.filters.add(index, inp['filter'])
             
-            if not self.simulation_mode:
-                GPIO.setup(io_point.pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-            else:
+            self.backend.setup_input(io_point.pin)
+            if io_point.edge:
+                self._add_edge_detect(index, io_point, inp.get('bounce_ms'))
+            if self.simulation_mode:
                 self.simulation_inputs[io_point.tag_name] = False
         
         # Configure outputs
@@ -93,44 +168,136 @@ class GPIOManager:
                 invert=out.get('invert', False)
             )
             self.outputs.append(io_point)
-            
-            if not self.simulation_mode:
-                GPIO.setup(io_point.pin, GPIO.OUT)
-                GPIO.output(io_point.pin, GPIO.LOW)
+            self.backend.setup_output(io_point.pin)
+        
+        self._input_pins = [p.pin for p in self.inputs]
+        self._output_pins = [p.pin for p in self.outputs]
+        self._written = [False] * len(self.outputs)   # outputs start LOW
+        self._last_output_image = None
+        self.input_image = [False] * len(self.inputs)
+        self._input_levels = [False] * len(self.inputs)
+        self.output_image = [False] * len(self.outputs)
+        self.edge_counts = [0] * len(self.inputs)
+        self.last_edge_ns = [0] * len(self.inputs)
+        self._slot_owner = None
         
-        logger.info(f"Loaded I/O config: {len(self.inputs)} inputs, {len(self.outputs)} outputs")
+        logger.info(f"Loaded I/O config: {len(self.inputs)} inputs, {len(self.outputs)} outputs "
+                    f"({self.backend.name} backend)")
         if self.simulation_mode:
             logger.info("Running in SIMULATION mode (no physical I/O)")
     
+    def _add_edge_detect(self, index: int, io_point: IOPoint, bounce_ms: int = None):
+        """Register a backend edge callback for an input"""
+        edge = io_point.edge
+        if io_point.invert and edge != 'both':
+            # Edges are configured on the logical (inverted) signal
+            edge = 'falling' if edge == 'rising' else 'rising'
+        
+        self.backend.add_edge_detect(io_point.pin, edge,
+                                     lambda timestamp_ns: self.capture_edge(index, timestamp_ns),
+                                     bounce_ms)
+    
+    def capture_edge(self, index: int, timestamp_ns: int = None):
+        """
+        Queue an edge on input `index` (called from the GPIO callback
+        thread or the simulator; thread-safe).
+        """
+        self.edges.append((index, timestamp_ns or self.clock()))
+        if self.inputs[index].priority and self.on_priority_edge:
+            self.on_priority_edge()
+    
+    @property
+    def has_priority_inputs(self) -> bool:
+        return any(io_point.priority for io_point in self.inputs)
+    
+    def _resolve_slots(self, tags):
+        """Resolve I/O tag names to tag slots once per tag database"""
+        if self._slot_owner is not tags:
+            self._input_slots = tags.resolve([p.tag_name for p in self.inputs])
+            self._output_slots = tags.resolve([p.tag_name for p in self.outputs])
+            self._counted = [i for i, p in enumerate(self.inputs) if p.count_tag]
+            self._count_slots = tags.resolve([self.inputs[i].count_tag for i in self._counted], 'DINT')
+            self._slot_owner = tags
+    
+    def _drain_edges(self, previous: List[bool]) -> set:
+        """
+        Consume queued edges. Returns the inputs that had a pulse: edges
+        since the last scan (that passed the input's filter, if any).
+        """
+        filters = self.filters
+        pulsed = set()
+        edges = self.edges
+        while edges:
+            index, timestamp_ns = edges.popleft()
+            self.edge_counts[index] += 1
+            self.last_edge_ns[index] = timestamp_ns
+            
+            if index not in filters.slots:
+                pulsed.add(index)
+            elif filters.is_timed(index) and self.inputs[index].edge == 'both':
+                # Each edge toggles the raw level; filter it at its timestamp
+                slot = filters.slots[index]
+                level = filters.raw[slot] == 0
+                if filters.update(slot, level, timestamp_ns) != previous[index]:
+                    pulsed.add(index)
+            # Other filtered inputs only see polled samples: a sub-scan
+            # pulse is shorter than any majority window
+        return pulsed
+    
     def read_inputs(self, tags):
         """
-        Read all inputs from GPIO and update tags.
+        Read all inputs into the input image table, latch pulses seen
+        by edge capture, then copy the whole image into the tags in one
+        block.
         Called at the start of each scan cycle.
         """
-        for io_point in self.inputs:
-            if not self.simulation_mode:
-                value = GPIO.input(io_point.pin)
-                if io_point.invert:
-                    value = not value
-            else:
-                # Simulation mode - read from simulation dict
-                value = self.simulation_inputs.get(io_point.tag_name, False)
-            
-            tags.set(io_point.tag_name, bool(value))
+        self._resolve_slots(tags)
+        image = self.input_image
+        # Compare with the last real levels: the image may hold a latched pulse
+        previous = self._input_levels
+        pulsed = self._drain_edges(previous) if self.edges else None
+        
+        levels = self.backend.read(self._input_pins)
+        for i, io_point in enumerate(self.inputs):
+            image[i] = levels[i] != io_point.invert
+        
+        if self.filters:
+            self.filters.apply(image, self.clock())
+        self._input_levels = image[:]
+        
+        # An input whose level is back where it was had a short pulse:
+        # show the pulse level for this scan
+        if pulsed:
+            for index in pulsed:
+                if image[index] == previous[index]:
+                    image[index] = not previous[index]
+        
+        tags.write_slots(self._input_slots, image)
+        if self._counted:
+            tags.write_slots(self._count_slots, [self.edge_counts[i] for i in self._counted])
     
     def write_outputs(self, tags):
         """
-        Write all outputs from tags to GPIO.
+        Copy all output tags into the output image table in one block,
+        then write the outputs that changed to GPIO in one batch.
         Called at the end of each scan cycle.
         """
-        for io_point in self.outputs:
-            value = tags.get(io_point.tag_name, False)
-            
-            if io_point.invert:
-                value = not value
-            
-            if not self.simulation_mode:
-                GPIO.output(io_point.pin, GPIO.HIGH if value else GPIO.LOW)
+        self._resolve_slots(tags)
+        self.output_image = image = [bool(v) for v in tags.read_slots(self._output_slots)]
+        if image == self._last_output_image:
+            return
+        self._last_output_image = image
+        
+        written = self._written
+        changes = {}
+        for i, io_point in enumerate(self.outputs):
+            level = image[i] != io_point.invert
+            if level != written[i]:
+                written[i] = level
+                changes[io_point.pin] = level
+        
+        if changes:
+            self.backend.write(changes)
     
     def set_simulation_input(self, tag_name: str, value: bool):
         """
@@ -139,20 +306,30 @@ class GPIOManager:
         if self.simulation_mode:
             self.simulation_inputs[tag_name] = value
             logger.info(f"Simulation: {tag_name} = {value}")
+            
+            # Drive the simulated pin; edge-captured inputs see the edge
+            for io_point in self.inputs:
+                if io_point.tag_name == tag_name:
+                    self.backend.set_level(io_point.pin, bool(value) != io_point.invert)
     
     def get_io_status(self) -> Dict:
         """Get current I/O status for monitoring"""
         status = {
             'mode': 'simulation' if self.simulation_mode else 'hardware',
+            'backend': self.backend.name,
             'inputs': [],
             'outputs': []
         }
         
-        for io_point in self.inputs:
-            status['inputs'].append({
+        for i, io_point in enumerate(self.inputs):
+            entry = {
                 'tag': io_point.tag_name,
                 'pin': io_point.pin
-            })
+            }
+            if io_point.edge:
+                entry.update(edge=io_point.edge, priority=io_point.priority,
+                             edges=self.edge_counts[i], last_edge_ns=self.last_edge_ns[i])
+            status['inputs'].append(entry)
         
         for io_point in self.outputs:
             status['outputs'].append({
@@ -164,12 +341,11 @@ class GPIOManager:
     
     def cleanup(self):
         """Cleanup GPIO on shutdown"""
+        # Turn off all outputs
+        if self.outputs:
+            self.backend.write({io_point.pin: False for io_point in self.outputs})
+        self.backend.cleanup()
         if not self.simulation_mode:
-            # Turn off all outputs
-            for io_point in self.outputs:
-                GPIO.output(io_point.pin, GPIO.LOW)
-            
-            GPIO.cleanup()
             logger.info("GPIO cleaned up")
 
 
@@ -177,10 +353,44 @@ class VirtualIOSimulator:
     """
     Simple virtual I/O simulator for testing without hardware.
     Provides a CLI interface to toggle inputs.
+    
+    Input changes can also be scripted against simulated time:
+    
+        simulator.load_script([
+            {"at_ms": 1000, "tag": "START_BTN", "value": "pulse"},
+            {"at_ms": 60000, "tag": "STOP_BTN", "value": true}
+        ])
+    
+    Simulation (simulation.py) applies due changes before each scan.
     """
     
     def __init__(self, gpio_manager: GPIOManager):
         self.gpio_manager = gpio_manager
+        # Pending scripted changes: heap of (at_ms, sequence, tag, value)
+        self.script: List[tuple] = []
+        self._sequence = 0
+    
+    def schedule(self, at_ms: float, tag_name: str, value):
+        """Script an input change (True/False or 'pulse') at at_ms"""
+        heapq.heappush(self.script, (at_ms, self._sequence, tag_name, value))
+        self._sequence += 1
+    
+    def load_script(self, events: List[Dict]):
+        """Script a list of {"at_ms", "tag", "value"} changes"""
+        for event in events:
+            self.schedule(event['at_ms'], event['tag'], event['value'])
+    
+    def apply_script(self, now_ms: float) -> int:
+        """Apply scripted changes due at or before now_ms, in order"""
+        applied = 0
+        while self.script and self.script[0][0] <= now_ms:
+            _, _, tag_name, value = heapq.heappop(self.script)
+            if value == 'pulse':
+                self.pulse_input(tag_name)
+            else:
+                self.set_input(tag_name, bool(value))
+            applied += 1
+        return applied
     
     def toggle_input(self, tag_name: str):
         """Toggle an input on/off"""
@@ -194,6 +404,15 @@ class VirtualIOSimulator:
         """Set an input to a specific value"""
         self.gpio_manager.set_simulation_input(tag_name, value)
     
+    def pulse_input(self, tag_name: str):
+        """
+        Pulse an input on and off between two scans; edge-captured
+        inputs still see it for one scan
+        """
+        current = self.gpio_manager.simulation_inputs.get(tag_name, False)
+        self.gpio_manager.set_simulation_input(tag_name, not current)
+        self.gpio_manager.set_simulation_input(tag_name, current)
+    
     def get_inputs(self) -> Dict[str, bool]:
         """Get all simulation input states"""
         return self.gpio_manager.simulation_inputs.copy()
@@ -0,0 +1,273 @@
+"""
+Tag Historian
+Records tag value changes into a fixed-size, memory-mapped ring file.
+
+Each published scan image is compared with the previous one
+(changed_indices skips unchanged chunks at C speed) and one 32-byte
+record is appended per changed tag:
+
+    scan number | monotonic timestamp (ns) | tag id | value
+
+The file never grows: once `capacity` records are written the oldest
+are overwritten. Records go straight into the shared mapping, so they
+survive a crash of the runtime process (the record count in the header
+is only advanced after a scan's records are written). flush() - called
+on close - also forces them to disk.
+
+File layout:
+
+    header (64 bytes) | tag table (names_size bytes) | capacity x record
+
+The tag table assigns ids to (name, data type) in first-seen order and
+is kept across restarts, so a file can be reopened by a later run or a
+changed program.
+
+History(path) reads a file (also while it is being written) for
+queries and export.
+"""
+
+import os
+import csv
+import json
+import mmap
+import time
+import struct
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .tags import BOOL, DINT, REAL, AREAS, changed_indices
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PLCH'
+VERSION = 1
+HEADER = struct.Struct('<4sHHQQIIq')       # magic, version, record size, capacity,
+HEADER_SIZE = 64                           # count, names size, names used, wall offset
+NAME = struct.Struct('<BH')                # data type code, name length (+ name bytes)
+RECORD_INT = struct.Struct('<qqI4xq')      # scan, timestamp_ns, tag id, value
+RECORD_REAL = struct.Struct('<qqI4xd')
+RECORD_SIZE = RECORD_INT.size
+
+_COUNT_OFFSET = 16                         # offset of the record count in the header
+_NAMES_USED_OFFSET = 28
+_TYPE_CODES = {BOOL: 0, DINT: 1, REAL: 2}
+_TYPES = {code: data_type for data_type, code in _TYPE_CODES.items()}
+
+Record = Tuple[int, int, str, Any]         # (timestamp_ns, scan, tag, value)
+
+
+def _read_names(data, names_used: int) -> List[Tuple[str, str]]:
+    """Decode the tag table: list of (name, data type) indexed by tag id"""
+    names, offset = [], HEADER_SIZE
+    end = HEADER_SIZE + names_used
+    while offset < end:
+        code, length = NAME.unpack_from(data, offset)
+        offset += NAME.size
+        names.append((bytes(data[offset:offset + length]).decode('utf-8'), _TYPES[code]))
+        offset += length
+    return names
+
+
+class Historian:
+    """Writer side: records changes of a TagDatabase's published images"""
+
+    def __init__(self, path: str, capacity: int = 100_000, names_size: int = 65536,
+                 include_system: bool = False, clock=time.monotonic_ns):
+        self.path = path
+        self.include_system = include_system
+        self.clock = clock
+
+        size = HEADER_SIZE + names_size + capacity * RECORD_SIZE
+        existing = os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE
+        self.file = open(path, 'r+b' if existing else 'w+b')
+        header = HEADER.unpack(self.file.read(HEADER.size)) if existing else None
+        if header and (header[:4] != (MAGIC, VERSION, RECORD_SIZE, capacity)
+                       or header[5] != names_size):
+            logger.warning(f"History file {path} has a different layout - starting a new one")
+            header = None
+
+        if header is None:
+            self.file.truncate(0)
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+
+        self.capacity = capacity
+        self.names_size = names_size
+        self.records_offset = HEADER_SIZE + names_size
+        if header is None:
+            self.count, self.names_used = 0, 0
+        else:
+            self.count, self.names_used = header[4], header[6]
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, RECORD_SIZE, capacity, self.count,
+                         names_size, self.names_used, time.time_ns() - self.clock())
+
+        self.ids = {key: tag_id for tag_id, key in
+                    enumerate(_read_names(self.map, self.names_used))}
+        self.slot_ids = {area: [] for area in AREAS}   # slot index -> tag id (-1: not recorded)
+        self.slot_count = 0
+        self.previous = None
+        self.table_full = False
+
+    def _tag_id(self, tag_name: str, data_type: str) -> int:
+        """Id of a tag in the file's tag table, appending it if new"""
+        key = (tag_name, data_type)
+        tag_id = self.ids.get(key)
+        if tag_id is None:
+            encoded = tag_name.encode('utf-8')
+            offset = HEADER_SIZE + self.names_used
+            if self.names_used + NAME.size + len(encoded) > self.names_size:
+                if not self.table_full:
+                    logger.warning(f"History tag table full - not recording {tag_name} and later tags")
+                    self.table_full = True
+                return -1
+            NAME.pack_into(self.map, offset, _TYPE_CODES[data_type], len(encoded))
+            self.map[offset + NAME.size:offset + NAME.size + len(encoded)] = encoded
+            self.names_used += NAME.size + len(encoded)
+            struct.pack_into('<I', self.map, _NAMES_USED_OFFSET, self.names_used)
+            tag_id = self.ids[key] = len(self.ids)
+        return tag_id
+
+    def _map_slots(self, slots: Dict[str, Tuple[str, int]]) -> None:
+        """Assign tag ids to the storage slots (called when tags were added)"""
+        for area in AREAS:
+            self.slot_ids[area] = [-1] * sum(1 for data_type, _ in slots.values() if data_type == area)
+        for tag_name, (data_type, index) in slots.items():
+            if self.include_system or not tag_name.startswith('_SYSTEM'):
+                self.slot_ids[data_type][index] = self._tag_id(tag_name, data_type)
+        self.slot_count = len(slots)
+
+    def record(self, image, timestamp_ns: int = None) -> int:
+        """
+        Append the changes between the previous and this published image
+        (every recorded tag for the first image). Returns the number of records.
+        """
+        if len(image.slots) != self.slot_count:
+            self._map_slots(image.slots)
+        if timestamp_ns is None:
+            timestamp_ns = self.clock()
+
+        data, capacity, base = self.map, self.capacity, self.records_offset
+        scan, count, start = image.cycle, self.count, self.count
+        previous = self.previous
+        for area in AREAS:
+            values = image.areas[area]
+            ids = self.slot_ids[area]
+            record = RECORD_REAL if area == REAL else RECORD_INT
+            old = previous.areas[area] if previous is not None else values[:0]
+            for index in changed_indices(old, values):
+                tag_id = ids[index] if index < len(ids) else -1
+                if tag_id >= 0:
+                    record.pack_into(data, base + (count % capacity) * RECORD_SIZE,
+                                     scan, timestamp_ns, tag_id, values[index])
+                    count += 1
+
+        self.previous = image
+        if count != start:
+            self.count = count
+            struct.pack_into('<Q', data, _COUNT_OFFSET, count)
+        return count - start
+
+    def flush(self) -> None:
+        self.map.flush()
+
+    def close(self) -> None:
+        if self.map is not None:
+            self.flush()
+            self.map.close()
+            self.file.close()
+            self.map = None
+
+
+class History:
+    """Reader side: queries a history file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.getsize(path) < HEADER_SIZE:
+            raise ValueError(f"{path} is not a history file")
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.capacity, _, self.names_size, _, self.wall_offset_ns = \
+            HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+            self.data.close()
+            raise ValueError(f"{path} is not a history file")
+        self.records_offset = HEADER_SIZE + self.names_size
+
+    def close(self) -> None:
+        self.data.close()
+
+    @property
+    def count(self) -> int:
+        """Total number of records ever written"""
+        return struct.unpack_from('<Q', self.data, _COUNT_OFFSET)[0]
+
+    def tags(self) -> List[Tuple[str, str]]:
+        """(name, data type) of every tag in the file, indexed by tag id"""
+        names_used = struct.unpack_from('<I', self.data, _NAMES_USED_OFFSET)[0]
+        return _read_names(self.data, names_used)
+
+    def records(self) -> Iterator[Record]:
+        """All retained records, oldest first"""
+        tags = self.tags()
+        count = self.count
+        data, capacity, base = self.data, self.capacity, self.records_offset
+        for n in range(max(0, count - capacity), count):
+            offset = base + (n % capacity) * RECORD_SIZE
+            scan, timestamp_ns, tag_id, value = RECORD_INT.unpack_from(data, offset)
+            if tag_id >= len(tags):
+                continue
+            tag_name, data_type = tags[tag_id]
+            if data_type == REAL:
+                value = RECORD_REAL.unpack_from(data, offset)[3]
+            elif data_type == BOOL:
+                value = bool(value)
+            yield timestamp_ns, scan, tag_name, value
+
+    def query(self, tags: List[str] = None, start_ns: int = None, end_ns: int = None,
+              every_ns: int = None) -> List[Record]:
+        """
+        Records of the given tags (all if None) with start_ns <= timestamp < end_ns.
+        With every_ns, only the last change of each tag per every_ns
+        interval is returned (the value the tag settled on).
+        """
+        wanted = set(tags) if tags else None
+        selected = [record for record in self.records()
+                    if (wanted is None or record[2] in wanted)
+                    and (start_ns is None or record[0] >= start_ns)
+                    and (end_ns is None or record[0] < end_ns)]
+        if not every_ns:
+            return selected
+
+        last: Dict[Tuple[str, int], Record] = {}
+        for record in selected:
+            last[(record[2], record[0] // every_ns)] = record
+        return sorted(last.values(), key=lambda record: (record[0], record[1]))
+
+    def last_timestamp_ns(self) -> Optional[int]:
+        count = self.count
+        if count == 0:
+            return None
+        offset = self.records_offset + ((count - 1) % self.capacity) * RECORD_SIZE
+        return RECORD_INT.unpack_from(self.data, offset)[1]
+
+    def wall_time(self, timestamp_ns: int) -> str:
+        """ISO wall-clock time of a record timestamp (monotonic clock of the last writer)"""
+        return datetime.fromtimestamp((timestamp_ns + self.wall_offset_ns) / 1e9).isoformat(
+            timespec='milliseconds')
+
+    def export(self, records: List[Record], out, fmt: str = 'csv') -> None:
+        """Write records as CSV or JSON lines to a text stream"""
+        if fmt == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(['time', 'timestamp_ns', 'scan', 'tag', 'value'])
+            for timestamp_ns, scan, tag_name, value in records:
+                writer.writerow([self.wall_time(timestamp_ns), timestamp_ns, scan, tag_name, value])
+        elif fmt == 'json':
+            for timestamp_ns, scan, tag_name, value in records:
+                out.write(json.dumps({'time': self.wall_time(timestamp_ns),
+                                      'timestamp_ns': timestamp_ns, 'scan': scan,
+                                      'tag': tag_name, 'value': value}) + '\n')
+        else:
+            raise ValueError(f"Unknown export format: {fmt}")
@@ -0,0 +1,159 @@
+"""
+Incremental Scan
+Dependency-driven execution that skips rungs whose inputs have not
+changed since they last ran.
+
+Each rung gets a dirty flag. A rung is evaluated when its flag is set or
+one of its timers is timing (TT), and after it runs, every tag it wrote
+that changed value marks the rungs depending on that tag dirty (itself
+included, so edge/one-shot state settles on the next scan). Changes made
+outside the scan (inputs, HMI writes) are found by diffing the tag image
+against the copy taken at the end of the previous scan.
+
+A skipped rung would have reproduced exactly the values it already
+wrote, so results are identical to a full scan.
+"""
+
+import logging
+from typing import Callable, Dict, List, Tuple
+
+from .tags import AREAS, changed_indices
+from .compiler import AREA_NAMES, CodeGenerator, compile_source
+from .instructions import timers
+from . import logic
+from .dependency import DependencyGraph
+
+logger = logging.getLogger(__name__)
+
+# Consecutive written slots compared as one slice after a rung runs
+BLOCK_SLOTS = 8
+
+
+class IncrementalScan:
+    """Compiled scan of a program that only evaluates dirty rungs"""
+
+    def __init__(self, program, rungs: List = None, name: str = 'incremental_scan'):
+        self.program = program
+        self.tags = program.tags
+        self.rungs = program.rungs if rungs is None else rungs
+        self.name = name
+        self.graph = DependencyGraph(self.rungs)
+        self.dirty = bytearray(b'\x01' * len(self.rungs))
+        self.rungs_evaluated = 0
+
+        program.declare_tags()
+        self.scan_function = self._compile()
+        self.dependents = self._slot_dependents()
+        self.baseline = None
+
+    def _slot_dependents(self) -> Dict[str, Dict[int, List[int]]]:
+        """(area -> slot index -> dependent rung indices) for external changes"""
+        dependents = {area: {} for area in AREAS}
+        for tag_name in self.graph.tags():
+            slot = self.tags.slot(tag_name)
+            if slot is not None:
+                data_type, index = slot
+                dependents[data_type][index] = self.graph.dependents(tag_name)
+        return dependents
+
+    def _compile(self) -> Callable:
+        gen = CodeGenerator(self.tags)
+        areas = ', '.join(AREA_NAMES[area] for area in AREAS)
+        gen.source.append(f"def {self.name}(tags, dt, {areas}, D):")
+        gen.line("n_run = 0")
+
+        # Accumulators advanced by the timer pass mark the other rungs reading them
+        watched = []
+        for timer in timers(self.rungs):
+            marks = [r for r in self.graph.dependents(timer.acc_tag)
+                     if r not in self.graph.writers[timer.acc_tag]]
+            if marks:
+                watched.append((gen.ref(timer.acc_tag), marks))
+        for k, (ref, _) in enumerate(watched):
+            gen.line(f"q{k} = {ref}")
+        gen.emit_timers(self.rungs)
+        for k, (ref, marks) in enumerate(watched):
+            gen.line(f"if {ref} != q{k}: {' = '.join(f'D[{r}]' for r in marks)} = 1")
+
+        for r, rung in enumerate(self.rungs):
+            body = CodeGenerator(self.tags)
+            body.namespace = gen.namespace
+            body.indent = '        '
+            # No sub-expressions shared across rungs: any rung may be skipped
+            logic.emit_rung(body, logic.plan(rung.instructions))
+
+            # Rungs using interpreter fallbacks cannot be tracked: always run
+            volatile = body.fallbacks > 0
+
+            written = self._written(sorted(self.graph.writes[r]), gen)
+
+            condition = [f"D[{r}]"] + [gen.test(tt) for tt in self.graph.timing_tags[r]]
+            gen.line(f"# rung {rung.rung_id}")
+            gen.line("if True:" if volatile else f"if {' or '.join(condition)}:")
+            gen.line(f"    D[{r}] = 0; n_run += 1")
+            for k, (ref, _) in enumerate(written):
+                gen.line(f"    o{k} = {ref}")
+            gen.source.extend(body.source)
+            for k, (ref, tag_names) in enumerate(written):
+                dependents = sorted({d for tag_name in tag_names
+                                     for d in self.graph.dependents(tag_name)})
+                marks = ' = '.join(f"D[{d}]" for d in dependents)
+                gen.line(f"    if {ref} != o{k}: {marks} = 1")
+
+        gen.line("return n_run")
+        source = '\n'.join(gen.source) + '\n'
+        namespace = dict(gen.namespace)
+        exec(compile_source(source, self.name), namespace)
+        function = namespace[self.name]
+        function.source = source
+        return function
+
+    def _written(self, tag_names: List[str], gen) -> List[Tuple[str, List[str]]]:
+        """
+        (reference, tags) to compare before and after a rung runs: one
+        tag each, except runs of at least BLOCK_SLOTS consecutive slots
+        (arrays written by COP/FLL), compared as one slice
+        """
+        for tag_name in tag_names:
+            gen.ref(tag_name)
+        slots = sorted((self.tags.slot(tag_name), tag_name) for tag_name in tag_names)
+        runs = []
+        for (data_type, index), tag_name in slots:
+            if runs and runs[-1][0] == data_type and runs[-1][1] + len(runs[-1][2]) == index:
+                runs[-1][2].append(tag_name)
+            else:
+                runs.append((data_type, index, [tag_name]))
+
+        written = []
+        for data_type, index, names in runs:
+            if len(names) >= BLOCK_SLOTS:
+                written.append((f"{AREA_NAMES[data_type]}[{index}:{index + len(names)}]", names))
+            else:
+                written.extend((gen.ref(tag_name), [tag_name]) for tag_name in names)
+        return written
+
+    def _mark_external_changes(self) -> None:
+        """Mark rungs depending on tags changed since the previous scan"""
+        dirty = self.dirty
+        for area in AREAS:
+            dependents = self.dependents[area]
+            for index in changed_indices(self.baseline[area], self.tags.areas[area]):
+                for r in dependents.get(index, ()):
+                    dirty[r] = 1
+
+    def execute(self, dt: int) -> int:
+        """Run one incremental scan; returns the number of rungs evaluated"""
+        areas = self.tags.areas
+        if self.baseline is not None:
+            self._mark_external_changes()
+
+        count = self.scan_function(self.tags, dt, *[areas[area] for area in AREAS], self.dirty)
+        self.rungs_evaluated = count
+
+        self.baseline = {area: areas[area][:] for area in AREAS}
+        return count
+
+    def invalidate(self) -> None:
+        """Force every rung to run on the next scan"""
+        for r in range(len(self.dirty)):
+            self.dirty[r] = 1
@@ -0,0 +1,119 @@
+"""
+Input Filters
+Per-point digital filtering of inputs, applied by GPIOManager before
+the input image is copied into the tags.
+
+All filtered points share one filter bank whose state lives in flat
+arrays (one entry per point), updated once per input read - or per
+captured edge, using the edge timestamp, for inputs with "edge": "both".
+
+Filter types ("filter" key of an input in io_config.json):
+
+    {"type": "debounce", "on_ms": 20, "off_ms": 50}
+        The filtered value turns ON once the raw input has been ON for
+        on_ms, and OFF once it has been OFF for off_ms.
+    {"type": "glitch", "min_ms": 5}
+        Pulses (in either direction) shorter than min_ms are ignored
+        (a symmetric debounce).
+    {"type": "majority", "samples": 5}
+        The filtered value is the majority of the last N samples.
+"""
+
+from array import array
+from typing import Dict, List
+
+DEBOUNCE = 'debounce'
+GLITCH = 'glitch'
+MAJORITY = 'majority'
+FILTER_TYPES = (DEBOUNCE, GLITCH, MAJORITY)
+
+_TIMED, _MAJORITY = 0, 1
+
+
+class InputFilterBank:
+    """Filter state for all filtered inputs of a GPIOManager"""
+
+    def __init__(self):
+        self.slots: Dict[int, int] = {}       # input index -> filter slot
+        self.inputs: List[int] = []            # filter slot -> input index
+
+        self.kind = bytearray()
+        self.raw = bytearray()                 # last raw level
+        self.state = bytearray()               # filtered level
+        self.since_ns = array('q')             # time of the last raw change
+        self.on_ns = array('q')                # delay before accepting ON
+        self.off_ns = array('q')               # delay before accepting OFF
+        self.history = array('Q')              # majority: one bit per sample
+        self.mask = array('Q')
+        self.threshold = bytearray()
+
+    def __len__(self) -> int:
+        return len(self.inputs)
+
+    def add(self, input_index: int, config: Dict) -> None:
+        """Add a filter for an input from its "filter" config"""
+        filter_type = config.get('type', DEBOUNCE)
+        if filter_type not in FILTER_TYPES:
+            raise ValueError(f"Unknown input filter type: {filter_type}")
+
+        on_ms = off_ms = 0
+        samples = 1
+        if filter_type == DEBOUNCE:
+            on_ms, off_ms = config.get('on_ms', 0), config.get('off_ms', 0)
+        elif filter_type == GLITCH:
+            on_ms = off_ms = config['min_ms']
+        else:
+            samples = int(config['samples'])
+            if not 1 <= samples <= 63:
+                raise ValueError("Majority filter samples must be between 1 and 63")
+
+        self.slots[input_index] = len(self.inputs)
+        self.inputs.append(input_index)
+        self.kind.append(_MAJORITY if filter_type == MAJORITY else _TIMED)
+        self.raw.append(0)
+        self.state.append(0)
+        self.since_ns.append(0)
+        self.on_ns.append(int(on_ms * 1_000_000))
+        self.off_ns.append(int(off_ms * 1_000_000))
+        self.history.append(0)
+        self.mask.append((1 << samples) - 1)
+        self.threshold.append(samples // 2 + 1)
+
+    def update(self, slot: int, level: bool, now_ns: int) -> bool:
+        """Feed one raw sample (or edge) taken at now_ns; returns the filtered level"""
+        if self.kind[slot] == _MAJORITY:
+            history = ((self.history[slot] << 1) | level) & self.mask[slot]
+            self.history[slot] = history
+            state = bin(history).count('1') >= self.threshold[slot]
+            self.state[slot] = state
+            return state
+
+        raw = self.raw[slot]
+        if level != raw:
+            # Settle the previous level up to now, then start timing the new one
+            self._settle(slot, raw, now_ns)
+            self.raw[slot] = raw = level
+            self.since_ns[slot] = now_ns
+        return self._settle(slot, raw, now_ns)
+
+    def _settle(self, slot: int, raw: int, now_ns: int) -> bool:
+        state = self.state[slot]
+        if state != raw:
+            delay = self.on_ns[slot] if raw else self.off_ns[slot]
+            if now_ns - self.since_ns[slot] >= delay:
+                self.state[slot] = state = raw
+        return bool(state)
+
+    def apply(self, image: List[bool], now_ns: int) -> None:
+        """Filter the freshly read input image in place"""
+        update, kind, raw, state = self.update, self.kind, self.raw, self.state
+        for slot, index in enumerate(self.inputs):
+            level = image[index]
+            # Steady timed input: nothing to do
+            if level == raw[slot] == state[slot] and kind[slot] == _TIMED:
+                continue
+            image[index] = update(slot, level, now_ns)
+
+    def is_timed(self, input_index: int) -> bool:
+        slot = self.slots.get(input_index)
+        return slot is not None and self.kind[slot] == _TIMED
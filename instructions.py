@@ -0,0 +1,954 @@
+"""
+Ladder Logic Instructions
+Implements the standard PLC instruction set:
+contacts, branches, coils, timers, counters and word instructions
+(compare, move/math, array copy/fill).
+"""
+
+import ast
+import re
+from operator import add, sub, mul, truediv
+from typing import Any, Iterator, List
+from .tags import (TagDatabase, BOOL, DINT, TIMER_MEMBERS, COUNTER_MEMBERS,
+                   element, elements, split_element)
+from . import logic
+
+
+class Instruction:
+    """
+    Base class for all ladder logic instructions.
+    Each instruction receives the incoming rung state (power flow)
+    and returns the outgoing rung state.
+    """
+
+    def __init__(self, tag: str):
+        self.tag = tag
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        """Evaluate the instruction and return the new rung state"""
+        raise NotImplementedError
+
+    def declare(self, tags: TagDatabase) -> None:
+        """Allocate the tags this instruction writes, with their data types"""
+        tags.allocate(self.tag, BOOL)
+
+    def reads(self) -> List[str]:
+        """Tags whose value affects this instruction (incl. its own state)"""
+        return [self.tag]
+
+    def writes(self) -> List[str]:
+        """Tags this instruction may write"""
+        return [self.tag]
+
+    def condition(self):
+        """
+        Expression tree node (see logic.py) for instructions that only
+        test tags, or None for instructions with side effects
+        """
+        return None
+
+    def emit(self, gen) -> None:
+        """
+        Emit straight-line Python for the program compiler.
+        Instructions without a specialised translation fall back
+        to calling evaluate() from the generated code.
+        """
+        gen.emit_evaluate(self)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.tag})"
+
+
+# ---------------------------------------------------------------------------
+# Contacts
+# ---------------------------------------------------------------------------
+
+class XIC(Instruction):
+    """Examine If Closed - passes power when the tag is TRUE"""
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        return rung_state and bool(tags.get(self.tag, False))
+
+    def declare(self, tags: TagDatabase) -> None:
+        pass
+
+    def writes(self) -> List[str]:
+        return []
+
+    def condition(self):
+        return logic.literal(self.tag)
+
+    def emit(self, gen) -> None:
+        gen.line(f"s = s and {gen.test(self.tag)}")
+
+
+class XIO(Instruction):
+    """Examine If Open - passes power when the tag is FALSE"""
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        return rung_state and not tags.get(self.tag, False)
+
+    def declare(self, tags: TagDatabase) -> None:
+        pass
+
+    def writes(self) -> List[str]:
+        return []
+
+    def condition(self):
+        return logic.literal(self.tag, negated=True)
+
+    def emit(self, gen) -> None:
+        gen.line(f"s = s and not {gen.test(self.tag)}")
+
+
+class AFI(Instruction):
+    """Always False Instruction - blocks power (disables the rest of the rung)"""
+
+    def __init__(self):
+        super().__init__(None)
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        return False
+
+    def declare(self, tags: TagDatabase) -> None:
+        pass
+
+    def reads(self) -> List[str]:
+        return []
+
+    def writes(self) -> List[str]:
+        return []
+
+    def condition(self):
+        return logic.FALSE
+
+    def emit(self, gen) -> None:
+        gen.line("s = False")
+
+    def __repr__(self):
+        return "AFI()"
+
+
+# ---------------------------------------------------------------------------
+# Branches
+# ---------------------------------------------------------------------------
+
+class Branch(Instruction):
+    """
+    Parallel branch: each leg is evaluated with the incoming rung state
+    and the outgoing state is TRUE if any leg passes power. Every leg is
+    always evaluated, so coils, timers and counters on a leg see their
+    own leg's state. An empty leg is a plain wire.
+
+    Branches made of contacts only are compiled into short-circuiting
+    expressions (see logic.py).
+    """
+
+    def __init__(self, legs: List[List[Instruction]]):
+        super().__init__(None)
+        self.legs = legs
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        result = False
+        for leg in self.legs:
+            leg_state = rung_state
+            for instruction in leg:
+                leg_state = instruction.evaluate(tags, leg_state)
+            result = result or leg_state
+        return result
+
+    def declare(self, tags: TagDatabase) -> None:
+        for instruction in self.legs_instructions():
+            instruction.declare(tags)
+
+    def legs_instructions(self) -> List[Instruction]:
+        return [instruction for leg in self.legs for instruction in leg]
+
+    def reads(self) -> List[str]:
+        return list(dict.fromkeys(tag_name for instruction in self.legs_instructions()
+                                  for tag_name in instruction.reads()))
+
+    def writes(self) -> List[str]:
+        return list(dict.fromkeys(tag_name for instruction in self.legs_instructions()
+                                  for tag_name in instruction.writes()))
+
+    def condition(self):
+        legs = [[instruction.condition() for instruction in leg] for leg in self.legs]
+        if any(node is None for leg in legs for node in leg):
+            return None
+        return logic.disjunction([logic.conjunction(leg) for leg in legs])
+
+    def emit(self, gen) -> None:
+        incoming, result = gen.temp('b'), gen.temp('t')
+        gen.line(f"{incoming} = s")
+        for k, leg in enumerate(self.legs):
+            if k:
+                gen.line(f"s = {incoming}")
+            gen.emit_instructions(leg)
+            gen.line(f"{result} = s" if k == 0 else f"{result} = {result} or s")
+        gen.line(f"s = {result}" if self.legs else "s = False")
+
+    def __repr__(self):
+        return f"Branch({', '.join(repr(leg) for leg in self.legs)})"
+
+
+def walk(instructions: List[Instruction]) -> Iterator[Instruction]:
+    """Instructions in program order, including those on branch legs"""
+    for instruction in instructions:
+        yield instruction
+        if isinstance(instruction, Branch):
+            yield from walk(instruction.legs_instructions())
+
+
+# ---------------------------------------------------------------------------
+# Coils
+# ---------------------------------------------------------------------------
+
+class OTE(Instruction):
+    """Output Energize - tag follows the rung state"""
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        tags.set(self.tag, rung_state)
+        return rung_state
+
+    def reads(self) -> List[str]:
+        return []
+
+    def emit(self, gen) -> None:
+        gen.line(gen.assign(self.tag, 's'))
+
+
+class OTL(Instruction):
+    """Output Latch - sets the tag TRUE when the rung is TRUE"""
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        if rung_state:
+            tags.set(self.tag, True)
+        return rung_state
+
+    def reads(self) -> List[str]:
+        return []
+
+    def emit(self, gen) -> None:
+        gen.line(f"if s: {gen.assign(self.tag, 'True')}")
+
+
+class OTU(Instruction):
+    """Output Unlatch - sets the tag FALSE when the rung is TRUE"""
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        if rung_state:
+            tags.set(self.tag, False)
+        return rung_state
+
+    def reads(self) -> List[str]:
+        return []
+
+    def emit(self, gen) -> None:
+        gen.line(f"if s: {gen.assign(self.tag, 'False')}")
+
+
+class OSR(Instruction):
+    """
+    One Shot Rising - TRUE for exactly one scan on a rising rung edge.
+    The previous rung state is kept in the storage bit TAG.SB.
+    """
+
+    def __init__(self, tag: str):
+        super().__init__(tag)
+        self.sb_tag = f"{tag}.SB"
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        pulse = rung_state and not tags.get(self.sb_tag, False)
+        tags.set(self.sb_tag, rung_state)
+        tags.set(self.tag, pulse)
+        return pulse
+
+    def declare(self, tags: TagDatabase) -> None:
+        tags.allocate(self.sb_tag, BOOL)
+        tags.allocate(self.tag, BOOL)
+
+    def reads(self) -> List[str]:
+        return [self.sb_tag]
+
+    def writes(self) -> List[str]:
+        return [self.sb_tag, self.tag]
+
+    def emit(self, gen) -> None:
+        gen.line(f"s, p = s and not {gen.test(self.sb_tag)}, s")
+        gen.line(gen.assign(self.sb_tag, 'p'))
+        gen.line(gen.assign(self.tag, 's'))
+
+
+# ---------------------------------------------------------------------------
+# Timers
+# ---------------------------------------------------------------------------
+
+class Timer(Instruction):
+    """
+    Common base for TON/TOF.
+    Timers accumulate tags.delta_ms, the whole milliseconds elapsed
+    since the previous scan, so they never read the clock themselves.
+
+    Accumulation is not done by the instruction: all timers of a scan
+    (or task) are advanced in one pass before the first rung (advance(),
+    or the pass the compiler emits over each block of timers; see
+    TagDatabase.allocate_block). The instruction then only updates the
+    status bits from its rung state, or resets the timer.
+    """
+
+    members = TIMER_MEMBERS
+
+    # Status bit that selects timers for the advance pass
+    advance_member = 'TT'
+
+    def __init__(self, tag: str, preset: int):
+        super().__init__(tag)
+        self.preset = int(preset)
+        self.en_tag = f"{tag}.EN"
+        self.tt_tag = f"{tag}.TT"
+        self.dn_tag = f"{tag}.DN"
+        self.acc_tag = f"{tag}.ACC"
+        self.pre_tag = f"{tag}.PRE"
+
+    def declare(self, tags: TagDatabase) -> None:
+        tags.allocate_block([self.tag], self.members, {self.pre_tag: self.preset})
+
+    def reads(self) -> List[str]:
+        return [self.en_tag, self.tt_tag, self.dn_tag, self.acc_tag, self.pre_tag]
+
+    def writes(self) -> List[str]:
+        return [self.en_tag, self.tt_tag, self.dn_tag, self.acc_tag, self.pre_tag]
+
+    def advance(self, tags: TagDatabase) -> None:
+        """Reference advance pass for this timer (start of the scan)"""
+        raise NotImplementedError
+
+    @staticmethod
+    def advance_value(acc: str, pre: str, dn: str, step: str = 'dt') -> str:
+        """
+        Expression for a timer's new ACC, given expressions for its ACC,
+        PRE and DN members and the time to add (dt for a selected timer;
+        a block may pass `dt * selected`, so a zero step must leave ACC
+        unchanged). The accumulator only moves while below the preset.
+        """
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.tag}, {self.preset})"
+
+
+class TON(Timer):
+    """Timer On Delay - DN goes TRUE after the rung has been TRUE for PRE ms"""
+
+    def advance(self, tags: TagDatabase) -> None:
+        # Enabled and not done at its last evaluation
+        if tags.get(self.tt_tag, False):
+            preset = tags.get(self.pre_tag, self.preset)
+            acc = tags.get(self.acc_tag, 0)
+            if acc < preset:
+                tags.set(self.acc_tag, min(preset, acc + tags.delta_ms))
+
+    @staticmethod
+    def advance_value(acc: str, pre: str, dn: str, step: str = 'dt') -> str:
+        return f"((y if (y := {acc} + {step}) < {pre} else {pre}) if {acc} < {pre} else {acc})"
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        preset = tags.get(self.pre_tag, self.preset)
+
+        if rung_state:
+            done = tags.get(self.acc_tag, 0) >= preset
+            tags.set(self.en_tag, True)
+            tags.set(self.tt_tag, not done)
+            tags.set(self.dn_tag, done)
+        else:
+            tags.set(self.en_tag, False)
+            tags.set(self.tt_tag, False)
+            tags.set(self.dn_tag, False)
+            tags.set(self.acc_tag, 0)
+
+        tags.set(self.pre_tag, preset)
+        return rung_state
+
+    def emit(self, gen) -> None:
+        gen.lines([
+            "if s:",
+            f"    d = {gen.get(self.acc_tag, 0)} >= {gen.get(self.pre_tag, self.preset)}",
+            f"    {gen.assign(self.en_tag, 'True')}",
+            f"    {gen.assign(self.tt_tag, 'not d')}",
+            f"    {gen.assign(self.dn_tag, 'd')}",
+            "else:",
+            f"    {gen.assign(self.en_tag, 'False')}",
+            f"    {gen.assign(self.tt_tag, 'False')}",
+            f"    {gen.assign(self.dn_tag, 'False')}",
+            f"    {gen.assign(self.acc_tag, '0')}",
+        ])
+
+
+class TOF(Timer):
+    """Timer Off Delay - DN stays TRUE for PRE ms after the rung goes FALSE"""
+
+    def advance(self, tags: TagDatabase) -> None:
+        # Timing since the rung went false
+        if tags.get(self.tt_tag, False) and tags.get(self.dn_tag, False):
+            preset = tags.get(self.pre_tag, self.preset)
+            acc = tags.get(self.acc_tag, 0)
+            if acc < preset:
+                tags.set(self.acc_tag, min(preset, acc + tags.delta_ms))
+
+    @staticmethod
+    def advance_value(acc: str, pre: str, dn: str, step: str = 'dt') -> str:
+        return f"((y if (y := {acc} + {step}) < {pre} else {pre}) if {dn} and {acc} < {pre} else {acc})"
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        preset = tags.get(self.pre_tag, self.preset)
+
+        if rung_state:
+            tags.set(self.en_tag, True)
+            tags.set(self.tt_tag, False)
+            tags.set(self.dn_tag, True)
+            tags.set(self.acc_tag, 0)
+        else:
+            tags.set(self.en_tag, False)
+            if tags.get(self.dn_tag, False):
+                timing = tags.get(self.acc_tag, 0) < preset
+                tags.set(self.tt_tag, timing)
+                tags.set(self.dn_tag, timing)
+
+        tags.set(self.pre_tag, preset)
+        return rung_state
+
+    def emit(self, gen) -> None:
+        gen.lines([
+            "if s:",
+            f"    {gen.assign(self.en_tag, 'True')}",
+            f"    {gen.assign(self.tt_tag, 'False')}",
+            f"    {gen.assign(self.dn_tag, 'True')}",
+            f"    {gen.assign(self.acc_tag, '0')}",
+            "else:",
+            f"    {gen.assign(self.en_tag, 'False')}",
+            f"    if {gen.test(self.dn_tag)}:",
+            f"        d = {gen.get(self.acc_tag, 0)} < {gen.get(self.pre_tag, self.preset)}",
+            f"        {gen.assign(self.tt_tag, 'd')}",
+            f"        {gen.assign(self.dn_tag, 'd')}",
+        ])
+
+
+def timers(rungs) -> List[Timer]:
+    """The timers of the given rungs (first instruction per timer tag)"""
+    found = {}
+    for rung in rungs:
+        for instruction in walk(rung.instructions):
+            if isinstance(instruction, Timer):
+                found.setdefault(instruction.tag, instruction)
+    return list(found.values())
+
+
+# ---------------------------------------------------------------------------
+# Counters
+# ---------------------------------------------------------------------------
+
+class Counter(Instruction):
+    """Common base for CTU/CTD (edge bit, DN, ACC, PRE)"""
+
+    members = COUNTER_MEMBERS
+    edge_member = 'CU'
+    step = 1
+
+    def __init__(self, tag: str, preset: int, reset_tag: str = None):
+        super().__init__(tag)
+        self.preset = int(preset)
+        self.reset_tag = reset_tag
+        self.edge_tag = f"{tag}.{self.edge_member}"
+        self.dn_tag = f"{tag}.DN"
+        self.acc_tag = f"{tag}.ACC"
+        self.pre_tag = f"{tag}.PRE"
+
+    def declare(self, tags: TagDatabase) -> None:
+        tags.allocate_block([self.tag], self.members, {self.pre_tag: self.preset})
+
+    def reads(self) -> List[str]:
+        members = [self.edge_tag, self.acc_tag, self.pre_tag]
+        if self.reset_tag:
+            members.append(self.reset_tag)
+        return members
+
+    def writes(self) -> List[str]:
+        return [self.edge_tag, self.dn_tag, self.acc_tag, self.pre_tag]
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        preset = tags.get(self.pre_tag, self.preset)
+        acc = tags.get(self.acc_tag, 0)
+
+        # Count on the false-to-true transition of the rung
+        if rung_state and not tags.get(self.edge_tag, False):
+            acc += self.step
+
+        if self.reset_tag and tags.get(self.reset_tag, False):
+            acc = 0
+
+        tags.set(self.edge_tag, rung_state)
+        tags.set(self.acc_tag, acc)
+        tags.set(self.dn_tag, acc >= preset)
+        tags.set(self.pre_tag, preset)
+        return rung_state
+
+    def emit(self, gen) -> None:
+        code = [
+            f"n = {gen.get(self.pre_tag, self.preset)}",
+            f"a = {gen.get(self.acc_tag, 0)}",
+            f"if s and not {gen.test(self.edge_tag)}: a = a + {self.step}",
+        ]
+        if self.reset_tag:
+            code.append(f"if {gen.test(self.reset_tag)}: a = 0")
+        code += [
+            gen.assign(self.edge_tag, 's'),
+            gen.assign(self.acc_tag, 'a'),
+            gen.assign(self.dn_tag, 'a >= n'),
+        ]
+        gen.lines(code)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.tag}, {self.preset})"
+
+
+class CTU(Counter):
+    """Count Up - increments ACC on each rising edge, optional reset tag"""
+
+    edge_member = 'CU'
+    step = 1
+
+
+class CTD(Counter):
+    """Count Down - decrements ACC on each rising edge"""
+
+    edge_member = 'CD'
+    step = -1
+
+    def __init__(self, tag: str, preset: int):
+        super().__init__(tag, preset)
+
+
+# ---------------------------------------------------------------------------
+# Word instructions
+# Operands are tag names or numeric constants. Operand and destination
+# tags not declared in the program's "tags" (or by another instruction)
+# are DINT. Results are converted to the destination's type as by
+# TagDatabase.set (truncated for DINT). A result that cannot be stored
+# (division by zero, overflow) leaves the destination unchanged.
+# ---------------------------------------------------------------------------
+
+# Errors of a result that cannot be stored
+MATH_ERRORS = (ArithmeticError, ValueError)
+
+
+def _read(tags: TagDatabase, operand: Any) -> Any:
+    return tags.get(operand, 0) if isinstance(operand, str) else operand
+
+
+def _tags(*operands: Any) -> List[str]:
+    return [operand for operand in operands if isinstance(operand, str)]
+
+
+def _declare_numbers(tags: TagDatabase, tag_names: List[str]) -> None:
+    for tag_name in tag_names:
+        tags.allocate(tag_name, DINT)
+
+
+def _emit_guarded(gen, statements: List[str]) -> None:
+    """Emit statements run when the rung is TRUE and skipped on MATH_ERRORS"""
+    errors = ', '.join(error.__name__ for error in MATH_ERRORS)
+    gen.lines(["if s:", "    try:"] + [f"        {statement}" for statement in statements] +
+              [f"    except ({errors}):", "        pass"])
+
+
+class Compare(Instruction):
+    """Common base for EQU/NEQ/GRT/GEQ/LES/LEQ: passes power when `a symbol b`"""
+
+    symbol = None
+
+    def __init__(self, source_a: Any, source_b: Any):
+        super().__init__(None)
+        self.source_a = source_a
+        self.source_b = source_b
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        return rung_state and logic.COMPARISONS[self.symbol](
+            _read(tags, self.source_a), _read(tags, self.source_b))
+
+    def declare(self, tags: TagDatabase) -> None:
+        _declare_numbers(tags, self.reads())
+
+    def reads(self) -> List[str]:
+        return _tags(self.source_a, self.source_b)
+
+    def writes(self) -> List[str]:
+        return []
+
+    def condition(self):
+        return logic.compare(self.symbol, self.source_a, self.source_b)
+
+    def emit(self, gen) -> None:
+        text, _ = logic.expression(gen, self.condition())
+        gen.line(f"s = s and {text}")
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.source_a}, {self.source_b})"
+
+
+class EQU(Compare):
+    """Equal - passes power when source A == source B"""
+    symbol = '=='
+
+
+class NEQ(Compare):
+    """Not Equal - passes power when source A != source B"""
+    symbol = '!='
+
+
+class GRT(Compare):
+    """Greater Than - passes power when source A > source B"""
+    symbol = '>'
+
+
+class GEQ(Compare):
+    """Greater Than or Equal - passes power when source A >= source B"""
+    symbol = '>='
+
+
+class LES(Compare):
+    """Less Than - passes power when source A < source B"""
+    symbol = '<'
+
+
+class LEQ(Compare):
+    """Less Than or Equal - passes power when source A <= source B"""
+    symbol = '<='
+
+
+class LIM(Instruction):
+    """
+    Limit Test - passes power when low <= test <= high; if low > high,
+    when test is outside the range (test >= low or test <= high)
+    """
+
+    def __init__(self, low: Any, test: Any, high: Any):
+        super().__init__(None)
+        self.low = low
+        self.test = test
+        self.high = high
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        low, test, high = (_read(tags, operand) for operand in (self.low, self.test, self.high))
+        if low <= high:
+            return rung_state and low <= test <= high
+        return rung_state and low > high and (test >= low or test <= high)
+
+    def declare(self, tags: TagDatabase) -> None:
+        _declare_numbers(tags, self.reads())
+
+    def reads(self) -> List[str]:
+        return _tags(self.low, self.test, self.high)
+
+    def writes(self) -> List[str]:
+        return []
+
+    def condition(self):
+        inside = logic.conjunction([logic.compare('<=', self.low, self.test),
+                                    logic.compare('<=', self.test, self.high)])
+        outside = logic.disjunction([logic.compare('>=', self.test, self.low),
+                                     logic.compare('<=', self.test, self.high)])
+        return logic.disjunction([
+            logic.conjunction([logic.compare('<=', self.low, self.high), inside]),
+            logic.conjunction([logic.compare('>', self.low, self.high), outside]),
+        ])
+
+    def emit(self, gen) -> None:
+        text, _ = logic.expression(gen, self.condition())
+        gen.line(f"s = s and ({text})")
+
+    def __repr__(self):
+        return f"LIM({self.low}, {self.test}, {self.high})"
+
+
+class MOV(Instruction):
+    """Move - writes source to dest when the rung is TRUE"""
+
+    def __init__(self, source: Any, dest: str):
+        super().__init__(dest)
+        self.source = source
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        if rung_state:
+            try:
+                tags.set(self.tag, _read(tags, self.source))
+            except MATH_ERRORS:
+                pass
+        return rung_state
+
+    def declare(self, tags: TagDatabase) -> None:
+        _declare_numbers(tags, self.reads() + [self.tag])
+
+    def reads(self) -> List[str]:
+        return _tags(self.source)
+
+    def emit(self, gen) -> None:
+        value = gen.operand(self.source)
+        _emit_guarded(gen, [gen.store(self.tag, value, gen.integral(self.source))])
+
+    def __repr__(self):
+        return f"MOV({self.source}, {self.tag})"
+
+
+class Math(Instruction):
+    """Common base for ADD/SUB/MUL/DIV: dest = source A (symbol) source B when the rung is TRUE"""
+
+    symbol = None
+    function = None
+
+    def __init__(self, source_a: Any, source_b: Any, dest: str):
+        super().__init__(dest)
+        self.source_a = source_a
+        self.source_b = source_b
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        if rung_state:
+            try:
+                tags.set(self.tag, self.function(_read(tags, self.source_a),
+                                                 _read(tags, self.source_b)))
+            except MATH_ERRORS:
+                pass
+        return rung_state
+
+    def declare(self, tags: TagDatabase) -> None:
+        _declare_numbers(tags, self.reads() + [self.tag])
+
+    def reads(self) -> List[str]:
+        return _tags(self.source_a, self.source_b)
+
+    def integral(self, gen) -> bool:
+        return gen.integral(self.source_a, self.source_b)
+
+    def emit(self, gen) -> None:
+        value = f"{gen.operand(self.source_a)} {self.symbol} {gen.operand(self.source_b)}"
+        _emit_guarded(gen, [gen.store(self.tag, value, self.integral(gen))])
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.source_a}, {self.source_b}, {self.tag})"
+
+
+class ADD(Math):
+    """Add - dest = source A + source B"""
+    symbol = '+'
+    function = staticmethod(add)
+
+
+class SUB(Math):
+    """Subtract - dest = source A - source B"""
+    symbol = '-'
+    function = staticmethod(sub)
+
+
+class MUL(Math):
+    """Multiply - dest = source A * source B"""
+    symbol = '*'
+    function = staticmethod(mul)
+
+
+class DIV(Math):
+    """Divide - dest = source A / source B (truncated for a DINT dest)"""
+    symbol = '/'
+    function = staticmethod(truediv)
+
+    def integral(self, gen) -> bool:
+        return False
+
+
+# CPT expression syntax: operators and functions (-> Python builtins)
+_CPT_OPERATORS = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/'}
+_CPT_FUNCTIONS = {'ABS': ('abs', 1), 'MIN': ('min', 2), 'MAX': ('max', 2)}
+_TAG_NAME = re.compile(r'^[A-Za-z_]\w*(\.\w+|\[\d+\])*$')
+
+
+class CPT(Instruction):
+    """
+    Compute - dest = expression when the rung is TRUE. The expression
+    uses + - * / (true division), parentheses, ABS(x), MIN(a, b, ...),
+    MAX(a, b, ...), numbers and tags (T1.ACC, RECIPE[3]), e.g.
+    "(RAW - 4000) * 100.0 / 16000".
+    """
+
+    def __init__(self, dest: str, expression: str):
+        super().__init__(dest)
+        self.expression = expression
+        try:
+            self.tree = ast.parse(expression.strip(), mode='eval').body
+        except SyntaxError as e:
+            raise ValueError(f"CPT {dest}: invalid expression {expression!r}") from e
+        self.sources: List[str] = []
+        self.render(self._source)
+        self.divides = any(isinstance(node, ast.BinOp) and isinstance(node.op, ast.Div)
+                           for node in ast.walk(self.tree))
+        self.constants = [node.value for node in ast.walk(self.tree)
+                          if isinstance(node, ast.Constant)]
+
+        # Reference implementation over the values of self.sources
+        text = self.render(lambda tag_name: f"v[{self.sources.index(tag_name)}]")
+        self.function = eval(f"lambda v: {text}", {'__builtins__': {}, 'abs': abs,
+                                                   'min': min, 'max': max})
+
+    def _source(self, tag_name: str) -> str:
+        if tag_name not in self.sources:
+            self.sources.append(tag_name)
+        return tag_name
+
+    def render(self, ref, functions=None, node=None) -> str:
+        """
+        The expression as Python source, with `ref(tag)` for each tag;
+        `functions` maps ABS/MIN/MAX to other callables' names
+        """
+        node = self.tree if node is None else node
+        functions = functions or {}
+        if isinstance(node, ast.BinOp) and type(node.op) in _CPT_OPERATORS:
+            return (f"({self.render(ref, functions, node.left)} {_CPT_OPERATORS[type(node.op)]} "
+                    f"{self.render(ref, functions, node.right)})")
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            sign = '-' if isinstance(node.op, ast.USub) else '+'
+            return f"({sign}{self.render(ref, functions, node.operand)})"
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            return repr(node.value)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and \
+                node.func.id.upper() in _CPT_FUNCTIONS and not node.keywords:
+            name, arity = _CPT_FUNCTIONS[node.func.id.upper()]
+            if len(node.args) == arity or (arity > 1 and len(node.args) > arity):
+                args = ', '.join(self.render(ref, functions, arg) for arg in node.args)
+                return f"{functions.get(name, name)}({args})"
+        if isinstance(node, (ast.Name, ast.Attribute, ast.Subscript)):
+            tag_name = ast.unparse(node)
+            if _TAG_NAME.match(tag_name):
+                return ref(tag_name)
+        raise ValueError(f"CPT {self.tag}: unsupported {ast.unparse(node)!r} "
+                         f"in {self.expression!r}")
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        if rung_state:
+            try:
+                tags.set(self.tag, self.function([tags.get(tag_name, 0)
+                                                  for tag_name in self.sources]))
+            except MATH_ERRORS:
+                pass
+        return rung_state
+
+    def declare(self, tags: TagDatabase) -> None:
+        _declare_numbers(tags, self.reads() + [self.tag])
+
+    def reads(self) -> List[str]:
+        return list(self.sources)
+
+    def emit(self, gen) -> None:
+        value = self.render(lambda tag_name: gen.get(tag_name, 0))
+        integral = not self.divides and gen.integral(*self.sources, *self.constants)
+        _emit_guarded(gen, [gen.store(self.tag, value, integral)])
+
+    def __repr__(self):
+        return f"CPT({self.tag}, {self.expression!r})"
+
+
+class FileInstruction(Instruction):
+    """
+    Common base for COP/FLL: work on `length` consecutive elements of
+    an array tag (dest is an element, e.g. RECIPE[10], or an array
+    name), compiled into one slice assignment. An array used by a file
+    instruction but not declared is created as a DINT array.
+    """
+
+    def __init__(self, source: Any, dest: str, length: int):
+        super().__init__(dest)
+        self.source = source
+        self.length = int(length)
+        self.dest_elements = elements(dest, self.length)
+
+    def declare(self, tags: TagDatabase) -> None:
+        _declare_numbers(tags, _tags(self.source))
+        _declare_block(tags, self.tag, self.length)
+
+    def writes(self) -> List[str]:
+        return list(self.dest_elements)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.source}, {self.tag}, {self.length})"
+
+
+def _declare_block(tags: TagDatabase, tag_name: str, length: int) -> None:
+    """Check (or create, as DINT) the array elements a file instruction uses"""
+    name, first = split_element(tag_name)
+    if not tags.exists(element(name, 0)):
+        tags.allocate_array(name, DINT, first + length)
+    tags.block(tag_name, length)
+
+
+class COP(FileInstruction):
+    """
+    Copy File - copies `length` elements from the source array to dest
+    when the rung is TRUE (as if through a buffer, so ranges of one
+    array may overlap)
+    """
+
+    def __init__(self, source: str, dest: str, length: int):
+        super().__init__(source, dest, length)
+        self.source_elements = elements(source, self.length)
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        if rung_state:
+            try:
+                tags.set_block(self.tag, tags.get_block(self.source, self.length))
+            except MATH_ERRORS:
+                pass
+        return rung_state
+
+    def declare(self, tags: TagDatabase) -> None:
+        _declare_block(tags, self.source, self.length)
+        _declare_block(tags, self.tag, self.length)
+
+    def reads(self) -> List[str]:
+        return list(self.source_elements)
+
+    def emit(self, gen) -> None:
+        source_type, source = gen.block(self.source, self.length)
+        data_type, target = gen.block(self.tag, self.length)
+        value = gen.block_value(data_type, source, source_type)
+        _emit_guarded(gen, gen.write_block(target, value))
+
+
+class FLL(FileInstruction):
+    """File Fill - writes source (a tag or number) to `length` elements of dest when the rung is TRUE"""
+
+    def evaluate(self, tags: TagDatabase, rung_state: bool) -> bool:
+        if rung_state:
+            try:
+                tags.set_block(self.tag, [_read(tags, self.source)] * self.length)
+            except MATH_ERRORS:
+                pass
+        return rung_state
+
+    def reads(self) -> List[str]:
+        return _tags(self.source)
+
+    def emit(self, gen) -> None:
+        data_type, target = gen.block(self.tag, self.length)
+        value = gen.fill_value(data_type, gen.operand(self.source), self.length,
+                               gen.integral(self.source))
+        _emit_guarded(gen, gen.write_block(target, value))
+
+
+__all__: List[str] = [
+    'Instruction',
+    'XIC', 'XIO', 'AFI',
+    'Branch', 'walk',
+    'OTE', 'OTL', 'OTU', 'OSR',
+    'Timer', 'TON', 'TOF', 'timers',
+    'Counter', 'CTU', 'CTD',
+    'Compare', 'EQU', 'NEQ', 'GRT', 'GEQ', 'LES', 'LEQ', 'LIM',
+    'MOV', 'Math', 'ADD', 'SUB', 'MUL', 'DIV', 'CPT',
+    'FileInstruction', 'COP', 'FLL',
+]
@@ -0,0 +1,276 @@
+"""
+Rung Logic Optimizer
+Builds boolean expression trees from the condition part of rungs
+(contacts, compares, AFI and branches of them) for the program compiler:
+
+    - consecutive series contacts and parallel branches become one
+      short-circuiting Python expression instead of one statement per
+      contact,
+    - constants are folded (AFI, empty branch legs, A and not A,
+      A or not A), duplicate terms and absorbed terms are dropped
+      (A or (A and B) -> A), and terms common to every leg of a branch
+      are factored out ((A and B) or (A and C) -> A and (B or C)),
+    - sub-expressions used by several rungs are evaluated once into a
+      local and reused for as long as none of their tags is written.
+
+Instructions with side effects (coils, one-shots, timers, counters and
+branches containing them) are still emitted one by one with the rung
+state at their position, so outputs see the same rung state as in the
+interpreter.
+
+Nodes are tuples: ('const', bool), ('lit', tag, negated),
+('cmp', symbol, a, b) with operands that are tag names or numbers,
+('and', children) and ('or', children).
+"""
+
+from collections import defaultdict
+from operator import eq, ne, gt, ge, lt, le
+from typing import Dict, List, Optional, Tuple
+
+TRUE = ('const', True)
+FALSE = ('const', False)
+
+AND = 'and'
+OR = 'or'
+
+# Comparison operators of 'cmp' nodes
+COMPARISONS = {'==': eq, '!=': ne, '>': gt, '>=': ge, '<': lt, '<=': le}
+
+
+def literal(tag_name: str, negated: bool = False) -> tuple:
+    return ('lit', tag_name, negated)
+
+
+def compare(symbol: str, a, b) -> tuple:
+    """Comparison of two operands (tag names or numbers), e.g. compare('<', 'LEVEL', 80)"""
+    if not isinstance(a, str) and not isinstance(b, str):
+        return TRUE if COMPARISONS[symbol](a, b) else FALSE
+    return ('cmp', symbol, a, b)
+
+
+def key(node: tuple):
+    """Order-independent identity of a node (a and b == b and a)"""
+    if node[0] in (AND, OR):
+        return (node[0], frozenset(key(child) for child in node[1]))
+    return node
+
+
+def conjunction(terms: List[tuple]) -> tuple:
+    return _combine(AND, terms)
+
+
+def disjunction(terms: List[tuple]) -> tuple:
+    node = _combine(OR, terms)
+    if node[0] != OR:
+        return node
+
+    # Factor out terms shared by every leg
+    legs = [leg[1] if leg[0] == AND else (leg,) for leg in node[1]]
+    common = set.intersection(*({key(term) for term in leg} for leg in legs))
+    if not common:
+        return node
+    shared = [term for term in legs[0] if key(term) in common]
+    rests = [conjunction([term for term in leg if key(term) not in common]) for leg in legs]
+    return conjunction(shared + [disjunction(rests)])
+
+
+def _combine(kind: str, terms: List[tuple]) -> tuple:
+    unit, zero = (TRUE, FALSE) if kind == AND else (FALSE, TRUE)
+
+    flat = []
+    for term in terms:
+        flat.extend(term[1] if term[0] == kind else (term,))
+
+    result, seen = [], set()
+    for term in flat:
+        if term == unit:
+            continue
+        if term == zero:
+            return zero
+        term_key = key(term)
+        if term_key in seen:
+            continue
+        if term[0] == 'lit' and literal(term[1], not term[2]) in seen:
+            # A and not A / A or not A
+            return zero
+        seen.add(term_key)
+        result.append(term)
+
+    # Absorption: A and (A or B) -> A, A or (A and B) -> A
+    result = [term for term in result
+              if term[0] not in (AND, OR) or term[0] == kind
+              or not any(key(child) in seen for child in term[1])]
+
+    if not result:
+        return unit
+    if len(result) == 1:
+        return result[0]
+    return (kind, tuple(result))
+
+
+def tags(node: tuple) -> set:
+    """Tags a node reads"""
+    if node[0] == 'lit':
+        return {node[1]}
+    if node[0] == 'cmp':
+        return {operand for operand in node[2:] if isinstance(operand, str)}
+    if node[0] == 'const':
+        return set()
+    return set().union(*(tags(child) for child in node[1]))
+
+
+# ---------------------------------------------------------------------------
+# Rung plans
+# ---------------------------------------------------------------------------
+
+class Step:
+    """
+    One step of a rung: either a condition (`node`, ANDed into the rung
+    state) or an instruction emitted as is. `define` and `use` map node
+    keys to the locals shared sub-expressions are stored in.
+    """
+
+    __slots__ = ('node', 'instruction', 'define', 'use')
+
+    def __init__(self, node: tuple = None, instruction=None):
+        self.node = node
+        self.instruction = instruction
+        self.define: Dict = {}
+        self.use: Dict = {}
+
+
+def plan(instructions: List) -> List[Step]:
+    """Split a rung into condition steps (runs of pure instructions) and instructions"""
+    steps = []
+    pending = []
+    for instruction in instructions:
+        node = instruction.condition()
+        if node is not None:
+            pending.append(node)
+            continue
+        if pending:
+            steps.append(Step(node=conjunction(pending)))
+            pending = []
+        steps.append(Step(instruction=instruction))
+    if pending:
+        steps.append(Step(node=conjunction(pending)))
+    return steps
+
+
+def plan_rungs(rungs: List) -> List[List[Step]]:
+    """
+    Plans for a sequence of rungs compiled into one function, with
+    sub-expressions shared across rungs. A compound node seen again
+    while none of its tags has been written since it was first
+    evaluated is computed once (unconditionally, at its first use) and
+    reused from a local.
+    """
+    plans = [plan(rung.instructions) for rung in rungs]
+
+    live: Dict = {}                       # node key -> occurrence id
+    by_tag: Dict[str, set] = defaultdict(set)
+    occurrences: List[Tuple[Step, object]] = []
+    reuses: List[Tuple[Step, object, int]] = []
+
+    def visit(step: Step, node: tuple) -> None:
+        if node[0] not in (AND, OR):
+            return
+        node_key = key(node)
+        if node_key in live:
+            reuses.append((step, node_key, live[node_key]))
+            return
+        live[node_key] = len(occurrences)
+        occurrences.append((step, node_key))
+        for tag_name in tags(node):
+            by_tag[tag_name].add(node_key)
+        for child in node[1]:
+            visit(step, child)
+
+    for steps in plans:
+        for step in steps:
+            if step.node is not None:
+                visit(step, step.node)
+                continue
+            for tag_name in step.instruction.writes():
+                for node_key in by_tag.pop(tag_name, ()):
+                    live.pop(node_key, None)
+
+    names = {}
+    for step, node_key, occurrence in reuses:
+        defining_step, _ = occurrences[occurrence]
+        if step is defining_step:
+            # Repeated within one expression: not worth a local
+            continue
+        if occurrence not in names:
+            names[occurrence] = f"e{len(names)}"
+            defining_step.define[node_key] = names[occurrence]
+        step.use[node_key] = names[occurrence]
+    return plans
+
+
+# ---------------------------------------------------------------------------
+# Emission
+# ---------------------------------------------------------------------------
+
+def expression(gen, node: tuple, step: Step = None) -> Tuple[str, str]:
+    """Python source for a node and its precedence ('atom', 'and' or 'or')"""
+    kind = node[0]
+    if kind == 'const':
+        return ('True' if node[1] else 'False'), 'atom'
+    if kind == 'lit':
+        return gen.truth(node[1], node[2]), 'atom'
+    if kind == 'cmp':
+        return f"{gen.operand(node[2])} {node[1]} {gen.operand(node[3])}", 'atom'
+
+    node_key = key(node) if step is not None and (step.use or step.define) else None
+    if node_key is not None and node_key in step.use:
+        return step.use[node_key], 'atom'
+
+    parts = []
+    for child in node[1]:
+        text, precedence = expression(gen, child, step)
+        if kind == AND and precedence == OR:
+            text = f"({text})"
+        parts.append(text)
+    text = f" {kind} ".join(parts)
+
+    if node_key is not None and node_key in step.define:
+        name = step.define[node_key]
+        gen.line(f"{name} = {text}")
+        return name, 'atom'
+    return text, kind
+
+
+def emit_steps(gen, steps: List[Step], state: Optional[bool] = None) -> None:
+    """
+    Emit a planned instruction sequence. `state` is the rung state
+    known at compile time (True at the start of a rung, where `s` is
+    not assigned yet; None if only known at run time).
+    """
+    assigned = state is None
+    for step in steps:
+        if step.node is None:
+            if not assigned:
+                gen.line(f"s = {state}")
+                assigned = True
+            step.instruction.emit(gen)
+            state = None
+            continue
+
+        node = step.node
+        if state is False or (state is None and node == TRUE):
+            continue
+        text, precedence = expression(gen, node, step)
+        if state is None and node != FALSE:
+            gen.line(f"s = s and ({text})" if precedence == OR else f"s = s and {text}")
+        else:
+            gen.line(f"s = {text}")
+        assigned = True
+        state = node[1] if node[0] == 'const' else None
+
+    if not assigned:
+        gen.line(f"s = {state}")
+
+
+def emit_rung(gen, steps: List[Step]) -> None:
+    emit_steps(gen, steps, state=True)
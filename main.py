@@ -5,15 +5,28 @@ Raspberry Pi Ladder Logic Runtime System
 """
 
 import sys
+import json
+import time
+import signal
 import argparse
 import logging
+import threading
 from pathlib import Path
 
 # Add core modules to path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from core.runtime import PLCRuntime
+from core.runtime import PLCRuntime, LadderProgram
+from core.scheduler import VirtualClock
+from core.simulation import Simulation
+from core import program_cache
+from core.historian import Historian, History
+from core.retentive import RetentiveStore
+from core.web_server import start_web_server
+from core.modbus_server import ModbusServer
+from core.mqtt_publisher import MQTTPublisher
 from io.gpio_manager import GPIOManager, VirtualIOSimulator
+from io.gpio_backends import SimulatedBackend
 
 logging.basicConfig(
     level=logging.INFO,
@@ -22,7 +35,96 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def positive_int(value: str) -> int:
+    """argparse type for scan periods"""
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be a positive number of milliseconds, got {value}")
+    return number
+
+
+def build_cache(argv):
+    """`main.py build-cache PROGRAM...`: precompile program caches for deployment"""
+    parser = argparse.ArgumentParser(
+        prog='main.py build-cache',
+        description='Build the precompiled cache next to each program JSON file'
+    )
+    parser.add_argument('programs', nargs='+', help='Ladder logic program JSON files')
+    args = parser.parse_args(argv)
+    
+    status = 0
+    for program_file in args.programs:
+        try:
+            with open(program_file, 'rb') as f:
+                source = f.read()
+            program = LadderProgram()
+            program.load_from_json(program_file, use_cache=False)
+            path = program_cache.save(program_file, program_cache.digest(source), program,
+                                      json.loads(source))
+            print(f"{program_file} -> {path}")
+        except Exception as e:
+            logger.error(f"Could not build cache for {program_file}: {e}")
+            status = 1
+    return status
+
+
+def export_history(argv):
+    """`main.py history FILE`: export recorded tag changes"""
+    parser = argparse.ArgumentParser(
+        prog='main.py history',
+        description='Export tag changes from a history file'
+    )
+    parser.add_argument('file', help='History file written with --history')
+    parser.add_argument('--tag', action='append', help='Tag to export (repeatable; default: all)')
+    parser.add_argument('--last', type=float, metavar='SECONDS',
+                        help='Only the last SECONDS before the newest record')
+    parser.add_argument('--every', type=float, metavar='MS',
+                        help='Downsample: last value of each tag per MS interval')
+    parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+    parser.add_argument('--output', help='Output file (default: stdout)')
+    args = parser.parse_args(argv)
+    
+    history = History(args.file)
+    start_ns = None
+    newest = history.last_timestamp_ns()
+    if args.last is not None and newest is not None:
+        start_ns = newest - int(args.last * 1e9)
+    records = history.query(args.tag, start_ns=start_ns,
+                            every_ns=int(args.every * 1e6) if args.every else None)
+    
+    if args.output:
+        with open(args.output, 'w', newline='') as out:
+            history.export(records, out, args.format)
+    else:
+        history.export(records, sys.stdout, args.format)
+    history.close()
+    return 0
+
+
+def handle_online_edit_signals(runtime, program_file: str):
+    """SIGHUP: online edit from the (changed) program file; SIGUSR1: roll back"""
+    if not hasattr(signal, 'SIGHUP'):
+        return
+    
+    def in_background(action, *args):
+        # Signal handlers interrupt the scan thread mid-scan
+        def edit():
+            try:
+                action(*args)
+            except Exception as e:
+                logger.error(f"Online edit failed: {e}")
+        threading.Thread(target=edit, name='online-edit', daemon=True).start()
+    
+    signal.signal(signal.SIGHUP, lambda signum, frame: in_background(runtime.load_online, program_file))
+    signal.signal(signal.SIGUSR1, lambda signum, frame: in_background(runtime.rollback))
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'build-cache':
+        return build_cache(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'history':
+        return export_history(sys.argv[2:])
+    
     parser = argparse.ArgumentParser(
         description='Pi Ladder Logic - PLC-style ladder logic for Raspberry Pi'
     )
@@ -40,17 +142,123 @@ def main():
     
     parser.add_argument(
         '--scan-time',
-        type=int,
+        type=positive_int,
         default=100,
         help='Scan cycle time in milliseconds (default: 100ms)'
     )
     
+    parser.add_argument(
+        '--overrun-policy',
+        choices=['skip', 'catch_up', 'fault'],
+        default='skip',
+        help='What to do when a scan misses its deadline (default: skip)'
+    )
+    
     parser.add_argument(
         '--no-io',
         action='store_true',
         help='Run without I/O (simulation mode)'
     )
     
+    parser.add_argument(
+        '--interpreted',
+        action='store_true',
+        help='Run the reference interpreter instead of the compiled scan'
+    )
+    
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Only re-evaluate rungs whose input tags changed since the last scan'
+    )
+    
+    parser.add_argument(
+        '--parallel',
+        action='store_true',
+        help='Run independent groups of rungs in parallel worker processes'
+    )
+    
+    parser.add_argument(
+        '--workers',
+        type=int,
+        help='Number of parallel partitions (default: CPU count)'
+    )
+    
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Always load the program from JSON and do not write the program cache '
+             '(the cache skips code generation in compiled mode only)'
+    )
+    
+    parser.add_argument(
+        '--history',
+        metavar='FILE',
+        help='Record tag changes into a ring file (export with: main.py history FILE)'
+    )
+    
+    parser.add_argument(
+        '--history-size',
+        type=int,
+        default=100_000,
+        help='Records kept in the history file (32 bytes each, default: 100000)'
+    )
+    
+    parser.add_argument(
+        '--retain',
+        metavar='FILE',
+        help='Keep the program\'s "retentive" tags across restarts in FILE '
+             '(restored before the first scan)'
+    )
+    
+    parser.add_argument(
+        '--retain-interval',
+        type=float,
+        default=1000,
+        metavar='MS',
+        help='Minimum time between writes of changed retentive tags (default: 1000)'
+    )
+    
+    parser.add_argument(
+        '--web',
+        type=int,
+        metavar='PORT',
+        help='Serve tag values and a live change stream (SSE) for HMIs on PORT (needs Flask)'
+    )
+    
+    parser.add_argument(
+        '--modbus',
+        metavar='MAP_FILE',
+        help='Serve tags over Modbus TCP using a register map (e.g. modbus_map.json)'
+    )
+    
+    parser.add_argument(
+        '--mqtt',
+        metavar='CONFIG',
+        help='Publish tag changes to an MQTT broker (e.g. mqtt_config.json; needs paho-mqtt)'
+    )
+    
+    parser.add_argument(
+        '--fast-forward',
+        type=float,
+        metavar='SECONDS',
+        help='Simulate SECONDS of operation as fast as possible on a virtual clock '
+             '(simulated I/O), then exit'
+    )
+    
+    parser.add_argument(
+        '--script',
+        metavar='FILE',
+        help='Scripted input changes for --fast-forward: JSON list of '
+             '{"at_ms": 1000, "tag": "START_BTN", "value": true | false | "pulse"}'
+    )
+    
+    parser.add_argument(
+        '--profile',
+        metavar='FILE',
+        help='Profile rungs/instructions; write flamegraph collapsed stacks to FILE on exit'
+    )
+    
     parser.add_argument(
         '--debug',
         action='store_true',
@@ -59,6 +267,9 @@ def main():
     
     args = parser.parse_args()
     
+    if args.script and (args.fast_forward is None or args.no_io):
+        parser.error("--script needs --fast-forward and simulated I/O")
+    
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
     
@@ -69,12 +280,22 @@ def main():
     print()
     
     # Create runtime
-    runtime = PLCRuntime(scan_time_ms=args.scan_time)
+    mode = LadderProgram.COMPILED
+    if args.interpreted:
+        mode = LadderProgram.INTERPRETED
+    elif args.incremental:
+        mode = LadderProgram.INCREMENTAL
+    elif args.parallel:
+        mode = LadderProgram.PARALLEL
+    clock = VirtualClock() if args.fast_forward is not None else time.monotonic_ns
+    runtime = PLCRuntime(scan_time_ms=args.scan_time, mode=mode,
+                         overrun_policy=args.overrun_policy, workers=args.workers,
+                         clock=clock)
     
     # Load program
     try:
         logger.info(f"Loading program: {args.program}")
-        runtime.load_program(args.program)
+        runtime.load_program(args.program, use_cache=not args.no_cache)
     except FileNotFoundError:
         logger.error(f"Program file not found: {args.program}")
         return 1
@@ -82,11 +303,55 @@ def main():
         logger.error(f"Error loading program: {e}")
         return 1
     
+    if args.retain:
+        try:
+            runtime.attach_retentive(RetentiveStore(args.retain, args.retain_interval))
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not open retentive file {args.retain}: {e}")
+            return 1
+    
+    if args.history:
+        runtime.attach_historian(Historian(args.history, capacity=args.history_size,
+                                           clock=clock))
+        logger.info(f"Recording tag history to {args.history}")
+    
+    if args.web:
+        try:
+            start_web_server(runtime.program.tags, port=args.web, runtime=runtime)
+        except Exception as e:
+            logger.error(f"Could not start web server: {e}")
+            return 1
+    
+    modbus_server = None
+    if args.modbus:
+        try:
+            modbus_server = ModbusServer.from_config(args.modbus, runtime.program.tags)
+            modbus_server.start()
+        except Exception as e:
+            logger.error(f"Could not start Modbus server: {e}")
+            return 1
+    
+    mqtt_publisher = None
+    if args.mqtt:
+        try:
+            mqtt_publisher = MQTTPublisher.from_config(args.mqtt, runtime.program.tags)
+            mqtt_publisher.start()
+        except Exception as e:
+            logger.error(f"Could not start MQTT publisher: {e}")
+            return 1
+    
+    if args.profile:
+        runtime.program.enable_profiling()
+        logger.info("Rung profiling enabled")
+    
     # Setup I/O if not disabled
+    simulator = None
     if not args.no_io:
         try:
             logger.info(f"Loading I/O config: {args.io_config}")
-            io_manager = GPIOManager(args.io_config)
+            # Physical pins cannot follow a virtual clock
+            backend = SimulatedBackend() if args.fast_forward is not None else None
+            io_manager = GPIOManager(args.io_config, backend, clock)
             runtime.attach_io(io_manager)
             
             io_status = io_manager.get_io_status()
@@ -97,11 +362,15 @@ def main():
             # If in simulation mode, create virtual I/O simulator
             if io_manager.simulation_mode:
                 simulator = VirtualIOSimulator(io_manager)
+                if args.script:
+                    with open(args.script, 'r') as f:
+                        simulator.load_script(json.load(f))
+            if io_manager.simulation_mode and args.fast_forward is None:
                 print()
                 print("SIMULATION MODE - No physical I/O")
                 print("Available simulation commands:")
                 print("  - Use separate terminal to control inputs")
-                print("  - Or modify simulation_inputs dict directly")
+                print("  - Or call VirtualIOSimulator.set_input() / pulse_input()")
                 print()
         
         except FileNotFoundError:
@@ -115,32 +384,67 @@ def main():
     
     # Start runtime
     print()
-    print(f"Starting PLC runtime (scan time: {runtime.scan_time_ms}ms)")
-    print("Press Ctrl+C to stop")
+    if args.fast_forward is not None:
+        print(f"Fast-forwarding {args.fast_forward:g}s of simulated time "
+              f"(scan time: {runtime.scan_time_ms}ms)")
+    else:
+        print(f"Starting PLC runtime (scan time: {runtime.scan_time_ms}ms)")
+        print("Press Ctrl+C to stop")
     print("=" * 60)
     print()
     
     try:
-        runtime.start()
-        runtime.run()
+        if args.fast_forward is not None:
+            simulation = Simulation(runtime, simulator)
+            try:
+                simulation.run(args.fast_forward * 1000)
+            finally:
+                simulation.close()
+        else:
+            handle_online_edit_signals(runtime, args.program)
+            runtime.start()
+            runtime.run()
     except KeyboardInterrupt:
         print()
         logger.info("Shutdown requested by user")
     finally:
         runtime.stop()
+        if modbus_server:
+            modbus_server.stop()
+        if mqtt_publisher:
+            mqtt_publisher.stop()
         print()
         print("PLC runtime stopped")
         
         # Print final statistics
         tags = runtime.program.tags.get_all()
         cycle_count = tags.get('_SYSTEM.CYCLE_COUNT', 0)
-        avg_scan_time = tags.get('_SYSTEM.SCAN_TIME', 0)
+        scan_stats = runtime.get_statistics()['scan']
         
         print()
         print("Runtime Statistics:")
         print(f"  Total scan cycles: {cycle_count}")
-        print(f"  Average scan time: {avg_scan_time:.2f}ms")
+        print(f"  Average scan time: {scan_stats['mean_ms']:.2f}ms")
+        print(f"  Overruns: {tags.get('_SYSTEM.OVERRUNS', 0)}")
         print()
+        print("Scan Time Distribution (ms):")
+        print(runtime.stats.report())
+        print()
+        
+        if args.fast_forward is not None:
+            print("Final Tag Values:")
+            for tag_name, value in sorted(tags.items()):
+                if not tag_name.startswith('_SYSTEM.'):
+                    print(f"  {tag_name} = {value}")
+            print()
+        
+        if runtime.program.profiler:
+            print("Rung Profile:")
+            print(runtime.program.profiler.report())
+            print()
+            runtime.program.profiler.write_collapsed(args.profile)
+            print(f"Collapsed stacks written to {args.profile}")
+            print()
     
     return 0
 
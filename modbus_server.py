@@ -0,0 +1,353 @@
+"""
+Modbus TCP Server
+Exposes tags to SCADA/HMI clients over Modbus TCP (asyncio, no extra
+dependencies).
+
+Tags are mapped to the four Modbus tables in a register map file:
+
+    {
+        "host": "0.0.0.0",
+        "port": 5020,
+        "coils":             [{"address": 0, "tag": "MOTOR_RUN"}],
+        "discrete_inputs":   [{"address": 0, "tag": "START_BTN"}],
+        "holding_registers": [{"address": 0, "tag": "RUN_TIMER.PRE", "type": "int32"}],
+        "input_registers":   [{"address": 0, "tag": "RUN_TIMER.ACC", "type": "int32"},
+                              {"address": 2, "tag": "_SYSTEM.SCAN_TIME", "type": "float32"}]
+    }
+
+Register types: int16 (default for DINT/BOOL), uint16, int32 and
+float32 (default for REAL); 32-bit values take two registers, high word
+first.
+
+The map is resolved to storage slots once, so a request is served by
+indexing the published scan image (TagDatabase.snapshot()) - no tag
+lock and no name lookups per register - and every client sees whole
+scans. Writes (FC 5, 6, 15, 16) are queued with tags.post() and take
+effect at the start of the next scan. Supported function codes:
+1, 2, 3, 4 (reads), 5, 6, 15, 16 (writes).
+"""
+
+import json
+import struct
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from .tags import BOOL, DINT, REAL
+
+logger = logging.getLogger(__name__)
+
+COILS = 'coils'
+DISCRETE_INPUTS = 'discrete_inputs'
+HOLDING_REGISTERS = 'holding_registers'
+INPUT_REGISTERS = 'input_registers'
+TABLES = (COILS, DISCRETE_INPUTS, HOLDING_REGISTERS, INPUT_REGISTERS)
+
+# Register encodings: (registers, struct format)
+REGISTER_TYPES = {
+    'int16': (1, '>h'),
+    'uint16': (1, '>H'),
+    'int32': (2, '>i'),
+    'float32': (2, '>f'),
+}
+
+# Exception codes
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+ILLEGAL_DATA_VALUE = 3
+
+MBAP = struct.Struct('>HHHB')      # transaction id, protocol id, length, unit id
+
+
+class ModbusError(Exception):
+    """Request rejected with a Modbus exception code"""
+
+    def __init__(self, code: int):
+        super().__init__(code)
+        self.code = code
+
+
+class Point:
+    """A tag mapped to a coil/discrete input or to one or two registers"""
+
+    __slots__ = ('tag', 'data_type', 'index', 'register_type', 'size', 'format')
+
+    def __init__(self, tag: str, data_type: str, index: int, register_type: str = None):
+        self.tag = tag
+        self.data_type = data_type
+        self.index = index
+        self.register_type = register_type
+        self.size, self.format = REGISTER_TYPES[register_type] if register_type else (1, None)
+
+    def encode(self, value) -> Tuple[int, ...]:
+        """Register words for a tag value"""
+        if self.register_type == 'float32':
+            data = struct.pack('>f', value)
+        else:
+            bits = 16 * self.size
+            value = int(value) & ((1 << bits) - 1)
+            if self.format in ('>h', '>i') and value >= 1 << (bits - 1):
+                value -= 1 << bits
+            data = struct.pack(self.format, value)
+        return struct.unpack(f'>{self.size}H', data)
+
+    def decode(self, words: List[int]):
+        """Tag value for written register words"""
+        value = struct.unpack(self.format, struct.pack(f'>{self.size}H', *words))[0]
+        if self.data_type == BOOL:
+            return bool(value)
+        if self.data_type == DINT:
+            return int(value)
+        return float(value)
+
+
+class RegisterMap:
+    """Modbus tables resolved to tag slots (address -> Point, gaps are None)"""
+
+    def __init__(self, config: Dict, tags):
+        self.tables: Dict[str, List[Optional[Point]]] = {}
+        for table in TABLES:
+            points: List[Optional[Point]] = []
+            for entry in config.get(table, []):
+                point = self._point(table, entry, tags)
+                address = entry['address']
+                if address < 0:
+                    raise ValueError(f"{table}: negative address {address}")
+                points.extend([None] * (address + point.size - len(points)))
+                for word in range(point.size):
+                    if points[address + word] is not None:
+                        raise ValueError(f"{table}: address {address + word} mapped twice")
+                    # Every register of a multi-register value refers to the point
+                    points[address + word] = point
+            self.tables[table] = points
+
+    @staticmethod
+    def _point(table: str, entry: Dict, tags) -> Point:
+        tag_name = entry['tag']
+        slot = tags.slot(tag_name)
+        register_type = entry.get('type')
+        if table in (COILS, DISCRETE_INPUTS):
+            if register_type:
+                raise ValueError(f"{table}: {tag_name} cannot have a register type")
+            data_type, index = slot or tags.allocate(tag_name, BOOL)
+            return Point(tag_name, data_type, index)
+
+        if register_type is None:
+            register_type = 'float32' if slot and slot[0] == REAL else 'int16'
+        if register_type not in REGISTER_TYPES:
+            raise ValueError(f"{table}: unknown register type {register_type} for {tag_name}")
+        if slot is None:
+            slot = tags.allocate(tag_name, REAL if register_type == 'float32' else DINT)
+        return Point(tag_name, slot[0], slot[1], register_type)
+
+    def read_bits(self, table: str, image, address: int, count: int) -> bytes:
+        points = self._range(table, address, count)
+        areas = image.areas
+        packed = bytearray((count + 7) // 8)
+        for offset, point in enumerate(points):
+            if point is not None:
+                area = areas[point.data_type]
+                if point.index < len(area) and area[point.index]:
+                    packed[offset >> 3] |= 1 << (offset & 7)
+        return bytes(packed)
+
+    def read_registers(self, table: str, image, address: int, count: int) -> List[int]:
+        points = self._range(table, address, count)
+        areas = image.areas
+        words = []
+        offset = 0
+        while offset < count:
+            point = points[offset]
+            if point is None:
+                words.append(0)
+                offset += 1
+                continue
+            # Position of this register within the point's words
+            first = address + offset
+            while first > 0 and self.tables[table][first - 1] is point:
+                first -= 1
+            area = areas[point.data_type]
+            value = area[point.index] if point.index < len(area) else 0
+            encoded = point.encode(value)
+            skip = address + offset - first
+            taken = encoded[skip:skip + count - offset]
+            words.extend(taken)
+            offset += len(taken)
+        return words
+
+    def write_bits(self, tags, address: int, values: List[bool]) -> None:
+        points = self._range(COILS, address, len(values))
+        if any(point is None for point in points):
+            raise ModbusError(ILLEGAL_DATA_ADDRESS)
+        for point, value in zip(points, values):
+            tags.post(point.tag, value)
+
+    def write_registers(self, tags, address: int, words: List[int]) -> None:
+        points = self._range(HOLDING_REGISTERS, address, len(words))
+        table = self.tables[HOLDING_REGISTERS]
+        if any(point is None for point in points):
+            raise ModbusError(ILLEGAL_DATA_ADDRESS)
+        # Multi-register values must be written whole
+        if address > 0 and table[address - 1] is points[0]:
+            raise ModbusError(ILLEGAL_DATA_ADDRESS)
+        if address + len(words) < len(table) and table[address + len(words)] is points[-1]:
+            raise ModbusError(ILLEGAL_DATA_ADDRESS)
+        offset = 0
+        while offset < len(words):
+            point = points[offset]
+            tags.post(point.tag, point.decode(words[offset:offset + point.size]))
+            offset += point.size
+
+    def _range(self, table: str, address: int, count: int) -> List[Optional[Point]]:
+        points = self.tables[table]
+        if address < 0 or address + count > len(points):
+            raise ModbusError(ILLEGAL_DATA_ADDRESS)
+        return points[address:address + count]
+
+
+class ModbusServer:
+    """Modbus TCP server over a TagDatabase, on its own event loop thread"""
+
+    def __init__(self, tags, register_map: RegisterMap, host: str = '0.0.0.0', port: int = 502):
+        self.tags = tags
+        self.map = register_map
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.clients = set()
+        self.requests = 0
+
+    @classmethod
+    def from_config(cls, config_file: str, tags) -> 'ModbusServer':
+        with open(config_file, 'r') as f:
+            config = json.load(f)
+        return cls(tags, RegisterMap(config, tags), config.get('host', '0.0.0.0'),
+                   config.get('port', 502))
+
+    # -- protocol ---------------------------------------------------------------
+
+    def handle(self, pdu: bytes) -> bytes:
+        """Process one request PDU, returning the response PDU"""
+        function = pdu[0] if pdu else 0
+        try:
+            return bytes([function]) + self._execute(function, pdu[1:])
+        except ModbusError as e:
+            return bytes([function | 0x80, e.code])
+        except (struct.error, IndexError):
+            return bytes([function | 0x80, ILLEGAL_DATA_VALUE])
+
+    def _execute(self, function: int, data: bytes) -> bytes:
+        if function in (1, 2):
+            address, count = struct.unpack_from('>HH', data)
+            if not 1 <= count <= 2000:
+                raise ModbusError(ILLEGAL_DATA_VALUE)
+            table = COILS if function == 1 else DISCRETE_INPUTS
+            packed = self.map.read_bits(table, self.tags.snapshot(), address, count)
+            return bytes([len(packed)]) + packed
+
+        if function in (3, 4):
+            address, count = struct.unpack_from('>HH', data)
+            if not 1 <= count <= 125:
+                raise ModbusError(ILLEGAL_DATA_VALUE)
+            table = HOLDING_REGISTERS if function == 3 else INPUT_REGISTERS
+            words = self.map.read_registers(table, self.tags.snapshot(), address, count)
+            return struct.pack(f'>B{count}H', 2 * count, *words)
+
+        if function == 5:
+            address, value = struct.unpack_from('>HH', data)
+            if value not in (0x0000, 0xFF00):
+                raise ModbusError(ILLEGAL_DATA_VALUE)
+            self.map.write_bits(self.tags, address, [value == 0xFF00])
+            return data[:4]
+
+        if function == 6:
+            address, word = struct.unpack_from('>HH', data)
+            self.map.write_registers(self.tags, address, [word])
+            return data[:4]
+
+        if function == 15:
+            address, count, length = struct.unpack_from('>HHB', data)
+            if not 1 <= count <= 1968 or length != (count + 7) // 8:
+                raise ModbusError(ILLEGAL_DATA_VALUE)
+            packed = data[5:5 + length]
+            values = [bool(packed[k >> 3] & (1 << (k & 7))) for k in range(count)]
+            self.map.write_bits(self.tags, address, values)
+            return data[:4]
+
+        if function == 16:
+            address, count, length = struct.unpack_from('>HHB', data)
+            if not 1 <= count <= 123 or length != 2 * count:
+                raise ModbusError(ILLEGAL_DATA_VALUE)
+            words = list(struct.unpack_from(f'>{count}H', data, 5))
+            self.map.write_registers(self.tags, address, words)
+            return data[:4]
+
+        raise ModbusError(ILLEGAL_FUNCTION)
+
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info('peername')
+        logger.debug(f"Modbus client connected: {peer}")
+        task = asyncio.current_task()
+        self.clients.add(task)
+        try:
+            while True:
+                header = await reader.readexactly(MBAP.size)
+                transaction, protocol, length, unit = MBAP.unpack(header)
+                if protocol != 0 or not 2 <= length <= 254:
+                    break
+                pdu = await reader.readexactly(length - 1)
+                response = self.handle(pdu)
+                self.requests += 1
+                writer.write(MBAP.pack(transaction, 0, len(response) + 1, unit) + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(task)
+            writer.close()
+            logger.debug(f"Modbus client disconnected: {peer}")
+
+    # -- server -----------------------------------------------------------------
+
+    async def serve(self) -> asyncio.AbstractServer:
+        """Start listening on the running event loop"""
+        self.server = await asyncio.start_server(self._serve_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Modbus TCP server listening on {self.host}:{self.port}")
+        return self.server
+
+    def start(self) -> None:
+        """Run the server on a background event loop thread"""
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.serve())
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, name='modbus-server', daemon=True)
+        self.thread.start()
+        started.wait(5.0)
+
+    def stop(self) -> None:
+        if self.loop is None:
+            return
+
+        async def shutdown():
+            self.server.close()
+            clients = list(self.clients)
+            for task in clients:
+                task.cancel()
+            await asyncio.gather(*clients, return_exceptions=True)
+            await self.server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(5.0)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5.0)
+        self.loop.close()
+        self.loop = None
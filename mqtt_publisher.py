@@ -0,0 +1,323 @@
+"""
+MQTT Publisher
+Pushes tag changes to an MQTT broker from a background thread.
+
+Changes come from a tag subscription (subscriptions.py), so the scan
+thread only pays for routing changed slots. Topics are configured in
+a JSON file:
+
+    {
+        "broker": "localhost", "port": 1883, "client_id": "pi-ladder",
+        "qos": 0, "format": "json", "batch_ms": 100, "max_batch": 200,
+        "offline_buffer": 1000,
+        "topics": [
+            {"topic": "plant/line1/motor", "prefixes": ["MOTOR_", "RUN_"],
+             "min_interval_ms": 500},
+            {"topic": "plant/line1/temps", "tags": ["TEMP_1", "TEMP_2"],
+             "deadband": 0.5, "min_interval_ms": 2000}
+        ]
+    }
+
+For each topic, changes are coalesced and published together (up to
+max_batch tags per message) at most once per min_interval_ms. A numeric
+change is only sent once it differs from the last sent value by more
+than the topic's deadband.
+
+Payload formats:
+
+    json    {"ts": <epoch ms>, "cycle": <scan>, "values": {"TAG": value, ...}}
+    binary  header <BHqq> (version, count, epoch ms, cycle), then per tag
+            <HB> (tag number, type) and the value (<B bool, <q DINT, <d REAL).
+            Tag numbers index the JSON list of names retained on
+            "<topic>/schema" (see decode_binary()).
+
+While the broker is unreachable, messages go to a bounded buffer (the
+oldest are dropped when it is full) that is sent on reconnection.
+"""
+
+import json
+import time
+import struct
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, List, Tuple
+
+from .subscriptions import Subscription, subscribe, unsubscribe
+
+logger = logging.getLogger(__name__)
+
+# Optional MQTT client library
+try:
+    import paho.mqtt.client as mqtt
+    PAHO_AVAILABLE = True
+except ImportError:
+    PAHO_AVAILABLE = False
+
+JSON = 'json'
+BINARY = 'binary'
+FORMATS = (JSON, BINARY)
+
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<BHqq')
+BINARY_ENTRY = struct.Struct('<HB')
+_BINARY_VALUES = {0: struct.Struct('<B'), 1: struct.Struct('<q'), 2: struct.Struct('<d')}
+
+
+def decode_binary(payload: bytes, schema: List[str]) -> Dict[str, Any]:
+    """Decode a binary payload with its topic's schema (list of tag names)"""
+    version, count, timestamp_ms, cycle = BINARY_HEADER.unpack_from(payload, 0)
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unsupported binary payload version {version}")
+    offset = BINARY_HEADER.size
+    values = {}
+    for _ in range(count):
+        number, type_code = BINARY_ENTRY.unpack_from(payload, offset)
+        offset += BINARY_ENTRY.size
+        value_format = _BINARY_VALUES[type_code]
+        value = value_format.unpack_from(payload, offset)[0]
+        offset += value_format.size
+        values[schema[number]] = bool(value) if type_code == 0 else value
+    return {'ts': timestamp_ms, 'cycle': cycle, 'values': values}
+
+
+class TopicGroup:
+    """Tags published together on one topic"""
+
+    def __init__(self, config: Dict):
+        self.topic = config['topic']
+        self.tags = set(config.get('tags', []))
+        self.prefixes = tuple(config.get('prefixes', []))
+        self.deadband = float(config.get('deadband', 0))
+        self.min_interval_ns = int(config.get('min_interval_ms', 0) * 1_000_000)
+
+        self.pending: Dict[str, Any] = {}
+        self.last_sent: Dict[str, Any] = {}
+        self.last_publish_ns = None
+        self.schema: List[str] = []
+        self.numbers: Dict[str, int] = {}
+
+    def matches(self, tag_name: str) -> bool:
+        if not self.tags and not self.prefixes:
+            return True
+        return tag_name in self.tags or tag_name.startswith(self.prefixes)
+
+    def update(self, tag_name: str, value: Any) -> None:
+        """Queue a change unless it is within the deadband of the last sent value"""
+        last = self.last_sent.get(tag_name)
+        if last is not None and (value == last or (
+                self.deadband and not isinstance(value, bool)
+                and abs(value - last) <= self.deadband)):
+            # Back at (or near) the sent value: a queued excursion is not worth sending
+            self.pending.pop(tag_name, None)
+            return
+        self.pending[tag_name] = value
+
+    def due(self, now_ns: int) -> bool:
+        return bool(self.pending) and (self.last_publish_ns is None or
+                                       now_ns - self.last_publish_ns >= self.min_interval_ns)
+
+
+class RecordingClient:
+    """
+    In-memory stand-in for an MQTT client (for tests and running without
+    a broker). Messages are appended to `messages`; set `connected` to
+    False to simulate a broker outage.
+    """
+
+    def __init__(self):
+        self.messages: List[Tuple[str, bytes, int, bool]] = []
+        self.connected = True
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def publish(self, topic: str, payload, qos: int = 0, retain: bool = False):
+        if not self.connected:
+            raise ConnectionError("not connected")
+        self.messages.append((topic, payload, qos, retain))
+
+    def disconnect(self) -> None:
+        self.connected = False
+
+
+class MQTTPublisher:
+    """Publishes coalesced, rate-limited batches of tag changes"""
+
+    def __init__(self, tags, config: Dict, client=None, clock=time.monotonic_ns):
+        self.tags = tags
+        self.config = config
+        self.clock = clock
+        self.qos = config.get('qos', 0)
+        self.format = config.get('format', JSON)
+        if self.format not in FORMATS:
+            raise ValueError(f"Unknown MQTT payload format: {self.format}")
+        self.batch_s = config.get('batch_ms', 100) / 1000.0
+        self.max_batch = config.get('max_batch', 200)
+
+        self.groups = [TopicGroup(topic) for topic in config.get('topics', [])]
+        if not self.groups:
+            raise ValueError("MQTT config has no topics")
+        self.routes: Dict[str, List[TopicGroup]] = {}
+
+        self.offline = deque(maxlen=config.get('offline_buffer', 1000))
+        self.dropped = 0
+        self.published = 0
+
+        self.client = client if client is not None else self._connect()
+        self.subscription = None
+        self.running = False
+        self.thread = None
+
+    @classmethod
+    def from_config(cls, config_file: str, tags, client=None) -> 'MQTTPublisher':
+        with open(config_file, 'r') as f:
+            return cls(tags, json.load(f), client)
+
+    def _connect(self):
+        if not PAHO_AVAILABLE:
+            raise RuntimeError("paho-mqtt is not available (pip install paho-mqtt)")
+        client_id = self.config.get('client_id', 'pi-ladder')
+        if hasattr(mqtt, 'CallbackAPIVersion'):
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+        else:
+            client = mqtt.Client(client_id=client_id)
+        if self.config.get('username'):
+            client.username_pw_set(self.config['username'], self.config.get('password'))
+        client.reconnect_delay_set(min_delay=1, max_delay=30)
+        client.connect_async(self.config.get('broker', 'localhost'), self.config.get('port', 1883),
+                             keepalive=self.config.get('keepalive', 60))
+        client.loop_start()
+        return client
+
+    # -- change processing ------------------------------------------------------
+
+    def _groups_for(self, tag_name: str) -> List[TopicGroup]:
+        groups = self.routes.get(tag_name)
+        if groups is None:
+            groups = self.routes[tag_name] = [g for g in self.groups if g.matches(tag_name)]
+        return groups
+
+    def collect(self, changes: Dict[str, Any]) -> None:
+        """Feed one delta of tag changes into the topic groups"""
+        for tag_name, value in changes.items():
+            for group in self._groups_for(tag_name):
+                group.update(tag_name, value)
+
+    def flush(self, now_ns: int = None, cycle: int = 0, force: bool = False) -> int:
+        """Publish the groups whose rate limit allows it; returns messages sent"""
+        now_ns = self.clock() if now_ns is None else now_ns
+        sent = 0
+        for group in self.groups:
+            if not (group.pending and (force or group.due(now_ns))):
+                continue
+            items = list(group.pending.items())
+            group.pending.clear()
+            group.last_publish_ns = now_ns
+            for start in range(0, len(items), self.max_batch):
+                batch = items[start:start + self.max_batch]
+                self._send(group.topic, self._encode(group, batch, cycle))
+                sent += 1
+            group.last_sent.update(items)
+        self._drain_offline()
+        return sent
+
+    def _encode(self, group: TopicGroup, items: List[Tuple[str, Any]], cycle: int) -> bytes:
+        timestamp_ms = time.time_ns() // 1_000_000
+        if self.format == JSON:
+            return json.dumps({'ts': timestamp_ms, 'cycle': cycle,
+                               'values': dict(items)}).encode('utf-8')
+
+        grown = False
+        for tag_name, _ in items:
+            if tag_name not in group.numbers:
+                group.numbers[tag_name] = len(group.schema)
+                group.schema.append(tag_name)
+                grown = True
+        if grown:
+            self._send(group.topic + '/schema', json.dumps(group.schema).encode('utf-8'),
+                       retain=True)
+
+        parts = [BINARY_HEADER.pack(BINARY_VERSION, len(items), timestamp_ms, cycle)]
+        for tag_name, value in items:
+            type_code = 0 if isinstance(value, bool) else 2 if isinstance(value, float) else 1
+            parts.append(BINARY_ENTRY.pack(group.numbers[tag_name], type_code))
+            parts.append(_BINARY_VALUES[type_code].pack(value))
+        return b''.join(parts)
+
+    def _send(self, topic: str, payload: bytes, retain: bool = False) -> None:
+        message = (topic, payload, self.qos, retain)
+        if self.offline or not self._publish(message):
+            self._buffer(message)
+
+    def _publish(self, message) -> bool:
+        if not self.client.is_connected():
+            return False
+        try:
+            info = self.client.publish(*message)
+        except (ConnectionError, OSError, ValueError):
+            return False
+        rc = getattr(info, 'rc', 0)
+        if rc != 0:
+            return False
+        self.published += 1
+        return True
+
+    def _buffer(self, message) -> None:
+        if len(self.offline) == self.offline.maxlen:
+            self.dropped += 1
+        self.offline.append(message)
+
+    def _drain_offline(self) -> None:
+        """Send buffered messages, oldest first, while the broker accepts them"""
+        while self.offline:
+            if not self._publish(self.offline[0]):
+                return
+            self.offline.popleft()
+
+    # -- thread -----------------------------------------------------------------
+
+    def start(self) -> None:
+        if any(not g.tags and not g.prefixes for g in self.groups):
+            # A topic without a selection publishes every tag
+            tag_names, prefixes = None, None
+        else:
+            tag_names = set().union(*(g.tags for g in self.groups))
+            prefixes = [prefix for g in self.groups for prefix in g.prefixes]
+        self.subscription = subscribe(self.tags, tag_names, prefixes, maxlen=64,
+                                      policy=Subscription.COALESCE)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='mqtt-publisher', daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        cycle = 0
+        while self.running:
+            deadline = time.monotonic() + self.batch_s
+            # Gather everything that arrives within one batch interval
+            while self.running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                delta = self.subscription.get(remaining)
+                if delta is not None:
+                    cycle, changes = delta
+                    self.collect(changes)
+            try:
+                self.flush(cycle=cycle)
+            except Exception as e:
+                logger.error(f"MQTT publish failed: {e}")
+
+    def stop(self) -> None:
+        self.running = False
+        if self.subscription is not None:
+            unsubscribe(self.tags, self.subscription)
+        if self.thread:
+            self.thread.join(timeout=2.0)
+        try:
+            self.flush(force=True)
+        except Exception as e:
+            logger.error(f"MQTT publish failed: {e}")
+        if PAHO_AVAILABLE and isinstance(self.client, mqtt.Client):
+            self.client.loop_stop()
+            self.client.disconnect()
@@ -0,0 +1,376 @@
+"""
+Online Program Edit
+Replaces the running ladder program between two scans without stopping
+the runtime (PLCRuntime.load_online / PLCRuntime.rollback):
+
+    1. The new program is loaded, validated and compiled on the calling
+       thread while scans go on, against a copy of the live tag layout
+       (TagDatabase.copy_layout), so its compiled code addresses the
+       same slots as the running program. Bytecode is compiled in a
+       child process so the scan thread is not held up by the GIL.
+       The tags it adds are then allocated in the live database.
+    2. At the next scan boundary the scan thread writes the presets the
+       edit changed and switches programs.
+
+Both programs share the tag database, so tag values, timer and counter
+accumulators, one-shot storage and everything attached to the tags
+(I/O, HMI, historian, retentive file, Modbus, MQTT) carry over, and
+outputs are never dropped. Tags only used by removed rungs keep their
+last value. The replaced program is kept for rollback.
+
+In parallel mode the new worker pool is forked while preparing, on the
+live storage areas, and the replaced program's pool is shut down on a
+background thread after the swap, so neither holds up a scan.
+
+Preparing still shares the interpreter with the scan thread (JSON
+parsing, code generation), so scans may start late while an edit is
+prepared: by up to about one period on a 10ms scan.
+"""
+
+import gc
+import sys
+import json
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Tuple
+
+from .compiler import background_compile
+from .instructions import walk
+from .parallel import ParallelScan
+from .tags import TagDatabase
+
+logger = logging.getLogger(__name__)
+
+# GIL switch interval while an edit is prepared, so the scan thread gets
+# the interpreter back promptly after each sleep (default 5ms)
+PREPARE_SWITCH_INTERVAL_S = 0.0005
+
+
+def program_tags(program) -> Dict[str, str]:
+    """Tags a program declares or examines, with their data types"""
+    scratch = TagDatabase()
+    system = set(scratch.slots)
+    program.declare_tags(scratch)
+    return {tag_name: data_type for tag_name, (data_type, _) in scratch.slots.items()
+            if tag_name not in system}
+
+
+def _rung_signatures(program) -> Dict[int, str]:
+    rungs = program.program_data.get('rungs')
+    if rungs is None:
+        # Program built in code rather than loaded from JSON
+        return {rung.rung_id: repr(rung.instructions) for rung in program.rungs}
+    return {rung['rung_id']: json.dumps(rung.get('instructions', []), sort_keys=True)
+            for rung in rungs}
+
+
+def _presets(program) -> Dict[str, int]:
+    """Preset tag -> preset, for every timer and counter"""
+    return {instruction.pre_tag: instruction.preset
+            for rung in program.rungs for instruction in walk(rung.instructions)
+            if hasattr(instruction, 'pre_tag')}
+
+
+class ProgramDiff:
+    """Rungs, tags, presets, tasks, scan time and retentive tags that differ between two programs"""
+
+    def __init__(self, old, new):
+        old_rungs, new_rungs = _rung_signatures(old), _rung_signatures(new)
+        self.added_rungs = sorted(new_rungs.keys() - old_rungs.keys())
+        self.removed_rungs = sorted(old_rungs.keys() - new_rungs.keys())
+        self.changed_rungs = sorted(rung_id for rung_id in new_rungs.keys() & old_rungs.keys()
+                                    if new_rungs[rung_id] != old_rungs[rung_id])
+
+        old_tags, new_tags = program_tags(old), program_tags(new)
+        self.added_tags = sorted(new_tags.keys() - old_tags.keys())
+        self.removed_tags = sorted(old_tags.keys() - new_tags.keys())
+
+        # Presets of timers/counters in both programs: tag -> (old, new)
+        old_presets, new_presets = _presets(old), _presets(new)
+        self.changed_presets: Dict[str, Tuple[int, int]] = {
+            pre_tag: (old_presets[pre_tag], preset) for pre_tag, preset in sorted(new_presets.items())
+            if pre_tag in old_presets and old_presets[pre_tag] != preset}
+
+        old_tasks = {task['name']: task for task in old.program_data.get('tasks', [])}
+        new_tasks = {task['name']: task for task in new.program_data.get('tasks', [])}
+        self.changed_tasks = sorted(name for name in old_tasks.keys() | new_tasks.keys()
+                                    if old_tasks.get(name) != new_tasks.get(name))
+
+        old_scan = old.program_data.get('scan_time_ms', 100)
+        new_scan = new.program_data.get('scan_time_ms', 100)
+        self.scan_time_ms = (old_scan, new_scan) if old_scan != new_scan else None
+
+        self.added_retentive = sorted(set(new.retentive) - set(old.retentive))
+        self.removed_retentive = sorted(set(old.retentive) - set(new.retentive))
+
+    def __bool__(self):
+        return bool(self.added_rungs or self.removed_rungs or self.changed_rungs or
+                    self.added_tags or self.removed_tags or self.changed_presets or
+                    self.changed_tasks or self.scan_time_ms or
+                    self.added_retentive or self.removed_retentive)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'added_rungs': self.added_rungs,
+            'removed_rungs': self.removed_rungs,
+            'changed_rungs': self.changed_rungs,
+            'added_tags': self.added_tags,
+            'removed_tags': self.removed_tags,
+            'changed_presets': {pre_tag: {'old': old, 'new': new}
+                                for pre_tag, (old, new) in self.changed_presets.items()},
+            'changed_tasks': self.changed_tasks,
+            'scan_time_ms': ({'old': self.scan_time_ms[0], 'new': self.scan_time_ms[1]}
+                             if self.scan_time_ms else None),
+            'added_retentive': self.added_retentive,
+            'removed_retentive': self.removed_retentive,
+        }
+
+    def report(self) -> str:
+        """Human-readable summary"""
+        if not self:
+            return "No changes"
+        lines = []
+        for label, items in (("Added rungs", self.added_rungs),
+                             ("Removed rungs", self.removed_rungs),
+                             ("Changed rungs", self.changed_rungs),
+                             ("Added tags", self.added_tags),
+                             ("Removed tags", self.removed_tags),
+                             ("Added, removed or changed tasks", self.changed_tasks),
+                             ("Now retentive", self.added_retentive),
+                             ("No longer retentive", self.removed_retentive)):
+            if items:
+                lines.append(f"{label}: {', '.join(str(item) for item in items)}")
+        for pre_tag, (old, new) in self.changed_presets.items():
+            lines.append(f"Preset {pre_tag}: {old} -> {new}")
+        if self.scan_time_ms:
+            lines.append(f"Scan time: {self.scan_time_ms[0]}ms -> {self.scan_time_ms[1]}ms")
+        return '\n'.join(lines)
+
+
+class ProgramEdit:
+    """A prepared program, staged to replace the running one at a scan boundary"""
+
+    def __init__(self, program, diff: ProgramDiff):
+        self.program = program
+        self.diff = diff
+
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.cancelled = False
+        self.applied = False
+        self.error = None
+
+    def apply(self, runtime) -> None:
+        """Switch the runtime to the program (on the scan thread, between scans)"""
+        with self.lock:
+            if self.cancelled or self.done.is_set():
+                return
+            try:
+                self._swap(runtime)
+                self.applied = True
+            except Exception as e:
+                self.error = e
+                logger.error(f"Online edit failed, keeping the running program: {e}", exc_info=True)
+                if runtime.program is not self.program:
+                    _release(self.program)
+            finally:
+                self.done.set()
+
+    def cancel(self) -> bool:
+        """Withdraw the edit unless it was already applied; returns True if withdrawn"""
+        with self.lock:
+            if self.done.is_set():
+                return False
+            self.cancelled = True
+        _release(self.program)
+        return True
+
+    def _swap(self, runtime) -> None:
+        old = runtime.program
+        live = old.tags
+        for pre_tag, (_, preset) in self.diff.changed_presets.items():
+            live.set(pre_tag, preset)
+
+        _bind(self.program, live)
+        runtime.program = self.program
+        runtime.previous_program = old
+        if self.diff.scan_time_ms:
+            runtime.scan_time_ms = self.diff.scan_time_ms[1]
+        if old.tasks and not self.program.tasks:
+            # The single-rate time base has not ticked while tasks ran
+            self.program.timebase.reset()
+        if runtime.scheduler is not None and \
+                (old.tasks or self.program.tasks or self.diff.scan_time_ms):
+            _reschedule(runtime, old)
+        if runtime.retentive is not None:
+            # Live values carry over: only the set of retentive tags may change
+            runtime.retentive.bind(self.program, restore=False)
+        _release(old)
+
+
+def _bind(program, tags: TagDatabase) -> None:
+    """Point a program, and incremental scans built for its slot layout, at `tags`"""
+    program.tags = tags
+    for scan in [program.incremental] + [task.incremental for task in program.tasks]:
+        if scan is not None:
+            # Run every rung once against the live values
+            scan.tags = tags
+            scan.baseline = None
+            scan.invalidate()
+
+
+def _start_workers(program) -> None:
+    """Fork a parallel program's worker pool on this thread, for its current tags"""
+    with background_compile():
+        program.parallel = ParallelScan(program, program.workers)
+
+
+def _release(program) -> None:
+    """Shut down a program's worker pool on a background thread (joining takes a while)"""
+    pool, program.parallel = program.parallel, None
+    if pool is not None:
+        threading.Thread(target=pool.close, name='parallel-close', daemon=True).start()
+
+
+def _reschedule(runtime, old) -> None:
+    """
+    New scheduler for the swapped-in program. Tasks kept by the edit
+    keep their timer time base and, if their period is unchanged,
+    their period grid.
+    """
+    tasks = runtime.program.tasks
+    timebases = [(task.timebase, task.timebase.last_ns, task.timebase.remainder_ns)
+                 for task in tasks]
+    runtime.create_scheduler()
+    for timebase, last_ns, remainder_ns in timebases:
+        timebase.last_ns, timebase.remainder_ns = last_ns, remainder_ns
+
+    previous = {task.name: task for task in old.tasks}
+    for task in tasks:
+        old_task = previous.get(task.name)
+        if old_task is not None and task.scheduler is not None and \
+                old_task.scheduler is not None and old_task.period_ms == task.period_ms:
+            task.scheduler.next_release_ns = old_task.scheduler.next_release_ns
+            task.scheduler.last_start_ns = old_task.scheduler.last_start_ns
+
+
+def _unknown_types(instruction_data: List[Dict]) -> List[str]:
+    from .runtime import INSTRUCTION_FACTORIES
+
+    unknown = []
+    for inst_data in instruction_data:
+        if inst_data.get('type') not in INSTRUCTION_FACTORIES:
+            unknown.append(str(inst_data.get('type')))
+        for leg in inst_data.get('legs', []):
+            unknown.extend(_unknown_types(leg))
+    return unknown
+
+
+def _validate(program, tags: TagDatabase) -> None:
+    """Raise ValueError for anything the loader would accept with only a warning"""
+    errors = []
+
+    unknown = sorted({inst_type for rung_data in program.program_data.get('rungs', [])
+                      for inst_type in _unknown_types(rung_data.get('instructions', []))})
+    if unknown:
+        errors.append(f"unknown instruction type(s) {', '.join(unknown)}")
+
+    rung_ids = Counter(rung.rung_id for rung in program.rungs)
+    duplicates = sorted(rung_id for rung_id, count in rung_ids.items() if count > 1)
+    if duplicates:
+        errors.append(f"duplicate rung_id(s) {duplicates}")
+
+    for tag_name, data_type in program_tags(program).items():
+        slot = tags.slot(tag_name)
+        if slot is not None and slot[0] != data_type:
+            errors.append(f"tag {tag_name} is {data_type} but {slot[0]} in the running program")
+
+    if errors:
+        raise ValueError(f"Invalid program {program.source_file}: {'; '.join(errors)}")
+
+
+@contextmanager
+def _sharing_the_interpreter():
+    """Keep the scan thread's wait for the GIL short while an edit is prepared"""
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(min(switch_interval, PREPARE_SWITCH_INTERVAL_S))
+    # A full collection holds the GIL for the whole heap: none while
+    # preparing, and the new objects then join the oldest generation
+    # without one
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.freeze()
+        gc.unfreeze()
+        if collecting:
+            gc.enable()
+        sys.setswitchinterval(switch_interval)
+
+
+def prepare(current, json_file: str) -> ProgramEdit:
+    """
+    Load, validate and compile `json_file` to replace the running
+    program `current` (on any thread). Raises ValueError if the program
+    is invalid, before anything in the running program is touched.
+
+    Tags the new program adds are then allocated in the live database
+    (the running program does not use their slots) so the program is
+    ready to run on it; they stay allocated if the edit is not applied.
+    """
+    with _sharing_the_interpreter():
+        return _prepare(current, json_file)
+
+
+def _prepare(current, json_file: str) -> ProgramEdit:
+    live = current.tags
+    tags = live.copy_layout()
+
+    # Parallel workers map the live storage areas: started once tags are allocated
+    mode = current.COMPILED if current.mode == current.PARALLEL else current.mode
+    program = type(current)(mode, current.workers)
+    program.tags = tags
+    program.timebase = current.timebase
+    with background_compile():
+        try:
+            program.load_from_json(json_file, use_cache=False)
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Invalid program {json_file}: missing or malformed {e}") from e
+        _validate(program, tags)
+        if current.profiler is not None:
+            program.enable_profiling()
+
+        # Add the new tags to the live database. Slots match the copy
+        # unless tags were created since it was taken (e.g. HMI writes):
+        # then compile again for the live layout.
+        ordered = sorted(tags.slots.items(), key=lambda item: item[1][1])
+        for tag_name, (data_type, index) in ordered:
+            live.allocate(tag_name, data_type, tags.areas[data_type][index])
+        if any(live.slot(tag_name) != slot for tag_name, slot in ordered):
+            program.tags = live
+            if program.mode != program.INTERPRETED:
+                program.compile()
+            if current.profiler is not None:
+                program.enable_profiling()
+    program.mode = current.mode
+    if program.mode == program.PARALLEL:
+        program.tags = live
+        _start_workers(program)
+
+    # Timers in tasks that carry over keep accumulating on the same time base
+    timebases = {task.name: task.timebase for task in current.tasks}
+    for task in program.tasks:
+        task.timebase = timebases.get(task.name, task.timebase)
+
+    return ProgramEdit(program, ProgramDiff(current, program))
+
+
+def rollback(current, previous) -> ProgramEdit:
+    """Edit switching back to the program `current` replaced"""
+    if previous.mode == previous.PARALLEL and previous.parallel is None:
+        with _sharing_the_interpreter():
+            _start_workers(previous)
+    return ProgramEdit(previous, ProgramDiff(current, previous))
@@ -0,0 +1,162 @@
+"""
+Scan Profiler
+Opt-in per-rung and per-instruction execution profiling.
+
+When enabled, the program is recompiled with timing code around every
+rung and instruction. When disabled, the normal compiled scan runs and
+the profiler costs nothing.
+"""
+
+import time
+from array import array
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from .compiler import ProgramCompiler
+
+
+def _zeros(length: int) -> array:
+    return array('q', bytes(8 * length))
+
+
+class ScanProfiler:
+    """
+    Records cumulative time, maximum time and call count for each rung
+    and each instruction, and reports them per rung_id and per
+    instruction type.
+    """
+
+    def __init__(self, program):
+        self.program = program
+        self.rungs = list(program.rungs)
+
+        # One entry per instruction instance, in program order
+        self.instructions: List[Tuple[int, str]] = [
+            (r, type(instruction).__name__)
+            for r, rung in enumerate(self.rungs)
+            for instruction in rung.instructions
+        ]
+
+        count = len(self.rungs)
+        self.rung_total_ns = _zeros(count)
+        self.rung_max_ns = _zeros(count)
+        self.rung_last_ns = _zeros(count)
+        self.rung_calls = _zeros(count)
+
+        count = len(self.instructions)
+        self.inst_total_ns = _zeros(count)
+        self.inst_max_ns = _zeros(count)
+        self.inst_calls = _zeros(count)
+
+        self.scan_function = ProgramCompiler().compile(
+            self.rungs, program.tags, name='profiled_scan', instrument=self)
+
+    # -- code instrumentation (called by ProgramCompiler) -------------------
+
+    def emit_rung_start(self, gen, rung_index: int) -> None:
+        if rung_index == 0:
+            gen.namespace.update(
+                _clock=time.perf_counter_ns,
+                _RT=self.rung_total_ns, _RM=self.rung_max_ns,
+                _RL=self.rung_last_ns, _RC=self.rung_calls,
+                _IT=self.inst_total_ns, _IM=self.inst_max_ns, _IC=self.inst_calls)
+            gen.instruction_index = 0
+        gen.line("r0 = t0 = _clock()")
+
+    def emit_instruction_end(self, gen, instruction) -> None:
+        k = gen.instruction_index
+        gen.instruction_index += 1
+        gen.lines([
+            "t1 = _clock(); d = t1 - t0; t0 = t1",
+            f"_IT[{k}] += d; _IC[{k}] += 1",
+            f"if d > _IM[{k}]: _IM[{k}] = d",
+        ])
+
+    def emit_rung_end(self, gen, rung_index: int) -> None:
+        r = rung_index
+        gen.lines([
+            f"d = t0 - r0; _RT[{r}] += d; _RL[{r}] = d; _RC[{r}] += 1",
+            f"if d > _RM[{r}]: _RM[{r}] = d",
+        ])
+
+    # -- results ------------------------------------------------------------
+
+    def reset(self) -> None:
+        for table in (self.rung_total_ns, self.rung_max_ns, self.rung_last_ns,
+                      self.rung_calls, self.inst_total_ns, self.inst_max_ns,
+                      self.inst_calls):
+            for i in range(len(table)):
+                table[i] = 0
+
+    def rung_stats(self) -> List[Dict]:
+        """Per-rung statistics, most expensive (cumulative) first"""
+        stats = [{
+            'rung_id': rung.rung_id,
+            'calls': self.rung_calls[r],
+            'total_ms': self.rung_total_ns[r] / 1e6,
+            'max_ms': self.rung_max_ns[r] / 1e6,
+            'last_ms': self.rung_last_ns[r] / 1e6,
+        } for r, rung in enumerate(self.rungs)]
+        return sorted(stats, key=lambda item: item['total_ms'], reverse=True)
+
+    def instruction_stats(self) -> List[Dict]:
+        """Per-instruction-type statistics, most expensive first"""
+        totals = defaultdict(lambda: {'calls': 0, 'total_ns': 0, 'max_ns': 0})
+        for k, (_, type_name) in enumerate(self.instructions):
+            entry = totals[type_name]
+            entry['calls'] += self.inst_calls[k]
+            entry['total_ns'] += self.inst_total_ns[k]
+            entry['max_ns'] = max(entry['max_ns'], self.inst_max_ns[k])
+
+        stats = [{
+            'type': type_name,
+            'calls': entry['calls'],
+            'total_ms': entry['total_ns'] / 1e6,
+            'max_ms': entry['max_ns'] / 1e6,
+        } for type_name, entry in totals.items()]
+        return sorted(stats, key=lambda item: item['total_ms'], reverse=True)
+
+    def slowest_rungs_last_scan(self, limit: int = 3) -> List[Tuple[int, float]]:
+        """(rung_id, ms) of the most expensive rungs in the last scan"""
+        ranked = sorted(range(len(self.rungs)), key=lambda r: self.rung_last_ns[r], reverse=True)
+        return [(self.rungs[r].rung_id, self.rung_last_ns[r] / 1e6) for r in ranked[:limit]]
+
+    def report(self, limit: int = 20) -> str:
+        """Sorted text report of the most expensive rungs and instruction types"""
+        lines = [f"  {'Rung':>8} {'Calls':>10} {'Total ms':>12} {'Max ms':>10}"]
+        for entry in self.rung_stats()[:limit]:
+            lines.append(f"  {entry['rung_id']:>8} {entry['calls']:>10} "
+                         f"{entry['total_ms']:>12.3f} {entry['max_ms']:>10.4f}")
+        lines.append("")
+        lines.append(f"  {'Type':>8} {'Calls':>10} {'Total ms':>12} {'Max ms':>10}")
+        for entry in self.instruction_stats():
+            lines.append(f"  {entry['type']:>8} {entry['calls']:>10} "
+                         f"{entry['total_ms']:>12.3f} {entry['max_ms']:>10.4f}")
+        return '\n'.join(lines)
+
+    def collapsed_stacks(self) -> List[str]:
+        """
+        Flamegraph-compatible collapsed stacks ("frame;frame value"),
+        values in microseconds.
+        """
+        per_type = defaultdict(int)
+        per_rung = defaultdict(int)
+        lines = []
+        for k, (r, type_name) in enumerate(self.instructions):
+            per_type[(r, type_name)] += self.inst_total_ns[k]
+            per_rung[r] += self.inst_total_ns[k]
+
+        for (r, type_name), total_ns in sorted(per_type.items()):
+            if total_ns:
+                lines.append(f"scan;rung_{self.rungs[r].rung_id};{type_name} {total_ns // 1000}")
+
+        for r, rung in enumerate(self.rungs):
+            overhead_ns = self.rung_total_ns[r] - per_rung[r]
+            if overhead_ns > 0:
+                lines.append(f"scan;rung_{rung.rung_id} {overhead_ns // 1000}")
+        return lines
+
+    def write_collapsed(self, path: str) -> None:
+        """Write collapsed stacks for flamegraph.pl / speedscope"""
+        with open(path, 'w') as f:
+            f.write('\n'.join(self.collapsed_stacks()) + '\n')
@@ -0,0 +1,158 @@
+"""
+Program Cache
+Precompiled binary artifact of a loaded ladder program, stored next to
+its JSON source (program.json -> program.plcc).
+
+The artifact holds the rung/instruction data, the resolved tag slot
+layout and the bytecode of the compiled scan functions (whole program
+and per task), serialised with marshal behind a fixed header:
+
+    magic 'PLCC' | format version | Python bytecode magic |
+    SHA-256 of the JSON | SHA-256 of the code generator sources
+
+A cache is only used when the header matches the current JSON content,
+interpreter and code generator, so editing the program, upgrading Python
+or changing how rungs compile simply falls back to the JSON path, which
+rewrites the cache.
+
+Only compiled mode (the default) skips code generation. Interpreted mode
+needs no code. Incremental and parallel mode generate their own scan
+structures from the rungs on every load (per-rung functions and
+dependency sets, or partitions and a forked worker pool). For them the
+cache saves only the JSON parse and the tag layout.
+"""
+
+import os
+import mmap
+import struct
+import marshal
+import hashlib
+import logging
+import builtins
+import importlib.util
+from types import FunctionType
+from typing import Any, Dict, Optional
+
+from .tags import AREAS
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PLCC'
+FORMAT_VERSION = 4
+HEADER = struct.Struct('<4sH4s32s32s')
+CACHE_SUFFIX = '.plcc'
+# Modules whose code decides what a cached scan function does
+GENERATOR_MODULES = ('compiler', 'logic', 'instructions', 'tags', 'program_cache')
+
+
+def cache_path(json_file: str) -> str:
+    """Cache file location for a program JSON file"""
+    return os.path.splitext(json_file)[0] + CACHE_SUFFIX
+
+
+def digest(source: bytes) -> bytes:
+    return hashlib.sha256(source).digest()
+
+
+def _generator_digest() -> bytes:
+    sha = hashlib.sha256()
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for module in GENERATOR_MODULES:
+        with open(os.path.join(package_dir, module + '.py'), 'rb') as f:
+            sha.update(f.read())
+    return sha.digest()
+
+
+GENERATOR_DIGEST = _generator_digest()
+
+
+def _header(source_digest: bytes) -> bytes:
+    return HEADER.pack(MAGIC, FORMAT_VERSION, importlib.util.MAGIC_NUMBER, source_digest,
+                       GENERATOR_DIGEST)
+
+
+def save(json_file: str, source_digest: bytes, program, program_data: Dict) -> str:
+    """
+    Write the cache for a program that was just loaded from JSON.
+    `program_data` is the parsed JSON. Returns the cache path.
+    """
+    tags = program.tags
+    slots = sorted(((data_type, index, tag_name) for tag_name, (data_type, index)
+                    in tags.slots.items()), key=lambda slot: (AREAS.index(slot[0]), slot[1]))
+
+    functions = {task.function_name: task.scan_function for task in program.tasks}
+    functions['scan'] = program.compiled_scan
+    code = {}
+    for name, function in functions.items():
+        # Only self-contained scans (no interpreter fallback objects) are cached
+        if function is None or any(key.startswith('_K') for key in function.__globals__):
+            code = None
+            break
+        code[name] = (marshal.dumps(function.__code__), getattr(function, 'source', None))
+
+    payload = {
+        'program': {
+            'scan_time_ms': program_data.get('scan_time_ms', 100),
+            'tasks': program_data.get('tasks', []),
+            'retentive': program_data.get('retentive', []),
+            'tags': program_data.get('tags', {}),
+            'rungs': [{'rung_id': rung['rung_id'], 'instructions': rung.get('instructions', [])}
+                      for rung in program_data.get('rungs', [])],
+        },
+        'slots': [(tag_name, data_type, index, tags.areas[data_type][index])
+                  for data_type, index, tag_name in slots],
+        'code': code,
+    }
+
+    path = cache_path(json_file)
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(_header(source_digest))
+        f.write(marshal.dumps(payload))
+    os.replace(temporary, path)
+    return path
+
+
+def load(json_file: str, source_digest: bytes) -> Optional[Dict[str, Any]]:
+    """Memory-map and load the cache; None if missing, stale or unreadable"""
+    path = cache_path(json_file)
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:HEADER.size] != _header(source_digest):
+                logger.info(f"Program cache {path} is stale")
+                return None
+            with memoryview(data) as view:
+                return marshal.loads(view[HEADER.size:])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, EOFError, TypeError) as e:
+        logger.warning(f"Ignoring unreadable program cache {path}: {e}")
+        return None
+
+
+def restore_slots(tags, cached: Dict[str, Any]) -> bool:
+    """
+    Recreate the cached tag layout in a tag database.
+    Returns False if the resulting slots differ (e.g. the database
+    already held other tags), in which case the cached code is unusable.
+    """
+    for tag_name, data_type, index, value in cached['slots']:
+        if tags.allocate(tag_name, data_type, value) != (data_type, index):
+            return False
+    return True
+
+
+def scan_functions(cached: Dict[str, Any]) -> Optional[Dict[str, FunctionType]]:
+    """
+    Rebuild the compiled scan functions from cached bytecode, keyed by
+    'scan' (whole program) and task function name
+    """
+    if not cached.get('code'):
+        return None
+    functions = {}
+    for name, (data, source) in cached['code'].items():
+        code = marshal.loads(data)
+        function = FunctionType(code, {'__builtins__': builtins}, code.co_name)
+        function.source = source
+        functions[name] = function
+    return functions
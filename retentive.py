@@ -0,0 +1,330 @@
+"""
+Retentive Tags
+Keeps the values of retentive tags (counter accumulators, latched bits,
+totals) across restarts in a small memory-mapped snapshot file.
+
+Retentive tags are listed in the program JSON:
+
+    "retentive": ["RUN_HOURS", "FAULT_LATCH"]
+
+A timer or counter name covers all its members (RUN_HOURS.ACC, .DN, the
+edge storage, ...) except the preset, which always comes from the program;
+an array name covers all its elements.
+
+The file holds two buffers (double buffering). A write goes to the
+older buffer, which is then committed with a higher sequence number
+and a CRC32 over its contents; on startup the newest buffer with a valid
+CRC is restored. A crash or power loss while a buffer is written leaves
+the other, complete one.
+
+Each buffer is self-describing:
+
+    header (32 bytes) | count x 8-byte value | tag table (JSON [[name, type], ...])
+
+Per scan the runtime only gathers the retentive values from the
+published image and compares them with the last ones (C-speed tuple
+operations). Changed values are handed to a writer thread, at most once
+per `min_interval_ms`, which writes only the values that differ from the
+target buffer's contents, then syncs that buffer's pages. The file is
+not written at all while retentive values do not change.
+"""
+
+import os
+import json
+import mmap
+import time
+import zlib
+import struct
+import logging
+import threading
+from array import array
+from operator import itemgetter
+from typing import Any, Dict, List, Optional, Tuple
+
+from .instructions import walk
+from .tags import BOOL, REAL, AREAS
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PLCR'
+VERSION = 1
+HEADER = struct.Struct('<4sHxxIIQI4x')     # magic, version, count, table size, sequence, crc
+HEADER_SIZE = 32
+_SEQUENCE_OFFSET = 16                      # sequence and crc are written last (commit)
+_CRC_OFFSET = 24
+VALUE_INT = struct.Struct('<q')
+VALUE_REAL = struct.Struct('<d')
+
+Layout = Tuple[Tuple[str, str], ...]       # (name, data type) per stored value
+
+
+def retentive_tags(program) -> Layout:
+    """The program's retentive tags as (name, data type), in storage-area order"""
+    tags = program.tags
+    presets = {instruction.pre_tag for rung in program.rungs
+               for instruction in walk(rung.instructions) if hasattr(instruction, 'pre_tag')}
+    selected = []
+    for entry in program.retentive:
+        members = [tag_name for tag_name in tags.slots
+                   if tag_name == entry or tag_name.startswith((entry + '.', entry + '['))]
+        if not members:
+            logger.warning(f"Retentive tag {entry} is not used by the program")
+        selected.extend(tag_name for tag_name in members
+                        if tag_name not in presets and not tag_name.startswith('_SYSTEM'))
+
+    slots = {tag_name: tags.slots[tag_name] for tag_name in selected}
+    ordered = sorted(slots, key=lambda tag_name: (AREAS.index(slots[tag_name][0]),
+                                                  slots[tag_name][1]))
+    return tuple((tag_name, slots[tag_name][0]) for tag_name in ordered)
+
+
+def _checksum(data, offset: int, end: int) -> int:
+    """CRC32 of a buffer (header up to the crc field, then values and table)"""
+    return zlib.crc32(data[offset + HEADER_SIZE:end], zlib.crc32(data[offset:offset + _CRC_OFFSET]))
+
+
+def _encode(layout: Layout, values: Tuple) -> bytes:
+    """Values (8 bytes each) followed by the tag table"""
+    ints = array('q', [int(value) for (_, data_type), value in zip(layout, values)
+                       if data_type != REAL])
+    reals = array('d', [value for (_, data_type), value in zip(layout, values)
+                        if data_type == REAL])
+    return ints.tobytes() + reals.tobytes() + json.dumps(layout).encode('utf-8')
+
+
+def _read_buffer(data, offset: int, size: int) -> Optional[Tuple[int, Layout, Tuple]]:
+    """(sequence, layout, values) of a committed buffer, or None if invalid"""
+    magic, version, count, table_size, sequence, crc = HEADER.unpack_from(data, offset)
+    end = offset + HEADER_SIZE + 8 * count + table_size
+    if magic != MAGIC or version != VERSION or end > offset + size or \
+            crc != _checksum(data, offset, end):
+        return None
+    try:
+        table = json.loads(bytes(data[end - table_size:end]).decode('utf-8'))
+        layout = tuple((tag_name, data_type) for tag_name, data_type in table)
+    except (ValueError, TypeError):
+        return None
+    if len(layout) != count:
+        return None
+    values = tuple((VALUE_REAL if data_type == REAL else VALUE_INT).unpack_from(
+        data, offset + HEADER_SIZE + 8 * n)[0] for n, (_, data_type) in enumerate(layout))
+    return sequence, layout, values
+
+
+class RetentiveStore:
+    """Restores retentive tags at startup and saves them when they change"""
+
+    def __init__(self, path: str, min_interval_ms: float = 1000):
+        self.path = path
+        self.min_interval_ns = int(min_interval_ms * 1_000_000)
+
+        self.file = None
+        self.map = None
+        self.buffer_size = 0
+        # Per buffer: (sequence, layout, values) as last committed
+        self.buffers: List[Optional[Tuple[int, Layout, Tuple]]] = [None, None]
+        self.saved: Dict[str, Tuple[str, Any]] = {}
+        if os.path.exists(path):
+            self._open()
+
+        # Scan thread side
+        self.layout: Layout = ()
+        self.getters = []
+        self.values = None
+        self.dirty = False
+        self.last_write_ns = 0
+
+        # Writer thread: latest (layout, values) not yet written
+        self.pending = None
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.writer = None
+        self.writes = 0
+
+    def _open(self) -> None:
+        """Map an existing file and read the newest valid buffer"""
+        size = os.path.getsize(self.path)
+        if size < 2 * HEADER_SIZE or size % 2:
+            logger.warning(f"Retentive file {self.path} is not valid - starting a new one")
+            return
+        self.file = open(self.path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.buffer_size = size // 2
+        self.buffers = [_read_buffer(self.map, n * self.buffer_size, self.buffer_size)
+                        for n in range(2)]
+
+        valid = [buffer for buffer in self.buffers if buffer is not None]
+        if not valid:
+            logger.warning(f"Retentive file {self.path} has no valid snapshot - "
+                           f"retentive tags start from their initial values")
+            return
+        _, layout, values = max(valid, key=lambda buffer: buffer[0])
+        self.saved = {tag_name: (data_type, value)
+                      for (tag_name, data_type), value in zip(layout, values)}
+
+    def bind(self, program, restore: bool = True) -> int:
+        """
+        Track the program's retentive tags; with `restore`, first write
+        their saved values to the tags (at startup, before the first
+        scan). Returns the number of restored tags.
+        """
+        tags = program.tags
+        layout = retentive_tags(program)
+        restored = 0
+        if restore:
+            for tag_name, data_type in layout:
+                saved = self.saved.get(tag_name)
+                if saved is None:
+                    continue
+                if saved[0] != data_type:
+                    logger.warning(f"Retentive tag {tag_name} was saved as {saved[0]}, "
+                                   f"is {data_type} - not restored")
+                    continue
+                tags.set(tag_name, bool(saved[1]) if data_type == BOOL else saved[1])
+                restored += 1
+            if restored:
+                logger.info(f"Restored {restored} retentive tags from {self.path}")
+
+        self.layout = layout
+        self.getters = []
+        for area in AREAS:
+            indices = [tags.slots[tag_name][1] for tag_name, data_type in layout
+                       if data_type == area]
+            if len(indices) == 1:
+                index = indices[0]
+                self.getters.append((area, lambda values, index=index: (values[index],)))
+            elif indices:
+                self.getters.append((area, itemgetter(*indices)))
+        # A new layout is written with the first update
+        self.values = None
+        return restored
+
+    def update(self, image) -> None:
+        """
+        Called after every scan with the published image: notes changed
+        retentive values and hands them to the writer thread, at most
+        once per min_interval_ms
+        """
+        if not self.layout:
+            return
+        areas = image.areas
+        values = ()
+        for area, getter in self.getters:
+            values += getter(areas[area])
+        if values != self.values:
+            self.values = values
+            self.dirty = True
+        if self.dirty:
+            now = time.monotonic_ns()
+            if now - self.last_write_ns >= self.min_interval_ns:
+                self.last_write_ns = now
+                self.dirty = False
+                self._hand_off(self.layout, values)
+
+    def _hand_off(self, layout: Layout, values: Tuple) -> None:
+        with self.condition:
+            self.pending = (layout, values)
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_loop, name='retentive',
+                                               daemon=True)
+                self.writer.start()
+            self.condition.notify()
+
+    def _write_loop(self) -> None:
+        while True:
+            with self.condition:
+                while self.pending is None and not self.stopping:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                pending, self.pending = self.pending, None
+            try:
+                self.write(*pending)
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not save retentive tags to {self.path}: {e}")
+
+    def write(self, layout: Layout, values: Tuple) -> None:
+        """Commit a snapshot to the older buffer and sync it to disk"""
+        table = json.dumps(layout).encode('utf-8')
+        needed = HEADER_SIZE + 8 * len(layout) + len(table)
+        if self.map is None or needed > self.buffer_size:
+            self._create(layout, values, needed)
+            return
+
+        committed = [buffer[0] if buffer else -1 for buffer in self.buffers]
+        target = 0 if committed[0] <= committed[1] else 1
+        offset = target * self.buffer_size
+        sequence = max(committed) + 1
+        data = self.map
+
+        previous = self.buffers[target]
+        if previous is None or previous[1] != layout:
+            payload = _encode(layout, values)
+            HEADER.pack_into(data, offset, MAGIC, VERSION, len(layout), len(table), 0, 0)
+            data[offset + HEADER_SIZE:offset + HEADER_SIZE + len(payload)] = payload
+        else:
+            # Same layout: only the values that differ from this buffer's
+            old = previous[2]
+            for n, (_, data_type) in enumerate(layout):
+                if values[n] != old[n]:
+                    (VALUE_REAL if data_type == REAL else VALUE_INT).pack_into(
+                        data, offset + HEADER_SIZE + 8 * n, values[n])
+
+        struct.pack_into('<Q', data, offset + _SEQUENCE_OFFSET, sequence)
+        struct.pack_into('<I', data, offset + _CRC_OFFSET,
+                         _checksum(data, offset, offset + needed))
+        data.flush(offset, self.buffer_size)
+        self.buffers[target] = (sequence, layout, values)
+        self.writes += 1
+
+    def _create(self, layout: Layout, values: Tuple, needed: int) -> None:
+        """
+        (Re)create the file with room for `layout` (and as many tags
+        again): written beside the old file, then renamed over it
+        """
+        page = mmap.PAGESIZE
+        buffer_size = max(page, -(-(2 * needed) // page) * page)
+        sequence = max(buffer[0] if buffer else -1 for buffer in self.buffers) + 1
+
+        image = bytearray(2 * buffer_size)
+        payload = _encode(layout, values)
+        table_size = len(payload) - 8 * len(layout)
+        HEADER.pack_into(image, 0, MAGIC, VERSION, len(layout), table_size, sequence, 0)
+        image[HEADER_SIZE:HEADER_SIZE + len(payload)] = payload
+        struct.pack_into('<I', image, _CRC_OFFSET, _checksum(image, 0, needed))
+
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(image)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+        self._close_map()
+        self.file = open(self.path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), len(image))
+        self.buffer_size = buffer_size
+        self.buffers = [(sequence, layout, values), None]
+        self.writes += 1
+
+    def close(self) -> None:
+        """Stop the writer thread, save unsaved values and close the file"""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+        if self.dirty:
+            self.dirty = False
+            try:
+                self.write(self.layout, self.values)
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not save retentive tags to {self.path}: {e}")
+        self._close_map()
+
+    def _close_map(self) -> None:
+        if self.map is not None:
+            self.map.close()
+            self.file.close()
+            self.map = None
@@ -6,9 +6,19 @@ Implements PLC-style scan cycle execution
 import json
 import time
 import logging
+import threading
 from typing import List, Dict, Any
-from .tags import TagDatabase
+from .tags import TagDatabase, AREAS
 from .instructions import *
+from .compiler import ProgramCompiler
+from .scheduler import ScanScheduler, Timebase, VirtualClock
+from .stats import ScanStatistics
+from .profiler import ScanProfiler
+from .incremental import IncrementalScan
+from .parallel import ParallelScan
+from .tasks import Task, TaskScheduler
+from . import program_cache
+from . import online_edit
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -35,23 +45,234 @@ class Rung:
         return rung_state
 
 
+def build_instructions(instruction_data: List[Dict]) -> List[Instruction]:
+    """Instructions from their program JSON (unknown types are skipped)"""
+    instructions = []
+    for inst_data in instruction_data:
+        inst_type = inst_data.get('type')
+        factory = INSTRUCTION_FACTORIES.get(inst_type)
+        if factory is None:
+            logger.warning(f"Unknown instruction type: {inst_type}")
+        else:
+            instructions.append(factory(inst_data))
+    return instructions
+
+
+# Instruction constructors by program JSON "type"
+INSTRUCTION_FACTORIES = {
+    'XIC': lambda data: XIC(data['tag']),
+    'XIO': lambda data: XIO(data['tag']),
+    'AFI': lambda data: AFI(),
+    'BRANCH': lambda data: Branch([build_instructions(leg) for leg in data['legs']]),
+    'OTE': lambda data: OTE(data['tag']),
+    'OTL': lambda data: OTL(data['tag']),
+    'OTU': lambda data: OTU(data['tag']),
+    'OSR': lambda data: OSR(data['tag']),
+    'TON': lambda data: TON(data['tag'], data['preset']),
+    'TOF': lambda data: TOF(data['tag'], data['preset']),
+    'CTU': lambda data: CTU(data['tag'], data['preset'], data.get('reset_tag')),
+    'CTD': lambda data: CTD(data['tag'], data['preset']),
+    'EQU': lambda data: EQU(data['source_a'], data['source_b']),
+    'NEQ': lambda data: NEQ(data['source_a'], data['source_b']),
+    'GRT': lambda data: GRT(data['source_a'], data['source_b']),
+    'GEQ': lambda data: GEQ(data['source_a'], data['source_b']),
+    'LES': lambda data: LES(data['source_a'], data['source_b']),
+    'LEQ': lambda data: LEQ(data['source_a'], data['source_b']),
+    'LIM': lambda data: LIM(data['low'], data['test'], data['high']),
+    'MOV': lambda data: MOV(data['source'], data['dest']),
+    'ADD': lambda data: ADD(data['source_a'], data['source_b'], data['dest']),
+    'SUB': lambda data: SUB(data['source_a'], data['source_b'], data['dest']),
+    'MUL': lambda data: MUL(data['source_a'], data['source_b'], data['dest']),
+    'DIV': lambda data: DIV(data['source_a'], data['source_b'], data['dest']),
+    'CPT': lambda data: CPT(data['dest'], data['expression']),
+    'COP': lambda data: COP(data['source'], data['dest'], data['length']),
+    'FLL': lambda data: FLL(data['source'], data['dest'], data['length']),
+}
+
+
 class LadderProgram:
     """Container for the complete ladder logic program"""
     
-    def __init__(self):
+    COMPILED = 'compiled'
+    INTERPRETED = 'interpreted'
+    INCREMENTAL = 'incremental'
+    PARALLEL = 'parallel'
+    MODES = (COMPILED, INTERPRETED, INCREMENTAL, PARALLEL)
+    
+    def __init__(self, mode: str = COMPILED, workers: int = None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown execution mode: {mode}")
+        
         self.rungs: List[Rung] = []
         self.tags = TagDatabase()
+        self.mode = mode
+        self.timebase = Timebase()
+        self.compiled_scan = None
+        self.incremental = None
+        self.workers = workers
+        self.parallel = None
+        self.profiler = None
+        self.tasks: List[Task] = []
+        
+        # Program JSON as loaded (rung diffs for online edits)
+        self.source_file = None
+        self.program_data: Dict[str, Any] = {}
+        
+        # Tags (or timer/counter names) kept across restarts (see retentive.py)
+        self.retentive: List[str] = []
+        
+        # Declared tags: name -> data type or {"type", "value", "length"}
+        self.tag_declarations: Dict[str, Any] = {}
     
     def add_rung(self, rung: Rung):
         """Add a rung to the program"""
         self.rungs.append(rung)
+        self.compiled_scan = None
+        self.incremental = None
+        self.close()
+    
+    def add_task(self, task: Task):
+        """Add a task; each rung may belong to at most one task"""
+        if any(existing.name == task.name for existing in self.tasks):
+            raise ValueError(f"Duplicate task name: {task.name}")
+        
+        assigned = {id(rung) for existing in self.tasks for rung in existing.rungs}
+        for rung in task.rungs:
+            if id(rung) in assigned:
+                raise ValueError(f"Rung {rung.rung_id} is assigned to more than one task")
+        
+        self.tasks.append(task)
+    
+    def declare_tags(self, tags: TagDatabase = None):
+        """
+        Assign storage slots to every tag the program declares or writes,
+        so each tag gets its data type from its declaration or the
+        instruction that owns it (e.g. TON members) before contacts
+        reference it. Declares into the program's own tags unless
+        another database is given.
+        """
+        tags = self.tags if tags is None else tags
+        
+        for tag_name, declaration in self.tag_declarations.items():
+            tags.declare(tag_name, declaration)
+        
+        # Timers and counters next, one struct-of-arrays block per task and
+        # instruction type, so each scan function advances its timers in
+        # as few passes as possible
+        for rungs in [task.rungs for task in self.tasks] or [self.rungs]:
+            structures = [instruction for rung in rungs for instruction in walk(rung.instructions)
+                          if isinstance(instruction, (Timer, Counter))]
+            presets = {}
+            for instruction in structures:
+                presets.setdefault(instruction.pre_tag, instruction.preset)
+            for kind in dict.fromkeys(type(instruction) for instruction in structures):
+                block = [instruction.tag for instruction in structures if type(instruction) is kind]
+                tags.allocate_block(block, kind.members, presets)
+        
+        for rung in self.rungs:
+            for instruction in rung.instructions:
+                instruction.declare(tags)
+        
+        # Remaining tags are only examined (contacts, reset inputs)
+        for rung in self.rungs:
+            for instruction in rung.instructions:
+                for tag_name in instruction.reads():
+                    tags.create(tag_name, False)
+    
+    def compile(self):
+        """
+        Compile all rungs into a single straight-line scan function,
+        and each task's rungs into its own function
+        """
+        self.declare_tags()
+        for task in self.tasks:
+            if self.mode == self.INCREMENTAL:
+                task.incremental = IncrementalScan(self, task.rungs, task.function_name)
+            else:
+                task.scan_function = ProgramCompiler().compile(
+                    task.rungs, self.tags, name=task.function_name)
+        
+        if self.mode == self.INCREMENTAL:
+            self.incremental = IncrementalScan(self)
+            return self.incremental.scan_function
+        self.compiled_scan = ProgramCompiler().compile(self.rungs, self.tags)
+        if self.mode == self.PARALLEL:
+            self.close()
+            self.parallel = ParallelScan(self, self.workers)
+        return self.compiled_scan
+    
+    def close(self):
+        """Release execution resources (parallel scan workers)"""
+        if self.parallel is not None:
+            self.parallel.close()
+            self.parallel = None
+    
+    def enable_profiling(self) -> ScanProfiler:
+        """Switch to an instrumented scan that records per-rung timing"""
+        self.declare_tags()
+        self.profiler = ScanProfiler(self)
+        if self.tasks:
+            logger.warning("Profiling instruments the single-rate scan; tasks run uninstrumented")
+        return self.profiler
+    
+    def disable_profiling(self):
+        """Return to the uninstrumented scan"""
+        self.profiler = None
     
     def execute_scan(self):
         """Execute one complete scan of all rungs"""
-        for rung in self.rungs:
+        self.tags.delta_ms = self.timebase.tick()
+        areas = self.tags.areas
+        
+        if self.profiler is not None:
+            self.profiler.scan_function(self.tags, self.tags.delta_ms, *[areas[area] for area in AREAS])
+        elif self.mode == self.COMPILED:
+            if self.compiled_scan is None:
+                self.compile()
+            self.compiled_scan(self.tags, self.tags.delta_ms, *[areas[area] for area in AREAS])
+        elif self.mode == self.INCREMENTAL:
+            if self.incremental is None:
+                self.compile()
+            self.incremental.execute(self.tags.delta_ms)
+        elif self.mode == self.PARALLEL:
+            if self.parallel is None:
+                self.compile()
+            self.parallel.execute(self.tags.delta_ms)
+        else:
+            self.execute_scan_interpreted()
+    
+    def execute_task(self, task: Task):
+        """
+        Execute one run of a task's rungs on the task's own time base
+        (tasks of a parallel program run their compiled scan in-process)
+        """
+        dt = self.tags.delta_ms = task.timebase.tick()
+        areas = self.tags.areas
+        
+        if self.mode == self.INTERPRETED:
+            self.execute_rungs(task.rungs)
+        elif self.mode == self.INCREMENTAL:
+            if task.incremental is None:
+                self.compile()
+            task.incremental.execute(dt)
+        else:
+            if task.scan_function is None:
+                self.compile()
+            task.scan_function(self.tags, dt, *[areas[area] for area in AREAS])
+    
+    def execute_scan_interpreted(self):
+        """Reference execution: evaluate every instruction object in turn"""
+        self.execute_rungs(self.rungs)
+    
+    def execute_rungs(self, rungs: List[Rung]):
+        """Advance the rungs' timing timers by tags.delta_ms, then execute the rungs"""
+        if self.tags.delta_ms:
+            for timer in timers(rungs):
+                timer.advance(self.tags)
+        for rung in rungs:
             rung.execute(self.tags)
     
-    def load_from_json(self, json_file: str):
+    def load_from_json(self, json_file: str, use_cache: bool = True):
         """
         Load ladder program from JSON file.
         
@@ -59,69 +280,120 @@ class LadderProgram:
         {
             "program_name": "MyProgram",
             "scan_time_ms": 100,
+            "tasks": [
+                {"name": "fast", "period_ms": 10, "priority": 1, "rungs": [0]}
+            ],
+            "retentive": ["RUN_HOURS"],
+            "tags": {
+                "SPEED_SP": {"type": "REAL", "value": 12.5},
+                "RECIPE": {"type": "DINT", "length": 20}
+            },
             "rungs": [
                 {
                     "rung_id": 0,
                     "comment": "Start button logic",
                     "instructions": [
-                        {"type": "XIC", "tag": "START_BTN"},
+                        {"type": "BRANCH", "legs": [
+                            [{"type": "XIC", "tag": "START_BTN"}],
+                            [{"type": "XIC", "tag": "MOTOR_RUN"}]
+                        ]},
+                        {"type": "XIO", "tag": "STOP_BTN"},
                         {"type": "OTE", "tag": "MOTOR_RUN"}
                     ]
                 }
             ]
         }
+        
+        A BRANCH passes power if any of its legs (instruction lists,
+        evaluated with the incoming rung state) does.
+        
+        "tasks" is optional (see tasks.py); rungs not listed in a task
+        run in an implicit "main" task at scan_time_ms.
+        
+        "retentive" is optional: tags, or timer/counter names (all
+        members but the preset), whose values a RetentiveStore keeps
+        across restarts.
+        
+        "tags" is optional: data types (BOOL, DINT, REAL) and initial
+        values of tags, and arrays (with "length": elements RECIPE[0]
+        ... RECIPE[19]). Other tags get their type from the instructions
+        using them: BOOL for bit instructions, DINT for word instructions.
+        
+        With use_cache, a precompiled program cache next to the file
+        (see program_cache.py) is used when it matches the JSON content,
+        and is (re)written after loading from JSON otherwise.
         """
-        with open(json_file, 'r') as f:
-            program_data = json.load(f)
+        with open(json_file, 'rb') as f:
+            source = f.read()
+        source_digest = program_cache.digest(source)
+        cached = program_cache.load(json_file, source_digest) if use_cache else None
+        program_data = cached['program'] if cached else json.loads(source)
         
         self.rungs = []
+        self.tasks = []
+        self.source_file = json_file
+        self.program_data = program_data
+        self.retentive = list(program_data.get('retentive', []))
+        self.tag_declarations = dict(program_data.get('tags', {}))
+        scan_time_ms = program_data.get('scan_time_ms', 100)
+        if scan_time_ms <= 0:
+            raise ValueError(f"Invalid program {json_file}: scan_time_ms must be positive")
         
         for rung_data in program_data.get('rungs', []):
-            instructions = []
-            
-            for inst_data in rung_data.get('instructions', []):
-                inst_type = inst_data.get('type')
-                
-                # Create instruction based on type
-                if inst_type == 'XIC':
-                    instructions.append(XIC(inst_data['tag']))
-                
-                elif inst_type == 'XIO':
-                    instructions.append(XIO(inst_data['tag']))
-                
-                elif inst_type == 'OTE':
-                    instructions.append(OTE(inst_data['tag']))
-                
-                elif inst_type == 'OTL':
-                    instructions.append(OTL(inst_data['tag']))
-                
-                elif inst_type == 'OTU':
-                    instructions.append(OTU(inst_data['tag']))
-                
-                elif inst_type == 'OSR':
-                    instructions.append(OSR(inst_data['tag']))
-                
-                elif inst_type == 'TON':
-                    instructions.append(TON(inst_data['tag'], inst_data['preset']))
-                
-                elif inst_type == 'TOF':
-                    instructions.append(TOF(inst_data['tag'], inst_data['preset']))
-                
-                elif inst_type == 'CTU':
-                    reset_tag = inst_data.get('reset_tag')
-                    instructions.append(CTU(inst_data['tag'], inst_data['preset'], reset_tag))
-                
-                elif inst_type == 'CTD':
-                    instructions.append(CTD(inst_data['tag'], inst_data['preset']))
-                
-                else:
-                    logger.warning(f"Unknown instruction type: {inst_type}")
-            
+            instructions = build_instructions(rung_data.get('instructions', []))
             rung = Rung(rung_data['rung_id'], instructions)
             self.add_rung(rung)
         
-        logger.info(f"Loaded program with {len(self.rungs)} rungs")
-        return program_data.get('scan_time_ms', 100)
+        for task_data in program_data.get('tasks', []):
+            self.add_task(Task.from_dict(task_data, self.rungs))
+        
+        if self.tasks:
+            assigned = {id(rung) for task in self.tasks for rung in task.rungs}
+            unassigned = [rung for rung in self.rungs if id(rung) not in assigned]
+            if unassigned:
+                lowest = max(task.priority for task in self.tasks) + 1
+                self.add_task(Task('main', unassigned, period_ms=scan_time_ms, priority=lowest))
+            for task in self.tasks:
+                logger.info(f"  {task}")
+        
+        if cached and self._load_cached(cached):
+            logger.info(f"Loaded program with {len(self.rungs)} rungs ({self.mode}) from cache")
+            return scan_time_ms
+        
+        self.declare_tags()
+        if self.mode != self.INTERPRETED:
+            self.compile()
+        
+        if use_cache and not cached:
+            try:
+                program_cache.save(json_file, source_digest, self, program_data)
+            except OSError as e:
+                logger.warning(f"Could not write program cache: {e}")
+        
+        logger.info(f"Loaded program with {len(self.rungs)} rungs ({self.mode})")
+        return scan_time_ms
+    
+    def _load_cached(self, cached: Dict) -> bool:
+        """
+        Restore the tag layout and compiled scans from a program cache.
+        Returns False if the cached code cannot be used with these tags.
+        """
+        if not program_cache.restore_slots(self.tags, cached):
+            return False
+        if self.mode == self.INTERPRETED:
+            return True
+        
+        functions = program_cache.scan_functions(cached)
+        if self.mode != self.COMPILED or functions is None:
+            # Incremental and parallel scans are not cached: they are
+            # generated again from the rungs (only the JSON parse is saved)
+            self.compile()
+            return True
+        
+        self.compiled_scan = functions['scan']
+        for task in self.tasks:
+            task.scan_function = functions[task.function_name]
+        return True
 
 
 class PLCRuntime:
@@ -130,59 +402,211 @@ class PLCRuntime:
     Executes ladder logic in continuous scan cycles
     """
     
-    def __init__(self, scan_time_ms: int = 100):
-        self.program = LadderProgram()
+    def __init__(self, scan_time_ms: int = 100, mode: str = LadderProgram.COMPILED,
+                 overrun_policy: str = ScanScheduler.SKIP, workers: int = None,
+                 clock=time.monotonic_ns):
+        self.program = LadderProgram(mode, workers)
         self.scan_time_ms = scan_time_ms
+        
+        # Release times and timers use `clock`; a VirtualClock runs scans
+        # back-to-back in simulated time (see simulation.py)
+        self.clock = clock
+        self.program.timebase.clock = clock
+        self.overrun_policy = overrun_policy
+        self.scheduler = None
+        self.stats = ScanStatistics()
         self.running = False
         self.io_manager = None
+        self.historian = None
+        self.retentive = None
+        
+        # Set to cut the inter-scan sleep short (out-of-cycle scan)
+        self.wake = threading.Event()
+        self.event_scans = 0
+        
+        # Online edits (see online_edit.py): swapped in by the scan thread
+        self.staged_edit = None
+        self.previous_program = None
+        self.scan_thread = None
+        self.edit_lock = threading.Lock()
     
     def attach_io(self, io_manager):
         """Attach I/O manager for physical GPIO"""
         self.io_manager = io_manager
+        io_manager.on_priority_edge = self.request_scan
+    
+    def attach_historian(self, historian):
+        """Record tag changes of every completed scan (see historian.py)"""
+        self.historian = historian
+    
+    def attach_retentive(self, store):
+        """
+        Restore the program's retentive tags from `store` (call before
+        the first scan) and save them when they change (see retentive.py)
+        """
+        self.retentive = store
+        store.bind(self.program)
     
-    def load_program(self, json_file: str):
-        """Load ladder program from JSON"""
-        self.scan_time_ms = self.program.load_from_json(json_file)
+    def request_scan(self):
+        """
+        Run a scan as soon as possible instead of waiting for the next
+        period (thread-safe; called on edges of priority inputs).
+        In a multi-rate program this wakes the task scheduler, so event
+        tasks triggered by the input run immediately.
+        """
+        self.wake.set()
+    
+    def _sleep(self, seconds: float):
+        """Interruptible sleep between scans"""
+        if self.wake.wait(seconds):
+            self.wake.clear()
+    
+    def load_program(self, json_file: str, use_cache: bool = True):
+        """Load ladder program from JSON (or its program cache)"""
+        self.scan_time_ms = self.program.load_from_json(json_file, use_cache)
+    
+    def load_online(self, json_file: str, timeout: float = 5.0) -> online_edit.ProgramDiff:
+        """
+        Online edit: load, validate and compile a new program on the
+        calling thread while scans go on, then swap it in at the next
+        scan boundary keeping all tag, timer and counter state.
+        Returns the differences to the replaced program. Raises
+        ValueError if the program is invalid (the running program is
+        left unchanged).
+        """
+        with self.edit_lock:
+            edit = online_edit.prepare(self.program, json_file)
+            self._commit(edit, timeout)
+            logger.info(f"Online edit: loaded {json_file}\n{edit.diff.report()}")
+            return edit.diff
+    
+    def rollback(self, timeout: float = 5.0) -> online_edit.ProgramDiff:
+        """Swap back to the program replaced by the last online edit (or rollback)"""
+        with self.edit_lock:
+            if self.previous_program is None:
+                raise ValueError("No previous program to roll back to")
+            edit = online_edit.rollback(self.program, self.previous_program)
+            self._commit(edit, timeout)
+            logger.info(f"Online edit: rolled back\n{edit.diff.report()}")
+            return edit.diff
+    
+    def _commit(self, edit: online_edit.ProgramEdit, timeout: float):
+        """Have the scan thread apply an edit between scans"""
+        if not self.running or threading.get_ident() == self.scan_thread:
+            # No scan in progress: this is a scan boundary
+            edit.apply(self)
+        else:
+            self.staged_edit = edit
+            if not edit.done.wait(timeout) and edit.cancel():
+                raise TimeoutError(f"Online edit not applied within {timeout}s")
+        if edit.error is not None:
+            raise edit.error
     
     def start(self):
         """Start the PLC scan cycle"""
         self.running = True
+        self.wake.clear()
+        self.program.timebase.reset()
         self.program.tags.set('_SYSTEM.RUNNING', True)
+        self.program.tags.publish()
         logger.info(f"PLC Runtime started (scan time: {self.scan_time_ms}ms)")
     
     def stop(self):
         """Stop the PLC scan cycle"""
         self.running = False
+        self.wake.set()
         self.program.tags.set('_SYSTEM.RUNNING', False)
+        self.program.tags.publish()
         logger.info("PLC Runtime stopped")
     
     def run_scan_cycle(self):
         """
         Execute one complete scan cycle:
-        1. Read inputs (from GPIO if attached)
+        1. Apply queued tag writes and read inputs (input image)
         2. Execute ladder logic
-        3. Write outputs (to GPIO if attached)
+        3. Write outputs (output image)
+        4. Publish the tag image for readers on other threads
         """
-        scan_start = time.time()
+        clock = time.perf_counter_ns
+        scan_start = clock()
         
         # Step 1: Read inputs
-        if self.io_manager:
-            self.io_manager.read_inputs(self.program.tags)
+        self.read_inputs()
+        inputs_done = clock()
         
         # Step 2: Execute ladder logic
         self.program.execute_scan()
+        logic_done = clock()
         
-        # Step 3: Write outputs
+        # Steps 3 and 4: Write outputs and publish
+        self.complete_cycle(scan_start, inputs_done, logic_done)
+    
+    def run_task_cycle(self, task_scheduler: TaskScheduler) -> bool:
+        """
+        Execute one multi-rate cycle: like run_scan_cycle, but step 2
+        runs only the tasks that are due, in priority order.
+        Returns False (after reading inputs only) if no task was due.
+        """
+        clock = time.perf_counter_ns
+        scan_start = clock()
+        tags = self.program.tags
+        
+        self.read_inputs()
+        task_scheduler.check_triggers(tags)
+        due = task_scheduler.due(task_scheduler.clock())
+        if not due:
+            return False
+        inputs_done = clock()
+        
+        task_start = inputs_done
+        for task in due:
+            self.program.execute_task(task)
+            task_end = clock()
+            self.stats.record_task(task.name, task_end - task_start)
+            task_start = task_end
+            
+            if task_scheduler.finish(task):
+                logger.warning(f"Task {task.name} overran its {task.period_ms}ms period "
+                               f"({task.scheduler.overruns} total)")
+        
+        self.complete_cycle(scan_start, inputs_done, task_start)
+        return True
+    
+    def read_inputs(self):
+        """Apply queued tag writes, then read the input image"""
+        tags = self.program.tags
+        tags.apply_pending()
         if self.io_manager:
-            self.io_manager.write_outputs(self.program.tags)
+            self.io_manager.read_inputs(tags)
+    
+    def complete_cycle(self, scan_start: int, inputs_done: int, logic_done: int):
+        """Write outputs, record cycle statistics and publish the tag image"""
+        tags = self.program.tags
+        if self.io_manager:
+            self.io_manager.write_outputs(tags)
+        scan_end = time.perf_counter_ns()
         
-        # Update scan time
-        scan_time = (time.time() - scan_start) * 1000
-        self.program.tags.set('_SYSTEM.SCAN_TIME', round(scan_time, 2))
+        # Update scan time and statistics
+        self.stats.record(inputs_done - scan_start, logic_done - inputs_done,
+                          scan_end - logic_done, scan_end - scan_start)
+        tags.set('_SYSTEM.SCAN_TIME', round((scan_end - scan_start) / 1_000_000, 2))
         
         # Increment cycle count
-        cycle_count = self.program.tags.get('_SYSTEM.CYCLE_COUNT', 0)
-        self.program.tags.set('_SYSTEM.CYCLE_COUNT', cycle_count + 1)
+        cycle_count = tags.get('_SYSTEM.CYCLE_COUNT', 0)
+        tags.set('_SYSTEM.CYCLE_COUNT', cycle_count + 1)
+        
+        # Publish the completed scan
+        image = tags.publish()
+        
+        # Recorded outside the measured scan time
+        if self.historian is not None:
+            self.historian.record(image)
+        if self.retentive is not None:
+            self.retentive.update(image)
+    
+    def get_statistics(self) -> Dict[str, Dict[str, float]]:
+        """Scan time statistics (min/max/mean/percentiles, per phase and task) in ms"""
+        return self.stats.summary()
     
     def run(self):
         """
@@ -191,19 +615,11 @@ class PLCRuntime:
         logger.info("Entering main execution loop...")
         
         try:
+            # Single-rate scans every scan_time_ms, or each task of a
+            # multi-rate program on its own period or trigger
+            self.create_scheduler()
             while self.running:
-                cycle_start = time.time()
-                
-                self.run_scan_cycle()
-                
-                # Sleep to maintain scan time
-                elapsed = (time.time() - cycle_start) * 1000
-                sleep_time = max(0, (self.scan_time_ms - elapsed) / 1000)
-                
-                if elapsed > self.scan_time_ms:
-                    logger.warning(f"Scan overrun: {elapsed:.2f}ms > {self.scan_time_ms}ms")
-                
-                time.sleep(sleep_time)
+                self.step()
         
         except KeyboardInterrupt:
             logger.info("Keyboard interrupt received")
@@ -213,6 +629,72 @@ class PLCRuntime:
             self.program.tags.set('_SYSTEM.ERROR', True)
         
         finally:
-            self.stop()
-            if self.io_manager:
-                self.io_manager.cleanup()
+            self.close()
+    
+    def close(self):
+        """Stop, and release the program's workers, I/O, history and retentive files"""
+        self.stop()
+        self.program.close()
+        if self.io_manager:
+            self.io_manager.cleanup()
+        if self.historian:
+            self.historian.close()
+        if self.retentive:
+            self.retentive.close()
+    
+    def create_scheduler(self):
+        """Anchor a new scan (or task) scheduler at the current time"""
+        # A virtual clock is advanced by the scheduler instead of slept on
+        sleep = self.clock.sleep if isinstance(self.clock, VirtualClock) else None
+        if self.program.tasks:
+            self.scheduler = TaskScheduler(self.program.tasks, self.overrun_policy,
+                                           poll_ms=self.scan_time_ms, clock=self.clock,
+                                           wake=self.wake, sleep=sleep)
+        else:
+            self.scheduler = ScanScheduler(self.scan_time_ms, self.overrun_policy,
+                                           clock=self.clock, sleep=sleep or self._sleep)
+        self.scheduler.start()
+    
+    def next_release_ns(self) -> int:
+        """Time (on the runtime clock) the next cycle is due"""
+        if self.scheduler is None:
+            self.create_scheduler()
+        if self.program.tasks:
+            return self.scheduler.next_wake_ns(self.clock())
+        return self.scheduler.next_release_ns
+    
+    def step(self):
+        """Wait for the next release, then run one cycle"""
+        self.scan_thread = threading.get_ident()
+        if self.staged_edit is not None:
+            edit, self.staged_edit = self.staged_edit, None
+            edit.apply(self)
+        
+        if self.scheduler is None:
+            self.create_scheduler()
+        
+        if self.program.tasks:
+            self.scheduler.wait()
+            self.scheduler.publish(self.program.tags)
+            self.run_task_cycle(self.scheduler)
+            return
+        
+        # Sleep until the next absolute release time
+        if self.scheduler.wait() is None:
+            # Woken early by request_scan(): extra scan off the period grid
+            if self.running:
+                self.event_scans += 1
+                self.run_scan_cycle()
+            return
+        self.scheduler.publish(self.program.tags)
+        
+        self.run_scan_cycle()
+        
+        if self.scheduler.finish():
+            scan_time = self.program.tags.get('_SYSTEM.SCAN_TIME', 0.0)
+            logger.warning(f"Scan overrun: {scan_time:.2f}ms > {self.scan_time_ms}ms "
+                           f"({self.scheduler.overruns} total)")
+            if self.program.profiler:
+                slowest = ', '.join(f"rung {rung_id} {ms:.2f}ms" for rung_id, ms
+                                    in self.program.profiler.slowest_rungs_last_scan())
+                logger.warning(f"Slowest rungs: {slowest}")
@@ -0,0 +1,187 @@
+"""
+Scan Scheduler
+Deadline-based periodic release of scan cycles, and the millisecond
+time base that timers accumulate.
+
+Releases are computed as absolute times (start + k * period) on a
+monotonic nanosecond clock, so sleep error never accumulates and the
+loop is immune to wall-clock (NTP) adjustments.
+
+Every clock is injectable; a VirtualClock makes scans run back-to-back
+while timers see the simulated scan period (see simulation.py).
+"""
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class VirtualClock:
+    """
+    Simulated monotonic nanosecond clock. Call it in place of
+    time.monotonic_ns; sleep() advances it instantly instead of waiting.
+    """
+
+    def __init__(self, start_ns: int = 0):
+        self.now_ns = start_ns
+
+    def __call__(self) -> int:
+        return self.now_ns
+
+    def advance(self, ns: int) -> None:
+        if ns > 0:
+            self.now_ns += ns
+
+    def sleep(self, seconds: float) -> None:
+        self.advance(round(seconds * 1_000_000_000))
+
+
+class Timebase:
+    """
+    Converts a nanosecond monotonic clock into whole-millisecond timer
+    ticks. The sub-millisecond remainder is carried to the next tick so
+    timers do not drift however the scan period jitters.
+    """
+
+    def __init__(self, clock=time.monotonic_ns):
+        self.clock = clock
+        self.last_ns = None
+        self.remainder_ns = 0
+
+    def tick(self) -> int:
+        """Return ms elapsed since the previous tick (0 on the first tick)"""
+        now = self.clock()
+        if self.last_ns is None:
+            self.last_ns = now
+            return 0
+
+        elapsed_ms, self.remainder_ns = divmod(now - self.last_ns + self.remainder_ns, 1_000_000)
+        self.last_ns = now
+        return elapsed_ms
+
+    def reset(self):
+        """Restart timing (e.g. after the runtime was stopped)"""
+        self.last_ns = None
+        self.remainder_ns = 0
+
+
+class ScanOverrunError(RuntimeError):
+    """Raised by the FAULT overrun policy when a scan misses its deadline"""
+
+
+class ScanScheduler:
+    """
+    Periodic scan scheduler with absolute deadlines.
+
+    Overrun policies (scan finished after the next release time):
+        skip     - drop the missed releases and resume on the period grid
+        catch_up - run the missed releases back-to-back until on time
+        fault    - raise ScanOverrunError
+
+    Period jitter is the difference between the measured start-to-start
+    interval and the nominal period.
+    """
+
+    SKIP = 'skip'
+    CATCH_UP = 'catch_up'
+    FAULT = 'fault'
+    POLICIES = (SKIP, CATCH_UP, FAULT)
+
+    def __init__(self, period_ms: float, overrun_policy: str = SKIP,
+                 clock=time.monotonic_ns, sleep=time.sleep):
+        if overrun_policy not in self.POLICIES:
+            raise ValueError(f"Unknown overrun policy: {overrun_policy}")
+        if period_ms <= 0:
+            raise ValueError(f"Scan period must be positive, got {period_ms}ms")
+
+        self.period_ns = int(period_ms * 1_000_000)
+        self.overrun_policy = overrun_policy
+        self.clock = clock
+        self.sleep = sleep
+
+        self.next_release_ns = None
+        self.last_start_ns = None
+        self.overruns = 0
+        self.skipped = 0
+
+        # Jitter statistics (ns)
+        self.jitter_ns = 0
+        self.max_jitter_ns = 0
+        self.jitter_sum_ns = 0
+        self.jitter_samples = 0
+
+    def start(self) -> None:
+        """Anchor the period grid at the current time"""
+        self.next_release_ns = self.clock()
+        self.last_start_ns = None
+
+    def wait(self) -> int:
+        """
+        Sleep until the next release time.
+        Returns the scan start time (ns), or None if the sleep function
+        returned early (an interruptible sleep was woken for an
+        out-of-cycle scan); the period grid is then left unchanged.
+        """
+        if self.next_release_ns is None:
+            self.start()
+
+        remaining = self.next_release_ns - self.clock()
+        if remaining > 0:
+            self.sleep(remaining / 1_000_000_000)
+            if self.clock() < self.next_release_ns:
+                return None
+
+        return self.begin(self.clock())
+
+    def begin(self, start_ns: int) -> int:
+        """Record the actual start time of a released scan (for jitter)"""
+        if self.last_start_ns is not None:
+            jitter = abs(start_ns - self.last_start_ns - self.period_ns)
+            self.jitter_ns = jitter
+            self.jitter_sum_ns += jitter
+            self.jitter_samples += 1
+            if jitter > self.max_jitter_ns:
+                self.max_jitter_ns = jitter
+        self.last_start_ns = start_ns
+        return start_ns
+
+    def finish(self) -> bool:
+        """
+        Mark the end of a scan and advance to the next release.
+        Returns True if the scan overran its period.
+        """
+        now = self.clock()
+        release = self.next_release_ns + self.period_ns
+
+        if now <= release:
+            self.next_release_ns = release
+            return False
+
+        self.overruns += 1
+        if self.overrun_policy == self.FAULT:
+            self.next_release_ns = release
+            raise ScanOverrunError(
+                f"Scan overrun: finished {(now - release) / 1e6:.2f}ms past the next release")
+
+        if self.overrun_policy == self.SKIP:
+            missed = (now - release) // self.period_ns + 1
+            self.skipped += missed
+            release += missed * self.period_ns
+            # Restart jitter measurement after deliberately dropped periods
+            self.last_start_ns = None
+
+        self.next_release_ns = release
+        return True
+
+    @property
+    def mean_jitter_ns(self) -> float:
+        if self.jitter_samples == 0:
+            return 0.0
+        return self.jitter_sum_ns / self.jitter_samples
+
+    def publish(self, tags) -> None:
+        """Write jitter and overrun statistics to _SYSTEM tags"""
+        tags.set('_SYSTEM.JITTER', round(self.jitter_ns / 1e6, 3))
+        tags.set('_SYSTEM.MAX_JITTER', round(self.max_jitter_ns / 1e6, 3))
+        tags.set('_SYSTEM.OVERRUNS', self.overruns)
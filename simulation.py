@@ -0,0 +1,113 @@
+"""
+Fast-forward Simulation
+Runs a PLCRuntime on a VirtualClock: scans execute back-to-back as fast
+as the CPU allows, while timers, schedulers and input filters see the
+simulated scan period. Hours of process behaviour run in seconds.
+
+    clock = VirtualClock()
+    runtime = PLCRuntime(clock=clock)
+    runtime.load_program('traffic_light.json')
+    io_manager = GPIOManager('io_config.json', SimulatedBackend(), clock)
+    runtime.attach_io(io_manager)
+    simulator = VirtualIOSimulator(io_manager)
+    simulator.schedule(500, 'START_BTN', 'pulse')
+
+    sim = Simulation(runtime, simulator)
+    sim.advance(60_000)                              # one simulated minute
+    sim.run_until('GREEN_LIGHT', timeout_ms=10_000)
+    sim.run_until(lambda tags: tags.get('COUNT') >= 5, timeout_ms=3_600_000)
+
+Scripted input changes (VirtualIOSimulator.schedule, times in ms since
+the simulation started) are applied before the first scan at or after
+their time.
+"""
+
+import time
+import logging
+from typing import Callable, Union
+
+from .scheduler import VirtualClock
+
+logger = logging.getLogger(__name__)
+
+Condition = Union[str, Callable]
+
+
+class Simulation:
+    """Steps a PLCRuntime through simulated time"""
+
+    def __init__(self, runtime, simulator=None):
+        if not isinstance(runtime.clock, VirtualClock):
+            raise ValueError("Simulation needs a runtime created with clock=VirtualClock()")
+
+        self.runtime = runtime
+        self.clock = runtime.clock
+        self.simulator = simulator
+        self.scans = 0
+
+        runtime.start()
+        runtime.create_scheduler()
+        self.start_ns = self.clock()
+
+    @property
+    def tags(self):
+        return self.runtime.program.tags
+
+    @property
+    def elapsed_ms(self) -> float:
+        """Simulated time since the simulation started"""
+        return (self.clock() - self.start_ns) / 1_000_000
+
+    def step(self) -> None:
+        """Move the clock to the next release and run one cycle"""
+        release = self.runtime.next_release_ns()
+        if release is not None:
+            self.clock.advance(release - self.clock())
+        if self.simulator is not None:
+            self.simulator.apply_script(self.elapsed_ms)
+        self.runtime.step()
+        self.scans += 1
+
+    def advance(self, ms: float) -> int:
+        """Run every cycle due in the next `ms` of simulated time; returns cycles run"""
+        end_ns = self.clock() + int(ms * 1_000_000)
+        scans = self.scans
+        while True:
+            release = self.runtime.next_release_ns()
+            if release is None or release > end_ns:
+                break
+            self.step()
+        # Leave the clock at the end of the interval
+        self.clock.advance(end_ns - self.clock())
+        return self.scans - scans
+
+    def run_until(self, condition: Condition, timeout_ms: float) -> float:
+        """
+        Run cycles until `condition` holds: a tag name (true when the
+        tag is truthy) or a function of the tag database. Returns the
+        simulated ms it took; raises TimeoutError after timeout_ms.
+        """
+        check = condition if callable(condition) else \
+            (lambda tags: bool(tags.get(condition, False)))
+        start_ns = self.clock()
+        end_ns = start_ns + int(timeout_ms * 1_000_000)
+        while not check(self.tags):
+            release = self.runtime.next_release_ns()
+            if release is None or release > end_ns:
+                raise TimeoutError(f"Condition {condition!r} not met within {timeout_ms}ms "
+                                   f"of simulated time")
+            self.step()
+        return (self.clock() - start_ns) / 1_000_000
+
+    def close(self) -> None:
+        self.runtime.close()
+
+    def run(self, ms: float) -> float:
+        """advance(ms), logging the speed-up over real time; returns the speed-up"""
+        start = time.perf_counter()
+        scans = self.advance(ms)
+        real_s = max(time.perf_counter() - start, 1e-9)
+        speedup = ms / 1000 / real_s
+        logger.info(f"Simulated {ms / 1000:.1f}s ({scans} cycles) in {real_s:.2f}s "
+                    f"({speedup:.0f}x real time)")
+        return speedup
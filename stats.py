@@ -0,0 +1,142 @@
+"""
+Scan Statistics
+Low-overhead streaming latency statistics for the scan cycle.
+
+Durations are recorded into a fixed set of geometric buckets (about 5%
+relative resolution from 1us to 60s), so memory use is constant and
+recording is a counter increment plus a C-level bisect. Percentiles are
+read back from the cumulative bucket counts.
+"""
+
+from array import array
+from bisect import bisect_left
+from typing import Dict, List
+
+
+def _bucket_bounds(low_ns: int = 1_000, high_ns: int = 60_000_000_000,
+                   ratio: float = 1.05) -> List[int]:
+    """Upper bounds (ns) of the histogram buckets"""
+    bounds = []
+    bound = float(low_ns)
+    while bound < high_ns:
+        bounds.append(int(bound))
+        bound *= ratio
+    bounds.append(high_ns)
+    return bounds
+
+
+BUCKET_BOUNDS = _bucket_bounds()
+
+PERCENTILES = (50.0, 95.0, 99.0, 99.9)
+
+
+class LatencyHistogram:
+    """Streaming min/max/mean and percentiles of durations in ns"""
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * (len(BUCKET_BOUNDS) + 1)))
+        self.reset()
+
+    def reset(self) -> None:
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+
+    def record(self, duration_ns: int) -> None:
+        self.counts[bisect_left(BUCKET_BOUNDS, duration_ns)] += 1
+        self.count += 1
+        self.total_ns += duration_ns
+        if self.min_ns is None or duration_ns < self.min_ns:
+            self.min_ns = duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+
+    @property
+    def mean_ns(self) -> float:
+        return self.total_ns / self.count if self.count else 0.0
+
+    def percentile(self, percent: float) -> int:
+        """Upper bound (ns) of the bucket holding the given percentile"""
+        if self.count == 0:
+            return 0
+
+        rank = self.count * percent / 100.0
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                bound = BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max_ns
+                return min(max(bound, self.min_ns), self.max_ns)
+        return self.max_ns
+
+    def summary(self) -> Dict[str, float]:
+        """Statistics in milliseconds"""
+        result = {
+            'count': self.count,
+            'min_ms': (self.min_ns or 0) / 1e6,
+            'max_ms': self.max_ns / 1e6,
+            'mean_ms': self.mean_ns / 1e6,
+        }
+        for percent in PERCENTILES:
+            result[f"p{percent:g}_ms"] = self.percentile(percent) / 1e6
+        return result
+
+
+class ScanStatistics:
+    """
+    Scan time statistics with a per-phase breakdown
+    (input read, ladder logic, output write) and, for multi-rate
+    programs, the execution time of each task.
+    """
+
+    PHASES = ('input', 'logic', 'output')
+
+    def __init__(self):
+        self.scan = LatencyHistogram()
+        self.phases = {phase: LatencyHistogram() for phase in self.PHASES}
+        self.tasks: Dict[str, LatencyHistogram] = {}
+
+    def record(self, input_ns: int, logic_ns: int, output_ns: int, total_ns: int) -> None:
+        """Record one completed scan"""
+        self.scan.record(total_ns)
+        phases = self.phases
+        phases['input'].record(input_ns)
+        phases['logic'].record(logic_ns)
+        phases['output'].record(output_ns)
+
+    def record_task(self, name: str, duration_ns: int) -> None:
+        """Record one run of a task"""
+        histogram = self.tasks.get(name)
+        if histogram is None:
+            histogram = self.tasks[name] = LatencyHistogram()
+        histogram.record(duration_ns)
+
+    def reset(self) -> None:
+        self.scan.reset()
+        for histogram in self.phases.values():
+            histogram.reset()
+        for histogram in self.tasks.values():
+            histogram.reset()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Statistics for the whole scan, each phase and each task (ms)"""
+        result = {'scan': self.scan.summary()}
+        for phase, histogram in self.phases.items():
+            result[phase] = histogram.summary()
+        for name, histogram in self.tasks.items():
+            result[f"task:{name}"] = histogram.summary()
+        return result
+
+    def report(self) -> str:
+        """Human-readable statistics table"""
+        columns = ['min_ms', 'mean_ms'] + [f"p{p:g}_ms" for p in PERCENTILES] + ['max_ms']
+        summary = self.summary()
+        width = max(8, *(len(name) for name in summary))
+        header = f"  {'':{width}}" + ''.join(f"{c[:-3]:>9}" for c in columns)
+        lines = [f"  Scans recorded: {self.scan.count}", header]
+        for name, stats in summary.items():
+            lines.append(f"  {name:{width}}" + ''.join(f"{stats[c]:9.3f}" for c in columns))
+        return '\n'.join(lines)
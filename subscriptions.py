@@ -0,0 +1,177 @@
+"""
+Tag Subscriptions
+Change notifications for HMI and monitoring clients.
+
+A client subscribes to a set of tags and/or name prefixes with
+subscribe(tags, ...). All subscriptions of a database share one
+SubscriptionHub, which maps storage slots to the subscriptions
+interested in them. When a scan is published the hub diffs the image
+once and routes each changed slot to its subscribers, so the cost per
+scan follows the number of changes, not the number of clients. Each
+subscription receives one delta per scan with changes to its tags:
+
+    (cycle, {"MOTOR_RUN": True, "RUN_TIMER.ACC": 1200})
+
+The first delta, queued at the next published scan, holds the current
+value of every subscribed tag.
+
+Queues are bounded. When a client falls behind, the policy decides
+what happens to a new delta arriving at a full queue:
+
+    coalesce - merge it into the newest queued delta (no change is
+               lost, intermediate values are)
+    drop     - discard the oldest queued delta and count it in `dropped`
+"""
+
+import threading
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .tags import BOOL, AREAS, TagDatabase, changed_indices
+
+Delta = Tuple[int, Dict[str, Any]]     # (scan cycle, {tag: value})
+
+
+class Subscription:
+    """A client's interest in a set of tags, with its queue of deltas"""
+
+    COALESCE = 'coalesce'
+    DROP = 'drop'
+    POLICIES = (COALESCE, DROP)
+
+    def __init__(self, tags: Iterable[str] = None, prefixes: Iterable[str] = None,
+                 maxlen: int = 16, policy: str = COALESCE):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown subscription policy: {policy}")
+        if maxlen < 1:
+            raise ValueError("Subscription queue length must be at least 1")
+        self.tags = set(tags) if tags else set()
+        self.prefixes = tuple(prefixes) if prefixes else ()
+        self.maxlen = maxlen
+        self.policy = policy
+
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def matches(self, tag_name: str) -> bool:
+        if not self.tags and not self.prefixes:
+            return True
+        return tag_name in self.tags or tag_name.startswith(self.prefixes)
+
+    def prime(self, image) -> None:
+        """Queue the current value of every subscribed tag"""
+        changes = {tag_name: image.get(tag_name) for tag_name in image.slots
+                   if self.matches(tag_name)}
+        self._put(image.cycle, changes)
+
+    def _put(self, cycle: int, changes: Dict[str, Any]) -> None:
+        with self.condition:
+            if len(self.queue) >= self.maxlen:
+                if self.policy == self.COALESCE:
+                    _, merged = self.queue.pop()
+                    merged.update(changes)
+                    changes = merged
+                else:
+                    self.queue.popleft()
+                    self.dropped += 1
+            self.queue.append((cycle, changes))
+            self.condition.notify()
+
+    def get(self, timeout: float = None) -> Optional[Delta]:
+        """Next delta, waiting up to timeout seconds; None on timeout or close"""
+        with self.condition:
+            if not self.queue and not self.closed:
+                self.condition.wait(timeout)
+            return self.queue.popleft() if self.queue else None
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class SubscriptionHub:
+    """Routes the changes of each published scan to the subscriptions"""
+
+    def __init__(self):
+        self.subscriptions: List[Subscription] = []   # replaced, never mutated
+        self.joining: List[Subscription] = []
+        self.lock = threading.Lock()
+        self.routes = {area: {} for area in AREAS}    # slot index -> (tag name, subscriptions)
+        self.routed_subscriptions = None
+        self.routed_slots = 0
+
+    def add(self, subscription: Subscription) -> None:
+        """Register a subscription; it is primed and routed at the next publish"""
+        with self.lock:
+            self.joining.append(subscription)
+
+    def remove(self, subscription: Subscription) -> None:
+        with self.lock:
+            self.joining = [s for s in self.joining if s is not subscription]
+            self.subscriptions = [s for s in self.subscriptions if s is not subscription]
+
+    def _route(self, slots: Dict[str, Tuple[str, int]]) -> None:
+        routes = {area: {} for area in AREAS}
+        for tag_name, (data_type, index) in slots.items():
+            subscribers = [s for s in self.subscriptions if s.matches(tag_name)]
+            if subscribers:
+                routes[data_type][index] = (tag_name, subscribers)
+        self.routes = routes
+        self.routed_subscriptions = self.subscriptions
+        self.routed_slots = len(slots)
+
+    def dispatch(self, previous, image) -> None:
+        """Called on the scan thread by TagDatabase.publish()"""
+        if self.subscriptions:
+            if (self.routed_subscriptions is not self.subscriptions
+                    or self.routed_slots != len(image.slots)):
+                self._route(image.slots)
+
+            deltas = {}
+            for area in AREAS:
+                routes = self.routes[area]
+                if not routes:
+                    continue
+                values = image.areas[area]
+                for index in changed_indices(previous.areas[area], values):
+                    route = routes.get(index)
+                    if route is not None:
+                        tag_name, subscribers = route
+                        value = bool(values[index]) if area == BOOL else values[index]
+                        for subscription in subscribers:
+                            changes = deltas.get(subscription)
+                            if changes is None:
+                                changes = deltas[subscription] = {}
+                            changes[tag_name] = value
+            for subscription, changes in deltas.items():
+                subscription._put(image.cycle, changes)
+
+        if self.joining:
+            with self.lock:
+                joining, self.joining = self.joining, []
+                self.subscriptions = self.subscriptions + joining
+            for subscription in joining:
+                subscription.prime(image)
+
+
+def subscribe(database: TagDatabase, tags: Iterable[str] = None, prefixes: Iterable[str] = None,
+              maxlen: int = 16, policy: str = Subscription.COALESCE) -> Subscription:
+    """
+    Subscribe to tags and/or prefixes (everything if neither is given).
+    Call unsubscribe() when done.
+    """
+    subscription = Subscription(tags, prefixes, maxlen, policy)
+    with database.lock:
+        if database.subscriptions is None:
+            database.subscriptions = SubscriptionHub()
+    database.subscriptions.add(subscription)
+    return subscription
+
+
+def unsubscribe(database: TagDatabase, subscription: Subscription) -> None:
+    if database.subscriptions is not None:
+        database.subscriptions.remove(subscription)
+    subscription.close()
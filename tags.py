@@ -2,56 +2,405 @@
 Tag Management System
 Manages all variables (tags) used in the ladder logic program.
 Similar to PLC tag database.
+
+Tags are assigned an integer slot in a typed storage area when they are
+first created (normally at program load). BOOL tags live in a byte array,
+DINT and REAL tags in typed arrays. The name -> slot map is only needed at
+the edges (I/O config, HMI, debugging); compiled scans address the storage
+areas directly by index.
+
+A tag array (declared with a length) is a run of consecutive slots in
+one area named NAME[0], NAME[1], ..., so block instructions (COP, FLL)
+work on a range of elements as one slice.
+
+The storage areas are the working image owned by the scan thread. At the
+end of every scan the runtime publishes a read-only copy (TagImage) that
+other threads read without locking, and writes from other threads are
+queued with post() and applied in one batch at the start of the next scan.
 """
 
-from typing import Any, Dict
+import re
+from array import array
+from typing import Any, Dict, Iterable, List, Tuple
 from threading import Lock
 
 
+# Tag data types (storage areas)
+BOOL = 'BOOL'
+DINT = 'DINT'
+REAL = 'REAL'
+
+# Storage areas in the order compiled scans receive them
+AREAS = (BOOL, DINT, REAL)
+
+# Members of structured tags (timers, counters) in storage order
+TIMER_MEMBERS = (('EN', BOOL), ('TT', BOOL), ('DN', BOOL), ('ACC', DINT), ('PRE', DINT))
+COUNTER_MEMBERS = (('CU', BOOL), ('CD', BOOL), ('DN', BOOL), ('ACC', DINT), ('PRE', DINT))
+
+# Array element tag name: NAME[index]
+_ELEMENT = re.compile(r'^(.+)\[(\d+)\]$')
+
+
+def infer_type(value: Any) -> str:
+    """Return the tag data type for a Python value"""
+    if isinstance(value, bool):
+        return BOOL
+    if isinstance(value, int):
+        return DINT
+    if isinstance(value, float):
+        return REAL
+    raise TypeError(f"Unsupported tag value type: {type(value).__name__}")
+
+
+def element(name: str, index: int) -> str:
+    """Tag name of an array element (RECIPE[3])"""
+    return f"{name}[{index}]"
+
+
+def split_element(tag_name: str) -> Tuple[str, int]:
+    """(array name, index) of an element (RECIPE[3]); (tag_name, 0) for an array name"""
+    match = _ELEMENT.match(tag_name)
+    return (match.group(1), int(match.group(2))) if match else (tag_name, 0)
+
+
+def elements(tag_name: str, length: int) -> List[str]:
+    """
+    Names of `length` consecutive array elements starting at `tag_name`,
+    an element (RECIPE[3]) or an array name (from its first element)
+    """
+    name, first = split_element(tag_name)
+    return [element(name, first + k) for k in range(length)]
+
+
+def changed_indices(old, new, chunk: int = 512) -> List[int]:
+    """
+    Indices where two storage areas differ (slots beyond the end of
+    `old` count as changed). The areas are compared as raw bytes: equal
+    chunks are skipped with one memcmp, and in a changed chunk the XOR
+    of the two chunks (as one integer) leads straight to the changed
+    slots, so the cost is proportional to the number of changes.
+    """
+    common = min(len(old), len(new))
+    changed = []
+    width = getattr(new, 'itemsize', 1)
+    size = common * width
+    before, after = bytes(old)[:size], bytes(new)[:size]
+    if before != after:
+        bits = 8 * width
+        step = chunk - chunk % width
+        for start in range(0, size, step):
+            a, b = before[start:start + step], after[start:start + step]
+            if a == b:
+                continue
+            diff = int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')
+            index = start // width
+            while diff:
+                skip = ((diff & -diff).bit_length() - 1) // bits
+                index += skip
+                changed.append(index)
+                diff >>= (skip + 1) * bits
+                index += 1
+    changed.extend(range(common, len(new)))
+    return changed
+
+
+class TagImage:
+    """
+    Read-only copy of the tag storage at the end of a scan.
+    Published by TagDatabase.publish(); safe to read from any thread.
+    """
+
+    __slots__ = ('slots', 'areas', 'cycle')
+
+    def __init__(self, slots: Dict[str, Tuple[str, int]], areas: Dict[str, Any], cycle: int):
+        self.slots = slots
+        self.areas = areas
+        self.cycle = cycle
+
+    def get(self, tag_name: str, default: Any = False) -> Any:
+        """Get a tag value as of the end of the published scan"""
+        slot = self.slots.get(tag_name)
+        if slot is None:
+            return default
+        data_type, index = slot
+        value = self.areas[data_type][index]
+        return bool(value) if data_type == BOOL else value
+
+    def get_all(self) -> Dict[str, Any]:
+        """All tag values as a dict"""
+        return {tag_name: self.get(tag_name) for tag_name in self.slots}
+
+
 class TagDatabase:
     """
     Centralized tag storage similar to PLC tag database.
-    Thread-safe for scan cycle operations.
+    get/set work on the scan's working image; other threads read
+    snapshot() and write through post().
     """
-    
+
     def __init__(self):
-        self.tags: Dict[str, Any] = {}
+        self.bits = bytearray()     # BOOL tags (0/1 per byte)
+        self.ints = array('q')      # DINT tags
+        self.reals = array('d')     # REAL tags
+        self.areas = {BOOL: self.bits, DINT: self.ints, REAL: self.reals}
+
+        # Tag name -> (data type, index into that type's area)
+        self.slots: Dict[str, Tuple[str, int]] = {}
         self.lock = Lock()
-        
+
+        # (array element, length) -> first slot of a checked block (see block())
+        self.blocks: Dict[Tuple[str, int], Tuple[str, int]] = {}
+
+        # Writes queued by other threads, applied at the start of a scan
+        self.pending: List[Tuple[str, Any]] = []
+        self.image: TagImage = None
+        self._published_slots: Dict[str, Tuple[str, int]] = {}
+
+        # SubscriptionHub, created by the first subscriptions.subscribe()
+        self.subscriptions = None
+
+        # Timer time base: whole ms elapsed since the previous scan
+        self.delta_ms = 0
+
         # Initialize system tags
-        self.tags['_SYSTEM.SCAN_TIME'] = 0.0  # Scan cycle time in ms
-        self.tags['_SYSTEM.RUNNING'] = False
-        self.tags['_SYSTEM.ERROR'] = False
-        self.tags['_SYSTEM.CYCLE_COUNT'] = 0
-    
-    def set(self, tag_name: str, value: Any) -> None:
-        """Set a tag value (thread-safe)"""
+        self.create('_SYSTEM.SCAN_TIME', 0.0)  # Scan cycle time in ms
+        self.create('_SYSTEM.RUNNING', False)
+        self.create('_SYSTEM.ERROR', False)
+        self.create('_SYSTEM.CYCLE_COUNT', 0)
+        self.create('_SYSTEM.JITTER', 0.0)      # Last scan period jitter in ms
+        self.create('_SYSTEM.MAX_JITTER', 0.0)  # Worst period jitter in ms
+        self.create('_SYSTEM.OVERRUNS', 0)      # Scans that missed their deadline
+        self.publish()
+
+    def allocate(self, tag_name: str, data_type: str, initial_value: Any = 0) -> Tuple[str, int]:
+        """
+        Assign a slot to a tag (no-op if it already has one).
+        Returns the tag's (data type, index).
+        """
+        with self.lock:
+            slot = self.slots.get(tag_name)
+            if slot is None:
+                area = self.areas[data_type]
+                area.append(_COERCE[data_type](initial_value))
+                slot = (data_type, len(area) - 1)
+                self.slots[tag_name] = slot
+            return slot
+
+    def allocate_block(self, names: List[str], members: Tuple[Tuple[str, str], ...],
+                       initial: Dict[str, Any] = None) -> None:
+        """
+        Allocate structured tags (timers, counters) as one struct-of-arrays
+        block: each member gets a contiguous run of slots with one entry
+        per structure in `names` order (all EN bits, then all TT bits,
+        ..., all ACCs, all PREs), so a block of structures is updated in
+        one pass per member. Members are ordinary tags (`T.DN`) to
+        everything else. Members that already have a slot are kept.
+        `initial` maps member tag names to initial values (presets).
+        """
+        initial = initial or {}
+        names = list(dict.fromkeys(names))
+        with self.lock:
+            for member, data_type in members:
+                area = self.areas[data_type]
+                for name in names:
+                    tag_name = f"{name}.{member}"
+                    if tag_name not in self.slots:
+                        area.append(_COERCE[data_type](initial.get(tag_name, 0)))
+                        self.slots[tag_name] = (data_type, len(area) - 1)
+
+    def allocate_array(self, name: str, data_type: str, length: int,
+                       initial: Any = 0) -> Tuple[str, int]:
+        """
+        Allocate a tag array: elements NAME[0] .. NAME[length - 1] in
+        consecutive slots of one area. `initial` is a value for every
+        element or a list of values. An existing array is kept; it can
+        only grow while its last element ends the area.
+        Returns the (data type, index) of element 0.
+        """
+        if isinstance(initial, (list, tuple)):
+            values = list(initial[:length]) + [0] * (length - len(initial))
+        else:
+            values = [initial] * length
+        names = [element(name, k) for k in range(length)]
         with self.lock:
-            self.tags[tag_name] = value
-    
+            area = self.areas[data_type]
+            existing = [self.slots.get(tag_name) for tag_name in names]
+            count = existing.index(None) if None in existing else length
+            if count:
+                start = existing[0][1]
+                if any(slot != (data_type, start + k) for k, slot in enumerate(existing[:count])) or \
+                        any(existing[count:]) or (count < length and start + count != len(area)):
+                    raise ValueError(f"Tag array {name}[{length}] {data_type} does not match "
+                                     f"the existing layout of {name}")
+            for k in range(count, length):
+                area.append(_COERCE[data_type](values[k]))
+                self.slots[names[k]] = (data_type, len(area) - 1)
+            return self.slots[names[0]]
+
+    def declare(self, tag_name: str, declaration: Any) -> None:
+        """
+        Allocate a tag from its program declaration: a data type
+        ("REAL") or {"type": "REAL", "value": 1.5, "length": 10}, where a
+        length makes it an array
+        """
+        if isinstance(declaration, str):
+            declaration = {'type': declaration}
+        data_type = declaration.get('type', DINT)
+        if data_type not in AREAS:
+            raise ValueError(f"Tag {tag_name}: unknown data type {data_type}")
+        length = declaration.get('length')
+        if length is None:
+            self.allocate(tag_name, data_type, declaration.get('value', 0))
+        else:
+            self.allocate_array(tag_name, data_type, int(length), declaration.get('value', 0))
+
+    def block(self, tag_name: str, length: int) -> Tuple[str, int]:
+        """
+        (data type, index) of the first of `length` consecutive array
+        elements (see elements()); ValueError unless they exist and
+        occupy consecutive slots of one area. Slots never move, so a
+        block is only checked the first time.
+        """
+        first = self.blocks.get((tag_name, length))
+        if first is not None:
+            return first
+        slots = [self.slots.get(name) for name in elements(tag_name, length)]
+        first = slots[0]
+        if first is None or any(slot != (first[0], first[1] + k) for k, slot in enumerate(slots)):
+            raise ValueError(f"{tag_name} is not the start of {length} consecutive array elements")
+        self.blocks[(tag_name, length)] = first
+        return first
+
+    def slot(self, tag_name: str) -> Tuple[str, int]:
+        """Return (data type, index) for a tag, or None if it does not exist"""
+        return self.slots.get(tag_name)
+
+    def set(self, tag_name: str, value: Any) -> None:
+        """Set a tag value (creates the tag on first write)"""
+        slot = self.slots.get(tag_name)
+        if slot is None:
+            slot = self.allocate(tag_name, infer_type(value))
+        data_type, index = slot
+        self.areas[data_type][index] = _COERCE[data_type](value)
+
+    def get_block(self, tag_name: str, length: int) -> List[Any]:
+        """Values of `length` consecutive array elements (see block())"""
+        data_type, index = self.block(tag_name, length)
+        values = self.areas[data_type][index:index + length]
+        return [bool(value) for value in values] if data_type == BOOL else values.tolist()
+
+    def set_block(self, tag_name: str, values: List[Any]) -> None:
+        """
+        Set consecutive array elements from tag_name on; all values are
+        converted before any is stored, so a failed conversion leaves
+        the block unchanged
+        """
+        data_type, index = self.block(tag_name, len(values))
+        area = self.areas[data_type]
+        converted = [_COERCE[data_type](value) for value in values]
+        area[index:index + len(values)] = (bytes(converted) if data_type == BOOL else
+                                           array('q' if data_type == DINT else 'd', converted))
+
     def get(self, tag_name: str, default: Any = False) -> Any:
-        """Get a tag value (thread-safe)"""
+        """Get a tag value"""
+        slot = self.slots.get(tag_name)
+        if slot is None:
+            return default
+        data_type, index = slot
+        value = self.areas[data_type][index]
+        return bool(value) if data_type == BOOL else value
+
+    def resolve(self, tag_names: List[str], data_type: str = BOOL) -> List[Tuple[str, int]]:
+        """Resolve (allocating if needed) a list of tags to their slots"""
+        return [self.slots.get(tag_name) or self.allocate(tag_name, data_type)
+                for tag_name in tag_names]
+
+    def read_slots(self, slots: List[Tuple[str, int]]) -> List[Any]:
+        """Read a block of tags by slot (e.g. to build an output image)"""
+        areas = self.areas
+        return [areas[data_type][index] for data_type, index in slots]
+
+    def write_slots(self, slots: List[Tuple[str, int]], values: List[Any]) -> None:
+        """Write a block of tags by slot (e.g. to load an input image)"""
+        areas = self.areas
+        for (data_type, index), value in zip(slots, values):
+            areas[data_type][index] = _COERCE[data_type](value)
+
+    def post(self, tag_name: str, value: Any) -> None:
+        """Queue a write from another thread; applied at the next scan start"""
+        with self.lock:
+            self.pending.append((tag_name, value))
+
+    def apply_pending(self) -> None:
+        """Apply queued writes to the working image (one lock per scan)"""
+        if not self.pending:
+            return
         with self.lock:
-            return self.tags.get(tag_name, default)
-    
+            pending, self.pending = self.pending, []
+        for tag_name, value in pending:
+            self.set(tag_name, value)
+
+    def publish(self) -> TagImage:
+        """
+        Publish a copy of the working image for readers on other threads.
+        Replacing self.image is a single reference assignment, so readers
+        always see one complete scan.
+        """
+        if len(self._published_slots) != len(self.slots):
+            with self.lock:
+                self._published_slots = dict(self.slots)
+
+        areas = {data_type: area[:] for data_type, area in self.areas.items()}
+        cycle = self.ints[self.slots['_SYSTEM.CYCLE_COUNT'][1]]
+        previous, self.image = self.image, TagImage(self._published_slots, areas, cycle)
+        if self.subscriptions is not None:
+            self.subscriptions.dispatch(previous, self.image)
+        return self.image
+
+    def snapshot(self) -> TagImage:
+        """Lock-free, consistent view of the last completed scan"""
+        return self.image
+
+    def copy_layout(self) -> 'TagDatabase':
+        """
+        New database with the same slots as the last published scan (and
+        its values), e.g. to compile a program for this database's slot
+        layout on another thread without touching the working image
+        """
+        image = self.image
+        tags = TagDatabase()
+        for tag_name, (data_type, index) in sorted(image.slots.items(), key=lambda item: item[1][1]):
+            tags.allocate(tag_name, data_type, image.areas[data_type][index])
+        return tags
+
     def exists(self, tag_name: str) -> bool:
         """Check if tag exists"""
-        with self.lock:
-            return tag_name in self.tags
-    
+        return tag_name in self.slots
+
     def create(self, tag_name: str, initial_value: Any = False) -> None:
         """Create a new tag if it doesn't exist"""
-        with self.lock:
-            if tag_name not in self.tags:
-                self.tags[tag_name] = initial_value
-    
+        if tag_name not in self.slots:
+            self.allocate(tag_name, infer_type(initial_value), initial_value)
+
     def get_all(self) -> Dict[str, Any]:
-        """Get all tags (returns a copy)"""
-        with self.lock:
-            return self.tags.copy()
-    
-    def clear_user_tags(self) -> None:
-        """Clear all tags except system tags"""
+        """Get all tags as of the last published scan (returns a copy)"""
+        return self.image.get_all()
+
+    def clear_user_tags(self, keep: Iterable[str] = ()) -> None:
+        """
+        Reset all tags except system tags and those in `keep` (e.g. the
+        retentive tags, for a warm restart) to zero/FALSE.
+        Slots are kept so compiled programs remain valid.
+        """
+        keep = set(keep)
         with self.lock:
-            system_tags = {k: v for k, v in self.tags.items() if k.startswith('_SYSTEM')}
-            self.tags = system_tags
+            for tag_name, (data_type, index) in self.slots.items():
+                if not tag_name.startswith('_SYSTEM') and tag_name not in keep:
+                    self.areas[data_type][index] = 0
+
+
+_COERCE = {
+    BOOL: lambda value: 1 if value else 0,
+    DINT: int,
+    REAL: float,
+}
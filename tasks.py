@@ -0,0 +1,212 @@
+"""
+Task Model
+Multi-rate execution of a ladder program.
+
+A program can divide its rungs into tasks, each with its own period (or
+trigger), priority and timer time base, so fast logic (e.g. a 5 ms
+interlock) does not pay for slow logic (e.g. 1 s housekeeping) every
+cycle:
+
+    "tasks": [
+        {"name": "safety", "period_ms": 5, "priority": 1, "rungs": [0, 1]},
+        {"name": "housekeeping", "period_ms": 1000, "priority": 10, "rungs": [5, 6]},
+        {"name": "estop", "type": "event", "trigger": "ESTOP", "priority": 0, "rungs": [3]}
+    ]
+
+Rungs not assigned to a task run in an implicit periodic task named
+"main" at the program scan time. Tasks are non-preemptive: each cycle
+the scheduler wakes at the earliest release time (or when an event task
+is triggered) and runs every due task in priority order (lower number
+first) between one input read and one output write.
+"""
+
+import re
+import time
+import logging
+import threading
+from typing import Dict, List
+
+from .scheduler import ScanScheduler, Timebase
+
+logger = logging.getLogger(__name__)
+
+
+class Task:
+    """A set of rungs executed together on a period or trigger"""
+
+    PERIODIC = 'periodic'
+    EVENT = 'event'
+    TYPES = (PERIODIC, EVENT)
+
+    def __init__(self, name: str, rungs: List, task_type: str = PERIODIC,
+                 period_ms: float = None, priority: int = 10, trigger: str = None):
+        if task_type not in self.TYPES:
+            raise ValueError(f"Unknown task type: {task_type}")
+        if task_type == self.PERIODIC and (period_ms is None or period_ms <= 0):
+            raise ValueError(f"Task {name}: periodic tasks need a positive period_ms")
+
+        self.name = name
+        self.rungs = rungs
+        self.task_type = task_type
+        self.period_ms = period_ms
+        self.priority = priority
+        self.trigger = trigger
+
+        # Timers in this task accumulate the time between its own runs
+        self.timebase = Timebase()
+        self.scan_function = None
+        self.incremental = None
+
+        self.scheduler = None
+        self.pending = False
+        self.trigger_state = False
+        self.runs = 0
+
+    @property
+    def periodic(self) -> bool:
+        return self.task_type == self.PERIODIC
+
+    @property
+    def function_name(self) -> str:
+        """Identifier used for the task's compiled scan function"""
+        return 'task_' + re.sub(r'\W', '_', self.name)
+
+    @classmethod
+    def from_dict(cls, task_data: Dict, program_rungs: List) -> 'Task':
+        """Create a task from its program JSON entry (rungs keep program order)"""
+        name = task_data['name']
+        rung_ids = set(task_data.get('rungs', []))
+        unknown = rung_ids - {rung.rung_id for rung in program_rungs}
+        if unknown:
+            raise ValueError(f"Task {name}: unknown rung_id(s) {sorted(unknown)}")
+        rungs = [rung for rung in program_rungs if rung.rung_id in rung_ids]
+
+        return cls(name, rungs,
+                   task_type=task_data.get('type', cls.PERIODIC),
+                   period_ms=task_data.get('period_ms'),
+                   priority=task_data.get('priority', 10),
+                   trigger=task_data.get('trigger'))
+
+    def __repr__(self):
+        rate = f"{self.period_ms}ms" if self.periodic else f"on {self.trigger or 'trigger()'}"
+        return f"Task({self.name}, {rate}, priority={self.priority}, {len(self.rungs)} rungs)"
+
+
+class TaskScheduler:
+    """
+    Releases periodic tasks on their own absolute deadlines (one
+    ScanScheduler per task, sharing the overrun policy) and event tasks
+    when triggered.
+
+    Event tasks run on the rising edge of their trigger tag, checked
+    every cycle after inputs are read (and at least every poll_ms), or
+    immediately when trigger() is called from any thread.
+
+    With a `sleep` function (e.g. VirtualClock.sleep), wait() sleeps
+    with it instead of blocking on the wake event.
+    """
+
+    def __init__(self, tasks: List[Task], overrun_policy: str = ScanScheduler.SKIP,
+                 poll_ms: float = 100, clock=time.monotonic_ns, wake: threading.Event = None,
+                 sleep=None):
+        self.tasks = sorted(tasks, key=lambda task: task.priority)
+        self.by_name = {task.name: task for task in self.tasks}
+        self.poll_ns = int(poll_ms * 1_000_000)
+        self.clock = clock
+        self.sleep = sleep
+        self.wake = wake or threading.Event()
+        self.polled = any(task.trigger for task in self.tasks)
+
+        for task in self.tasks:
+            # Task timers run on the scheduler's clock
+            task.timebase.clock = clock
+            if task.periodic:
+                task.scheduler = ScanScheduler(task.period_ms, overrun_policy, clock)
+
+    def start(self) -> None:
+        """Anchor every periodic task's period grid at the same instant"""
+        now = self.clock()
+        for task in self.tasks:
+            task.timebase.reset()
+            if task.scheduler:
+                task.scheduler.next_release_ns = now
+                task.scheduler.last_start_ns = None
+
+    def trigger(self, name: str) -> None:
+        """Request a run of an event task (thread-safe)"""
+        self.by_name[name].pending = True
+        self.wake.set()
+
+    def check_triggers(self, tags) -> None:
+        """Mark event tasks whose trigger tag rose since the last check"""
+        for task in self.tasks:
+            if task.trigger:
+                state = bool(tags.get(task.trigger, False))
+                if state and not task.trigger_state:
+                    task.pending = True
+                task.trigger_state = state
+
+    def next_release_ns(self) -> int:
+        releases = [task.scheduler.next_release_ns for task in self.tasks if task.scheduler]
+        return min(releases) if releases else None
+
+    def next_wake_ns(self, now: int) -> int:
+        """
+        Earliest task release, or the next trigger poll if sooner
+        (None: nothing is due until trigger() is called)
+        """
+        release = self.next_release_ns()
+        if self.polled and (release is None or release - now > self.poll_ns):
+            return now + self.poll_ns
+        return release
+
+    def wait(self) -> int:
+        """
+        Sleep until the earliest task release or an event trigger.
+        Returns the wake-up time (ns).
+        """
+        now = self.clock()
+        wake = self.next_wake_ns(now)
+        remaining = None if wake is None else wake - now
+
+        if self.sleep is not None:
+            if remaining is not None and remaining > 0:
+                self.sleep(remaining / 1_000_000_000)
+        elif remaining is None:
+            self.wake.wait()
+        elif remaining > 0:
+            self.wake.wait(remaining / 1_000_000_000)
+        self.wake.clear()
+        return self.clock()
+
+    def due(self, now: int) -> List[Task]:
+        """Tasks to run this cycle, highest priority first"""
+        due = []
+        for task in self.tasks:
+            if task.scheduler:
+                if task.scheduler.next_release_ns <= now:
+                    task.scheduler.begin(now)
+                    due.append(task)
+            elif task.pending:
+                task.pending = False
+                due.append(task)
+        return due
+
+    def finish(self, task: Task) -> bool:
+        """Advance a task that just ran; returns True if it overran"""
+        task.runs += 1
+        if task.scheduler:
+            return task.scheduler.finish()
+        return False
+
+    @property
+    def overruns(self) -> int:
+        return sum(task.scheduler.overruns for task in self.tasks if task.scheduler)
+
+    def publish(self, tags) -> None:
+        """Write worst-case jitter and total overruns to _SYSTEM tags"""
+        schedulers = [task.scheduler for task in self.tasks if task.scheduler]
+        if schedulers:
+            tags.set('_SYSTEM.JITTER', round(max(s.jitter_ns for s in schedulers) / 1e6, 3))
+            tags.set('_SYSTEM.MAX_JITTER', round(max(s.max_jitter_ns for s in schedulers) / 1e6, 3))
+        tags.set('_SYSTEM.OVERRUNS', self.overruns)
@@ -0,0 +1,106 @@
+"""
+Compiled scan tests: the generated scan function must leave the same tag
+image as the interpreter after every scan, including where the compiler
+reuses a condition evaluated by an earlier rung.
+"""
+
+import random
+
+import pytest
+
+from .conftest import generate_program, input_values, run_modes
+from .runtime import LadderProgram
+
+MODES = (LadderProgram.INTERPRETED, LadderProgram.COMPILED)
+
+
+def xic(tag):
+    return {"type": "XIC", "tag": tag}
+
+
+def ote(tag):
+    return {"type": "OTE", "tag": tag}
+
+
+def grt(a, b):
+    return {"type": "GRT", "source_a": a, "source_b": b}
+
+
+def rungs(*bodies):
+    return [{"rung_id": k, "instructions": body} for k, body in enumerate(bodies)]
+
+
+# Each program evaluates a compound condition, writes one of its tags in a
+# later rung, then tests the same condition again: the second test must see
+# the new value, not the one computed by the first rung.
+SHARED_CONDITIONS = {
+    'coil': rungs(
+        [xic('X0'), xic('B0'), ote('Y0')],
+        [xic('X1'), ote('B0')],
+        [xic('X0'), xic('B0'), ote('Y1')]),
+    'same_rung': rungs(
+        [xic('X0'), xic('B0'), ote('Y0'), xic('X1'), {"type": "OTU", "tag": "B0"}],
+        [xic('B0'), xic('X0'), ote('Y1')],
+        [xic('X2'), {"type": "OTL", "tag": "B0"}]),
+    'branch': rungs(
+        [{"type": "BRANCH", "legs": [[xic('X0')], [xic('B0'), xic('X1')]]}, ote('Y0')],
+        [xic('X2'), {"type": "OTL", "tag": "B0"}],
+        [xic('X3'), {"type": "OTU", "tag": "B0"}],
+        [{"type": "BRANCH", "legs": [[xic('X0')], [xic('X1'), xic('B0')]]}, ote('Y1')]),
+    'word': rungs(
+        [grt('D0', 5), xic('X0'), ote('Y0')],
+        [xic('X1'), {"type": "ADD", "source_a": "D0", "source_b": 4, "dest": "D0"}],
+        [xic('X2'), {"type": "MOV", "source": 0, "dest": "D0"}],
+        [xic('X0'), grt('D0', 5), ote('Y1')]),
+    'array': rungs(
+        [grt('A[2]', 0), grt('A[0]', 1), xic('X0'), ote('Y0')],
+        [xic('X1'), {"type": "FLL", "source": "D0", "dest": "A", "length": 4}],
+        [xic('X2'), {"type": "COP", "source": "E", "dest": "A", "length": 3}],
+        [xic('X0'), grt('A[0]', 1), grt('A[2]', 0), ote('Y1')]),
+    'timer': rungs(
+        [xic('X0'), xic('T0.DN'), ote('Y0')],
+        [xic('X1'), {"type": "TON", "tag": "T0", "preset": 30}],
+        [xic('T0.DN'), xic('X0'), ote('Y1')]),
+    'counter': rungs(
+        [xic('X0'), xic('C0.DN'), ote('Y0')],
+        [xic('X1'), {"type": "CTU", "tag": "C0", "preset": 2, "reset_tag": "X2"}],
+        [xic('C0.DN'), xic('X0'), ote('Y1')]),
+    'one_shot': rungs(
+        [xic('X0'), xic('P0'), ote('Y0')],
+        [xic('X1'), {"type": "OSR", "tag": "P0"}, ote('B0')],
+        [xic('X0'), xic('P0'), ote('Y1')]),
+}
+
+TAGS = {"D0": "DINT", "A": {"type": "DINT", "length": 4},
+        "E": {"type": "DINT", "length": 3, "value": [-1, 0, 2]}}
+
+
+def steps(scans):
+    rnd = random.Random(scans)
+    return [[(f"X{bit}", rnd.random() < 0.5) for bit in range(4)] + [("D0", rnd.randint(-2, 6))]
+            for _ in range(scans)]
+
+
+@pytest.mark.parametrize('name', sorted(SHARED_CONDITIONS))
+def test_condition_reused_across_rungs(name, program_file):
+    path = program_file({"tags": TAGS, "rungs": SHARED_CONDITIONS[name]})
+    images = run_modes(path, MODES, steps(200))
+    assert images[LadderProgram.COMPILED] == images[LadderProgram.INTERPRETED]
+
+
+def test_conditions_are_shared(program_file):
+    # Otherwise the tests above would not exercise the reuse
+    path = program_file({"rungs": rungs([xic('X0'), xic('X1'), ote('Y0')],
+                                        [xic('X1'), xic('X0'), ote('Y1')])})
+    program = LadderProgram(LadderProgram.COMPILED)
+    program.load_from_json(path, use_cache=False)
+    assert 'e0' in program.compiled_scan.source
+
+
+@pytest.mark.parametrize('seed', range(12))
+def test_generated_programs(seed, program_file):
+    path = program_file(generate_program(seed))
+    images = run_modes(path, MODES, input_values(seed, 150))
+    for scan, (expected, image) in enumerate(zip(images[LadderProgram.INTERPRETED],
+                                                 images[LadderProgram.COMPILED])):
+        assert image == expected, f"compiled differs from interpreted after scan {scan}"
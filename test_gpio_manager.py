@@ -0,0 +1,71 @@
+"""
+Edge capture tests on the simulated backend: pulses shorter than a scan
+are latched into the input image for one scan.
+"""
+
+import json
+
+import pytest
+
+from .gpio_backends import SimulatedBackend
+from .gpio_manager import GPIOManager, VirtualIOSimulator
+from .scheduler import VirtualClock
+from .tags import TagDatabase
+
+
+@pytest.fixture(params=['rising', 'both'])
+def io(request, tmp_path):
+    path = tmp_path / 'io_config.json'
+    path.write_text(json.dumps({"inputs": [
+        {"tag": "SENSOR", "pin": 5, "edge": request.param, "count_tag": "SENSOR_COUNT"},
+        {"tag": "PLAIN", "pin": 6}]}))
+    clock = VirtualClock()
+    manager = GPIOManager(str(path), backend=SimulatedBackend(), clock=clock)
+    return manager, VirtualIOSimulator(manager), TagDatabase(), clock
+
+
+def scan(manager, tags, clock):
+    clock.advance(10_000_000)
+    manager.read_inputs(tags)
+    return tags.get('SENSOR')
+
+
+def test_pulse_is_latched_for_one_scan(io):
+    manager, simulator, tags, clock = io
+    assert scan(manager, tags, clock) is False
+    simulator.pulse_input('SENSOR')
+    assert [scan(manager, tags, clock) for _ in range(3)] == [True, False, False]
+
+
+def test_back_to_back_pulses(io):
+    manager, simulator, tags, clock = io
+    scan(manager, tags, clock)
+    levels = []
+    for _ in range(3):
+        simulator.pulse_input('SENSOR')
+        levels.append(scan(manager, tags, clock))
+    levels.append(scan(manager, tags, clock))
+    # Each pulse is latched for the scan after it; with no scan between
+    # pulses the input stays TRUE, and the count tag has every edge
+    assert levels == [True, True, True, False]
+    assert tags.get('SENSOR_COUNT') == (3 if manager.inputs[0].edge == 'rising' else 6)
+
+
+def test_pulses_every_other_scan(io):
+    manager, simulator, tags, clock = io
+    scan(manager, tags, clock)
+    levels = []
+    for _ in range(3):
+        simulator.pulse_input('SENSOR')
+        levels.append(scan(manager, tags, clock))
+        levels.append(scan(manager, tags, clock))
+    assert levels == [True, False] * 3
+
+
+def test_pulse_on_a_held_input(io):
+    manager, simulator, tags, clock = io
+    simulator.set_input('SENSOR', True)
+    assert scan(manager, tags, clock) is True
+    # Released and pressed again between two scans
+    simulator.pulse_input('SENSOR')
+    assert [scan(manager, tags, clock) for _ in range(2)] == [False, True]
@@ -0,0 +1,45 @@
+"""
+Incremental scan tests: interpreted, compiled and incremental mode run the
+same program on the same inputs and must leave identical tag images after
+every scan.
+"""
+
+import os
+import random
+
+import pytest
+
+from .conftest import EXAMPLES, generate_program, input_values, run_modes
+from .runtime import LadderProgram
+
+MODES = (LadderProgram.INTERPRETED, LadderProgram.COMPILED, LadderProgram.INCREMENTAL)
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Push buttons of start_stop_motor; blink and traffic_light have no inputs
+BUTTONS = ('START_BTN', 'STOP_BTN', 'ESTOP')
+
+
+def assert_same_images(images):
+    reference = images[MODES[0]]
+    for mode in MODES[1:]:
+        for scan, (expected, image) in enumerate(zip(reference, images[mode])):
+            assert image == expected, f"{mode} differs from {MODES[0]} after scan {scan}"
+
+
+@pytest.mark.parametrize('example', EXAMPLES)
+def test_examples(example):
+    rnd = random.Random(example)
+    steps = [[(name, rnd.random() < 0.2) for name in BUTTONS] for _ in range(600)]
+    assert_same_images(run_modes(os.path.join(HERE, example), MODES, steps))
+
+
+@pytest.mark.parametrize('seed', range(12))
+def test_generated_programs(seed, program_file):
+    path = program_file(generate_program(seed))
+    assert_same_images(run_modes(path, MODES, input_values(seed, 150)))
+
+
+def test_idle_scans_keep_timers_running(program_file):
+    # No input changes at all: incremental mode must still run timed rungs
+    path = program_file(generate_program(100))
+    steps = input_values(100, 5) + [[] for _ in range(60)]
+    assert_same_images(run_modes(path, MODES, steps))
@@ -0,0 +1,181 @@
+"""
+Modbus TCP server loopback tests: a server on an ephemeral port and a
+raw-socket client speaking MBAP frames.
+"""
+
+import socket
+import struct
+
+import pytest
+
+from .modbus_server import (ModbusServer, RegisterMap, MBAP, ILLEGAL_FUNCTION,
+                            ILLEGAL_DATA_ADDRESS, ILLEGAL_DATA_VALUE)
+from .tags import TagDatabase, BOOL, DINT, REAL
+
+REGISTER_MAP = {
+    "coils": [{"address": 0, "tag": "MOTOR"}, {"address": 1, "tag": "PUMP"},
+              {"address": 3, "tag": "VALVE"}],
+    "discrete_inputs": [{"address": 0, "tag": "START_BTN"}, {"address": 1, "tag": "STOP_BTN"}],
+    "holding_registers": [{"address": 0, "tag": "SPEED"},
+                          {"address": 1, "tag": "PRESET", "type": "int32"},
+                          {"address": 3, "tag": "SETPOINT", "type": "float32"},
+                          {"address": 5, "tag": "FLAGS", "type": "uint16"}],
+    "input_registers": [{"address": 0, "tag": "ACC", "type": "int32"},
+                        {"address": 2, "tag": "TEMP", "type": "float32"},
+                        {"address": 5, "tag": "COUNT"}],
+}
+
+
+class Client:
+    """Minimal Modbus TCP client"""
+
+    def __init__(self, port: int):
+        self.socket = socket.create_connection(('127.0.0.1', port), timeout=5.0)
+        self.transaction = 0
+
+    def request(self, pdu: bytes) -> bytes:
+        self.transaction += 1
+        self.socket.sendall(MBAP.pack(self.transaction, 0, len(pdu) + 1, 1) + pdu)
+        header = self._receive(MBAP.size)
+        transaction, protocol, length, unit = MBAP.unpack(header)
+        assert (transaction, protocol, unit) == (self.transaction, 0, 1)
+        return self._receive(length - 1)
+
+    def read(self, function: int, address: int, count: int) -> bytes:
+        return self.request(struct.pack('>BHH', function, address, count))
+
+    def read_registers(self, function: int, address: int, count: int):
+        response = self.read(function, address, count)
+        assert response[:2] == bytes([function, 2 * count])
+        return struct.unpack(f'>{count}H', response[2:])
+
+    def write_registers(self, address: int, words) -> bytes:
+        return self.request(struct.pack(f'>BHHB{len(words)}H', 16, address, len(words),
+                                        2 * len(words), *words))
+
+    def _receive(self, size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = self.socket.recv(size - len(data))
+            assert chunk, "connection closed"
+            data += chunk
+        return data
+
+    def close(self):
+        self.socket.close()
+
+
+def words(fmt: str, value):
+    data = struct.pack(fmt, value)
+    return struct.unpack(f'>{len(data) // 2}H', data)
+
+
+@pytest.fixture
+def tags():
+    tags = TagDatabase()
+    for tag_name, value in (('MOTOR', True), ('PUMP', False), ('VALVE', True),
+                            ('START_BTN', False), ('STOP_BTN', True)):
+        tags.allocate(tag_name, BOOL, value)
+    for tag_name, value in (('SPEED', -3), ('PRESET', -70000), ('FLAGS', 0xBEEF),
+                            ('ACC', 123456), ('COUNT', 42)):
+        tags.allocate(tag_name, DINT, value)
+    tags.allocate('SETPOINT', REAL, 12.5)
+    tags.allocate('TEMP', REAL, -40.25)
+    tags.publish()
+    return tags
+
+
+@pytest.fixture
+def client(tags):
+    server = ModbusServer(tags, RegisterMap(REGISTER_MAP, tags), host='127.0.0.1', port=0)
+    server.start()
+    client = Client(server.port)
+    yield client
+    client.close()
+    server.stop()
+
+
+def test_read_bits(client):
+    assert client.read(1, 0, 4) == bytes([1, 1, 0b1001])
+    assert client.read(2, 0, 2) == bytes([2, 1, 0b10])
+
+
+def test_reads_serve_the_published_image(tags, client):
+    tags.set('MOTOR', False)
+    tags.set('SPEED', 99)
+    assert client.read(1, 0, 1) == bytes([1, 1, 1])
+    assert client.read_registers(3, 0, 1) == words('>h', -3)
+
+    tags.publish()
+    assert client.read(1, 0, 1) == bytes([1, 1, 0])
+    assert client.read_registers(3, 0, 1) == (99,)
+
+
+def test_read_registers(client):
+    assert client.read_registers(3, 0, 6) == (
+        words('>h', -3) + words('>i', -70000) + words('>f', 12.5) + (0xBEEF,))
+    # Unmapped addresses read as zero
+    assert client.read_registers(4, 0, 6) == (
+        words('>i', 123456) + words('>f', -40.25) + (0,) + (42,))
+
+
+def test_partial_register_reads(client):
+    preset = words('>i', -70000)
+    setpoint = words('>f', 12.5)
+    assert client.read_registers(3, 2, 1) == preset[1:]
+    assert client.read_registers(3, 2, 2) == preset[1:] + setpoint[:1]
+    assert client.read_registers(3, 1, 1) == preset[:1]
+
+
+def test_write_single_coil_and_register(tags, client):
+    assert client.request(struct.pack('>BHH', 5, 0, 0x0000)) == struct.pack('>BHH', 5, 0, 0x0000)
+    assert client.request(struct.pack('>BHH', 6, 0, 0xFFFE)) == struct.pack('>BHH', 6, 0, 0xFFFE)
+    assert client.request(struct.pack('>BHH', 6, 5, 0xFFFE)) == struct.pack('>BHH', 6, 5, 0xFFFE)
+    # Queued until the next scan start
+    assert (tags.get('MOTOR'), tags.get('SPEED'), tags.get('FLAGS')) == (True, -3, 0xBEEF)
+
+    tags.apply_pending()
+    assert (tags.get('MOTOR'), tags.get('SPEED'), tags.get('FLAGS')) == (False, -2, 0xFFFE)
+
+
+def test_write_multiple_coils(tags, client):
+    # MOTOR, PUMP (addresses 0, 1)
+    assert client.request(struct.pack('>BHHBB', 15, 0, 2, 1, 0b10)) == struct.pack('>BHH', 15, 0, 2)
+    tags.apply_pending()
+    assert (tags.get('MOTOR'), tags.get('PUMP'), tags.get('VALVE')) == (False, True, True)
+
+
+def test_write_multiple_registers(tags, client):
+    values = words('>h', 7) + words('>i', -123456789) + words('>f', -0.5)
+    assert client.write_registers(0, values) == struct.pack('>BHH', 16, 0, 5)
+    assert tags.get('PRESET') == -70000
+
+    tags.apply_pending()
+    assert (tags.get('SPEED'), tags.get('PRESET'), tags.get('SETPOINT')) == (7, -123456789, -0.5)
+
+
+@pytest.mark.parametrize('pdu, function, code', [
+    (struct.pack('>BHH', 7, 0, 1), 7, ILLEGAL_FUNCTION),
+    (struct.pack('>BHH', 1, 3, 2), 1, ILLEGAL_DATA_ADDRESS),            # past the last coil
+    (struct.pack('>BHH', 3, 0, 0), 3, ILLEGAL_DATA_VALUE),              # count 0
+    (struct.pack('>BHH', 4, 0, 126), 4, ILLEGAL_DATA_VALUE),            # count over 125
+    (struct.pack('>BHH', 4, 4, 3), 4, ILLEGAL_DATA_ADDRESS),
+    (struct.pack('>BHH', 5, 0, 0x1234), 5, ILLEGAL_DATA_VALUE),         # not ON/OFF
+    (struct.pack('>BHH', 5, 2, 0xFF00), 5, ILLEGAL_DATA_ADDRESS),       # unmapped coil
+    (struct.pack('>BHH', 6, 1, 1), 6, ILLEGAL_DATA_ADDRESS),            # half an int32
+    (struct.pack('>BHH', 6, 2, 1), 6, ILLEGAL_DATA_ADDRESS),            # low word of an int32
+    (struct.pack('>BHHBB', 15, 0, 9, 1, 0), 15, ILLEGAL_DATA_VALUE),    # byte count mismatch
+    (struct.pack('>BHHB2H', 16, 2, 2, 4, 0, 0), 16, ILLEGAL_DATA_ADDRESS),  # starts mid-value
+    (struct.pack('>BHHB2H', 16, 0, 2, 4, 0, 0), 16, ILLEGAL_DATA_ADDRESS),  # ends mid-value
+    (struct.pack('>BHHB2H', 16, 0, 2, 3, 0, 0), 16, ILLEGAL_DATA_VALUE),    # byte count mismatch
+    (struct.pack('>BH', 3, 0), 3, ILLEGAL_DATA_VALUE),                  # truncated request
+])
+def test_exception_responses(tags, client, pdu, function, code):
+    assert client.request(pdu) == bytes([function | 0x80, code])
+    # Rejected writes change nothing
+    assert not tags.pending
+
+
+def test_connection_serves_requests_after_an_exception(client):
+    assert client.request(struct.pack('>BHH', 7, 0, 1)) == bytes([0x87, ILLEGAL_FUNCTION])
+    assert client.read(2, 0, 2) == bytes([2, 1, 0b10])
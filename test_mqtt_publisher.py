@@ -0,0 +1,136 @@
+"""
+MQTT publisher tests against the in-memory RecordingClient, driven with
+collect()/flush() on a fake clock (no thread, no broker).
+"""
+
+import json
+
+from .mqtt_publisher import MQTTPublisher, RecordingClient, decode_binary
+from .tags import TagDatabase
+
+MS = 1_000_000
+
+
+def publisher(topics, **config):
+    client = RecordingClient()
+    config = dict(config, topics=topics)
+    return MQTTPublisher(TagDatabase(), config, client, clock=lambda: 0), client
+
+
+def values(client, topic=None):
+    """Values of each JSON message, in publish order"""
+    return [json.loads(payload)['values'] for message_topic, payload, _, _ in client.messages
+            if topic is None or message_topic == topic]
+
+
+def test_deadband():
+    mqtt, client = publisher([{"topic": "temps", "tags": ["TEMP", "RUN"], "deadband": 0.5}])
+
+    mqtt.collect({'TEMP': 20.0, 'RUN': True})
+    assert mqtt.flush(now_ns=0) == 1
+    mqtt.collect({'TEMP': 20.4})
+    assert mqtt.flush(now_ns=1 * MS) == 0
+    mqtt.collect({'TEMP': 20.6})
+    assert mqtt.flush(now_ns=2 * MS) == 1
+
+    # An excursion that returns within the deadband before the flush is not sent
+    mqtt.collect({'TEMP': 25.0})
+    mqtt.collect({'TEMP': 20.8})
+    assert mqtt.flush(now_ns=3 * MS) == 0
+
+    # Booleans ignore the deadband
+    mqtt.collect({'RUN': False})
+    assert mqtt.flush(now_ns=4 * MS) == 1
+    assert values(client) == [{'TEMP': 20.0, 'RUN': True}, {'TEMP': 20.6}, {'RUN': False}]
+
+
+def test_min_interval_coalesces_changes():
+    mqtt, client = publisher([{"topic": "motor", "prefixes": ["MOTOR_"], "min_interval_ms": 500},
+                              {"topic": "fast", "tags": ["LEVEL"]}])
+
+    mqtt.collect({'MOTOR_RUN': True, 'LEVEL': 1})
+    assert mqtt.flush(now_ns=1000 * MS) == 2
+    mqtt.collect({'MOTOR_SPEED': 10, 'LEVEL': 2})
+    mqtt.collect({'MOTOR_SPEED': 20, 'OTHER': 5})
+    assert mqtt.flush(now_ns=1100 * MS) == 1
+    assert mqtt.flush(now_ns=1499 * MS) == 0
+    assert mqtt.flush(now_ns=1500 * MS) == 1
+    assert values(client, 'motor') == [{'MOTOR_RUN': True}, {'MOTOR_SPEED': 20}]
+    assert values(client, 'fast') == [{'LEVEL': 1}, {'LEVEL': 2}]
+
+    # force (used on stop) ignores the rate limit
+    mqtt.collect({'MOTOR_RUN': False})
+    assert mqtt.flush(now_ns=1501 * MS, force=True) == 1
+
+
+def test_max_batch_splits_messages():
+    mqtt, client = publisher([{"topic": "all"}], max_batch=2)
+
+    changes = {f'T{k}': k for k in range(5)}
+    mqtt.collect(changes)
+    assert mqtt.flush(now_ns=0, cycle=7) == 3
+    batches = values(client)
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert {tag: value for batch in batches for tag, value in batch.items()} == changes
+    assert all(json.loads(payload)['cycle'] == 7 for _, payload, _, _ in client.messages)
+
+
+def test_offline_buffer_drains_in_order():
+    mqtt, client = publisher([{"topic": "level", "tags": ["LEVEL"]}], offline_buffer=3)
+
+    client.connected = False
+    for level in range(1, 5):
+        mqtt.collect({'LEVEL': level})
+        mqtt.flush(now_ns=level * MS)
+    assert client.messages == []
+    # Oldest message dropped when the buffer is full
+    assert mqtt.dropped == 1
+    assert len(mqtt.offline) == 3
+
+    client.connected = True
+    assert mqtt.flush(now_ns=5 * MS) == 0
+    assert values(client) == [{'LEVEL': 2}, {'LEVEL': 3}, {'LEVEL': 4}]
+    assert not mqtt.offline
+
+    mqtt.collect({'LEVEL': 5})
+    assert mqtt.flush(now_ns=6 * MS) == 1
+    assert values(client)[-1] == {'LEVEL': 5}
+    assert mqtt.published == 4
+
+
+def test_messages_queue_behind_the_offline_buffer():
+    mqtt, client = publisher([{"topic": "level", "tags": ["LEVEL"]}])
+
+    client.connected = False
+    mqtt.collect({'LEVEL': 1})
+    mqtt.flush(now_ns=0)
+    client.connected = True
+    mqtt.collect({'LEVEL': 2})
+    mqtt.flush(now_ns=1 * MS)
+    assert values(client) == [{'LEVEL': 1}, {'LEVEL': 2}]
+
+
+def test_binary_round_trip():
+    mqtt, client = publisher([{"topic": "plant"}], format='binary')
+
+    mqtt.collect({'RUN': True, 'COUNT': -5, 'TEMP': 21.25})
+    mqtt.flush(now_ns=0, cycle=3)
+    mqtt.collect({'COUNT': 6, 'NEW': False})
+    mqtt.flush(now_ns=1 * MS, cycle=4)
+
+    schemas = [(payload, retain) for topic, payload, _, retain in client.messages
+               if topic == 'plant/schema']
+    payloads = [payload for topic, payload, _, _ in client.messages if topic == 'plant']
+    assert len(schemas) == 2 and all(retain for _, retain in schemas)
+    # Tag numbers are stable: the schema only grows
+    first, second = (json.loads(payload) for payload, _ in schemas)
+    assert second[:len(first)] == first
+
+    decoded = [decode_binary(payload, second) for payload in payloads]
+    assert [message['cycle'] for message in decoded] == [3, 4]
+    assert decoded[0]['values'] == {'RUN': True, 'COUNT': -5, 'TEMP': 21.25}
+    assert decoded[1]['values'] == {'COUNT': 6, 'NEW': False}
+    assert isinstance(decoded[1]['values']['NEW'], bool)
+    # Each schema message precedes the payload that needs it
+    topics = [topic for topic, _, _, _ in client.messages]
+    assert topics == ['plant/schema', 'plant', 'plant/schema', 'plant']
@@ -0,0 +1,148 @@
+"""
+Online edit tests on a PLCRuntime stepped through simulated time: state
+carries over, changed presets apply at the swap, invalid programs are
+rejected and rollback restores the replaced program.
+"""
+
+import copy
+import json
+import threading
+
+import pytest
+
+from .runtime import LadderProgram, PLCRuntime
+from .scheduler import VirtualClock
+from .simulation import Simulation
+
+PROGRAM = {
+    "scan_time_ms": 10,
+    "rungs": [
+        {"rung_id": 0, "instructions": [{"type": "XIC", "tag": "RUN"},
+                                        {"type": "TON", "tag": "T1", "preset": 1000}]},
+        {"rung_id": 1, "instructions": [{"type": "XIC", "tag": "PULSE"},
+                                        {"type": "CTU", "tag": "C1", "preset": 10}]},
+        {"rung_id": 2, "instructions": [{"type": "XIC", "tag": "T1.DN"},
+                                        {"type": "OTE", "tag": "LAMP"}]},
+    ],
+}
+
+
+def edited(**presets):
+    """PROGRAM with new presets and an extra rung"""
+    program = copy.deepcopy(PROGRAM)
+    for rung in program["rungs"]:
+        for instruction in rung["instructions"]:
+            instruction["preset"] = presets.get(instruction["tag"], instruction.get("preset"))
+    program["rungs"].append({"rung_id": 3, "instructions": [{"type": "XIC", "tag": "C1.DN"},
+                                                            {"type": "OTE", "tag": "ALARM"}]})
+    return program
+
+
+@pytest.fixture(params=[LadderProgram.COMPILED, LadderProgram.INTERPRETED,
+                        LadderProgram.INCREMENTAL, LadderProgram.PARALLEL])
+def sim(request, program_file):
+    runtime = PLCRuntime(mode=request.param, workers=2, clock=VirtualClock())
+    runtime.load_program(program_file(PROGRAM, 'v1.json'), use_cache=False)
+    sim = Simulation(runtime)
+    yield sim
+    runtime.close()
+
+
+def run(sim, ms, pulses=0):
+    """Advance `ms` with RUN on, pulsing PULSE `pulses` times first"""
+    sim.tags.set('RUN', True)
+    for _ in range(pulses):
+        sim.tags.set('PULSE', True)
+        sim.step()
+        sim.tags.set('PULSE', False)
+        sim.step()
+    sim.advance(ms)
+
+
+def test_state_carries_over(sim, program_file):
+    run(sim, 200, pulses=2)
+    acc = sim.tags.get('T1.ACC')
+    assert 200 <= acc < 1000 and sim.tags.get('C1.ACC') == 2
+
+    diff = sim.runtime.load_online(program_file(edited(), 'v2.json'))
+    assert diff.added_rungs == [3] and not diff.changed_presets
+    assert sim.tags.get('T1.ACC') == acc and sim.tags.get('C1.ACC') == 2
+
+    run(sim, 100, pulses=1)
+    assert sim.tags.get('T1.ACC') >= acc + 100
+    assert sim.tags.get('C1.ACC') == 3 and not sim.tags.get('ALARM')
+
+
+def test_changed_presets_apply_at_the_swap(sim, program_file):
+    run(sim, 200, pulses=3)
+    assert not sim.tags.get('T1.DN') and not sim.tags.get('C1.DN')
+
+    diff = sim.runtime.load_online(program_file(edited(T1=250, C1=3), 'v2.json'))
+    assert diff.changed_presets == {'C1.PRE': (10, 3), 'T1.PRE': (1000, 250)}
+    assert sim.tags.get('T1.PRE') == 250 and sim.tags.get('C1.PRE') == 3
+
+    sim.step()
+    # The counter was already at the new preset; the timer passes it within 50ms
+    assert sim.tags.get('C1.DN') and sim.tags.get('ALARM')
+    run(sim, 60)
+    assert sim.tags.get('T1.DN') and sim.tags.get('LAMP')
+    assert sim.tags.get('T1.ACC') == 250
+
+
+@pytest.mark.parametrize('change', ['unknown_type', 'duplicate_rung', 'type_conflict', 'malformed'])
+def test_invalid_program_is_rejected(sim, program_file, change):
+    run(sim, 100)
+    program = edited(T1=50)
+    if change == 'unknown_type':
+        program["rungs"][3]["instructions"][1]["type"] = "OTX"
+    elif change == 'duplicate_rung':
+        program["rungs"][3]["rung_id"] = 1
+    elif change == 'type_conflict':
+        program["tags"] = {"LAMP": "DINT"}
+    else:
+        del program["rungs"][3]["instructions"][0]["tag"]
+    running = sim.runtime.program
+
+    with pytest.raises(ValueError):
+        sim.runtime.load_online(program_file(program, 'bad.json'))
+    assert sim.runtime.program is running and sim.runtime.previous_program is None
+    assert sim.tags.get('T1.PRE') == 1000
+    run(sim, 100)
+    assert 200 <= sim.tags.get('T1.ACC') < 1000 and not sim.tags.get('T1.DN')
+    assert 'ALARM' not in sim.tags.slots or not sim.tags.get('ALARM')
+
+
+def test_rollback_restores_the_old_program(sim, program_file):
+    run(sim, 100, pulses=1)
+    original = sim.runtime.program
+    sim.runtime.load_online(program_file(edited(T1=5000), 'v2.json'))
+    run(sim, 100, pulses=1)
+    acc = sim.tags.get('T1.ACC')
+
+    diff = sim.runtime.rollback()
+    assert sim.runtime.program is original
+    assert diff.removed_rungs == [3] and diff.changed_presets == {'T1.PRE': (5000, 1000)}
+    assert sim.tags.get('T1.PRE') == 1000
+    assert sim.tags.get('T1.ACC') == acc and sim.tags.get('C1.ACC') == 2
+
+    run(sim, 1000)
+    assert sim.tags.get('T1.DN') and sim.tags.get('LAMP')
+
+
+def test_edit_applied_by_the_scan_thread(program_file):
+    runtime = PLCRuntime(clock=VirtualClock())
+    runtime.load_program(program_file(PROGRAM, 'v1.json'), use_cache=False)
+    runtime.program.tags.set('RUN', True)
+    runtime.start()
+    scan_thread = threading.Thread(target=runtime.run)
+    scan_thread.start()
+    try:
+        original = runtime.program
+        diff = runtime.load_online(program_file(edited(T1=20), 'v2.json'))
+        assert diff.changed_presets == {'T1.PRE': (1000, 20)}
+        assert runtime.program is not original and runtime.previous_program is original
+        assert runtime.program.tags.get('T1.PRE') == 20
+    finally:
+        runtime.stop()
+        scan_thread.join(timeout=5)
+    assert not scan_thread.is_alive()
@@ -0,0 +1,39 @@
+"""
+Parallel scan tests: partitions on forked workers must leave the same tag
+image as compiled mode after every scan, and close() must stop them.
+"""
+
+import multiprocessing
+
+import pytest
+
+from .conftest import generate_program, input_values, run_modes
+from .runtime import LadderProgram
+
+SECTIONS = 4
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_parallel_matches_compiled(seed, program_file):
+    path = program_file(generate_program(seed, rungs=15, sections=SECTIONS))
+    steps = input_values(seed, 120, sections=SECTIONS)
+    images = run_modes(path, (LadderProgram.COMPILED, LadderProgram.PARALLEL), steps,
+                       workers=SECTIONS)
+    for scan, (expected, image) in enumerate(zip(images[LadderProgram.COMPILED],
+                                                 images[LadderProgram.PARALLEL])):
+        assert image == expected, f"parallel differs from compiled after scan {scan}"
+
+
+def test_close_stops_the_workers(program_file):
+    path = program_file(generate_program(0, rungs=15, sections=SECTIONS))
+    program = LadderProgram(LadderProgram.PARALLEL, SECTIONS)
+    program.load_from_json(path, use_cache=False)
+    workers = program.parallel.processes
+    assert len(workers) == SECTIONS - 1
+    program.execute_scan()
+
+    program.close()
+    assert not any(process.is_alive() for process in workers)
+    assert multiprocessing.active_children() == []
+    # A second close() is harmless
+    program.close()
@@ -0,0 +1,141 @@
+"""
+Retentive store tests: values saved by one session are restored by the
+next, a damaged buffer falls back to the other one, a new layout is
+saved, and close() writes values held back by min_interval_ms.
+"""
+
+import os
+
+import pytest
+
+from .retentive import HEADER_SIZE, RetentiveStore
+from .runtime import LadderProgram
+
+PROGRAM = {
+    "tags": {"TOTAL": "REAL"},
+    "retentive": ["C1", "LATCH", "TOTAL"],
+    "rungs": [
+        {"rung_id": 0, "instructions": [{"type": "XIC", "tag": "PULSE"},
+                                        {"type": "CTU", "tag": "C1", "preset": 100}]},
+        {"rung_id": 1, "instructions": [{"type": "XIC", "tag": "SET"},
+                                        {"type": "OTL", "tag": "LATCH"}]},
+        {"rung_id": 2, "instructions": [{"type": "XIC", "tag": "PULSE"},
+                                        {"type": "ADD", "source_a": "TOTAL", "source_b": 0.5,
+                                         "dest": "TOTAL"}]},
+    ],
+}
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / 'retain.bin')
+
+
+def start(json_file, store_path, min_interval_ms=0):
+    """A program with its retentive tags restored (a PLC restart)"""
+    program = LadderProgram()
+    program.load_from_json(json_file, use_cache=False)
+    store = RetentiveStore(store_path, min_interval_ms)
+    store.bind(program)
+    return program, store
+
+
+def pulse(program, store, count=1, **inputs):
+    for tag_name, value in inputs.items():
+        program.tags.set(tag_name, value)
+    for _ in range(count):
+        for level in (True, False):
+            program.tags.set('PULSE', level)
+            program.execute_scan()
+            store.update(program.tags.publish())
+
+
+def values(program):
+    return {tag_name: program.tags.get(tag_name) for tag_name in ('C1.ACC', 'LATCH', 'TOTAL')}
+
+
+def test_restore_after_restart(program_file, store_path):
+    json_file = program_file(PROGRAM)
+    program, store = start(json_file, store_path)
+    pulse(program, store, 3, SET=True)
+    store.close()
+
+    program, store = start(json_file, store_path)
+    assert values(program) == {'C1.ACC': 3, 'LATCH': True, 'TOTAL': 1.5}
+    # Inputs and the preset are not retentive
+    assert program.tags.get('SET') is False and program.tags.get('C1.PRE') == 100
+    pulse(program, store)
+    store.close()
+
+    program, store = start(json_file, store_path)
+    assert values(program) == {'C1.ACC': 4, 'LATCH': True, 'TOTAL': 2.0}
+    store.close()
+
+
+@pytest.mark.parametrize('damaged, expected', [(0, 4), (1, 3)])
+def test_damaged_buffer_falls_back_to_the_other(program_file, store_path, damaged, expected):
+    json_file = program_file(PROGRAM)
+    # Two sessions: buffer 0 holds C1.ACC == 3, buffer 1 (newer) C1.ACC == 4
+    program, store = start(json_file, store_path)
+    pulse(program, store, 3)
+    store.close()
+    program, store = start(json_file, store_path)
+    pulse(program, store)
+    store.close()
+
+    buffer_size = os.path.getsize(store_path) // 2
+    with open(store_path, 'r+b') as f:
+        f.seek(damaged * buffer_size + HEADER_SIZE)
+        value = f.read(1)
+        f.seek(damaged * buffer_size + HEADER_SIZE)
+        f.write(bytes([value[0] ^ 0xFF]))
+
+    program, store = start(json_file, store_path)
+    assert program.tags.get('C1.ACC') == expected
+    store.close()
+
+
+def test_changed_layout(program_file, store_path):
+    program, store = start(program_file(PROGRAM), store_path)
+    pulse(program, store, 2, SET=True)
+    store.close()
+    size, inode = os.path.getsize(store_path), os.stat(store_path).st_ino
+
+    # Fewer retentive tags: rewritten in place
+    smaller = dict(PROGRAM, retentive=["C1", "TOTAL"])
+    program, store = start(program_file(smaller, 'smaller.json'), store_path)
+    assert values(program) == {'C1.ACC': 2, 'LATCH': False, 'TOTAL': 1.0}
+    pulse(program, store)
+    store.close()
+    assert os.path.getsize(store_path) == size
+
+    # A layout that does not fit the buffers: the file is recreated larger
+    larger = dict(PROGRAM, retentive=["C1", "LOG"],
+                  tags={"TOTAL": "REAL", "LOG": {"type": "DINT", "length": 1000}})
+    program, store = start(program_file(larger, 'larger.json'), store_path)
+    assert program.tags.get('C1.ACC') == 3
+    program.tags.set('LOG[999]', 42)
+    pulse(program, store)
+    store.close()
+    assert os.path.getsize(store_path) > size
+    assert os.stat(store_path).st_ino != inode
+
+    program, store = start(program_file(larger, 'larger.json'), store_path)
+    assert program.tags.get('C1.ACC') == 4 and program.tags.get('LOG[999]') == 42
+    assert program.tags.get('TOTAL') == 0.0
+    store.close()
+
+
+def test_close_saves_values_held_back_by_min_interval(program_file, store_path):
+    json_file = program_file(PROGRAM)
+    program, store = start(json_file, store_path, min_interval_ms=60_000)
+    pulse(program, store)
+    # Written at once; the next changes wait for the interval
+    pulse(program, store, 4)
+    assert store.dirty
+    store.close()
+    assert store.writes == 2
+
+    program, store = start(json_file, store_path)
+    assert program.tags.get('C1.ACC') == 5
+    store.close()
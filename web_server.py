@@ -0,0 +1,130 @@
+"""
+Web Server
+Minimal HTTP interface for HMI screens (Flask, optional).
+
+    GET /api/tags                  all tag values of the last scan (JSON)
+    GET /api/stream?tags=A,B&prefix=MOTOR_&policy=coalesce
+                                   server-sent events, one per scan with changes:
+                                       id: <cycle>
+                                       data: {"MOTOR_RUN": true, ...}
+
+With a runtime (online program edit, see online_edit.py):
+
+    GET  /api/program              the running program
+    POST /api/program              {"file": "program.json"}: load, validate and
+                                   swap in a new program between two scans;
+                                   returns the diff to the replaced program
+    POST /api/program/rollback     swap back to the replaced program
+
+The first event of a stream holds the current value of every subscribed
+tag. Each stream is a tag subscription (subscriptions.py); the scan
+loop only diffs each published image once, however many clients are
+connected, and slow clients are coalesced instead of holding up scans.
+"""
+
+import json
+import logging
+import threading
+
+from .subscriptions import Subscription, subscribe, unsubscribe
+
+logger = logging.getLogger(__name__)
+
+# Optional web framework
+try:
+    from flask import Flask, Response, jsonify, request
+    FLASK_AVAILABLE = True
+except ImportError:
+    FLASK_AVAILABLE = False
+
+try:
+    from flask_cors import CORS
+    CORS_AVAILABLE = True
+except ImportError:
+    CORS_AVAILABLE = False
+
+KEEPALIVE_S = 15
+
+
+def create_app(tags, runtime=None):
+    """Flask application serving a TagDatabase (and program edits of `runtime`)"""
+    if not FLASK_AVAILABLE:
+        raise RuntimeError("Flask is not available (pip install flask)")
+
+    app = Flask(__name__)
+    if CORS_AVAILABLE:
+        CORS(app)
+
+    @app.route('/api/tags')
+    def get_tags():
+        return jsonify(tags.snapshot().get_all())
+
+    @app.route('/api/stream')
+    def stream():
+        names = [name for name in request.args.get('tags', '').split(',') if name]
+        prefixes = [prefix for prefix in request.args.getlist('prefix') if prefix]
+        policy = request.args.get('policy', Subscription.COALESCE)
+        try:
+            subscription = subscribe(tags, names, prefixes, policy=policy)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        def events():
+            try:
+                while True:
+                    delta = subscription.get(timeout=KEEPALIVE_S)
+                    if delta is None:
+                        if subscription.closed:
+                            break
+                        yield ': keepalive\n\n'
+                        continue
+                    cycle, changes = delta
+                    yield f"id: {cycle}\ndata: {json.dumps(changes)}\n\n"
+            finally:
+                # Client disconnected
+                unsubscribe(tags, subscription)
+
+        return Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    if runtime is not None:
+        def edit(action, *args):
+            try:
+                return jsonify(action(*args).to_dict())
+            except (ValueError, OSError) as e:
+                return jsonify({'error': str(e)}), 400
+            except TimeoutError as e:
+                return jsonify({'error': str(e)}), 503
+
+        @app.route('/api/program')
+        def get_program():
+            program = runtime.program
+            return jsonify({'name': program.program_data.get('program_name'),
+                            'file': program.source_file,
+                            'rungs': len(program.rungs),
+                            'scan_time_ms': runtime.scan_time_ms,
+                            'rollback': runtime.previous_program is not None})
+
+        @app.route('/api/program', methods=['POST'])
+        def load_program():
+            json_file = (request.get_json(silent=True) or {}).get('file')
+            if not json_file:
+                return jsonify({'error': 'Request body must be {"file": "<program.json>"}'}), 400
+            return edit(runtime.load_online, json_file)
+
+        @app.route('/api/program/rollback', methods=['POST'])
+        def rollback_program():
+            return edit(runtime.rollback)
+
+    return app
+
+
+def start_web_server(tags, host: str = '0.0.0.0', port: int = 8080, runtime=None):
+    """Serve create_app(tags, runtime) from a background thread; returns the server"""
+    from werkzeug.serving import make_server
+
+    server = make_server(host, port, create_app(tags, runtime), threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name='web-server', daemon=True)
+    thread.start()
+    logger.info(f"Web server listening on http://{host}:{port}")
+    return server